@@ -24,20 +24,26 @@ def create_api(app):
         '/api/accounts/<int:account_id>'
         )
 
-    # manage transfers
-    # api.add_resource(resources.TransferResource,
-    #     '/api/users/<int:user_id>/transfers',
-    #     '/api/transfers/<int:transfer_id>',
-    #     '/api/accounts/<int:account_id>/transfers'
-    #     )
-    #
-    # # manage transactions
-    # api.add_resource(resources.TransactionResource,
-    #     '/api/users/<int:user_id>/incomes',
-    #     '/api/users/<int:user_id>/expenses',
-    #     '/api/users/<int:user_id>/transactions',
-    #     '/api/transactions/<int:transaction_id>'
-    #     )
+    # point in time balances
+    api.add_resource(resources.AccountBalanceResource, '/api/accounts/<int:account_id>/balances')
+
+    # monthly totals out of the transaction rollups
+    api.add_resource(resources.DashboardResource, '/api/dashboard')
+
+    # bank statement imports
+    api.add_resource(resources.StatementImportResource, '/api/accounts/<int:account_id>/imports')
+
+    # transfers of an account
+    api.add_resource(resources.TransferResource, '/api/accounts/<int:account_id>/transfers')
+
+    # transactions with their account, category and tags
+    api.add_resource(resources.TransactionResource,
+        '/api/transactions',
+        '/api/users/<int:user_id>/transactions'
+        )
+
+    # many operations in one request
+    api.add_resource(resources.BatchResource, '/api/batch')
 
     api.add_resource(resources.HealthcheckResource,
                      '/api/healthcheck',
@@ -0,0 +1,101 @@
+"""
+In-process dispatch of batched sub-requests
+
+Sub-requests run inside the batch request app context, so they share its `g` (authentication already done
+by before_request) and its database session. before/after request hooks are not run for them: no new auth
+check, token signing or cookies per item.
+"""
+
+from flask import g
+
+from app import database
+
+db = database.AppRepository.db
+
+# request scoped values on `g` that belong to a single sub-request
+REQUEST_SCOPED = ('payload', 'payload_parses', 'etag')
+FAILED_DEPENDENCY = 424
+
+
+class InvalidBatch(Exception):
+    pass
+
+
+def validate(items, max_requests):
+    if not isinstance(items, list) or not items:
+        raise InvalidBatch('requests must be a non empty list')
+    if len(items) > max_requests:
+        raise InvalidBatch('a batch accepts at most {} requests'.format(max_requests))
+    for item in items:
+        if not isinstance(item, dict) or not item.get('path', '').startswith('/api/'):
+            raise InvalidBatch('every request needs an /api/ path')
+        if item['path'].split('?')[0].rstrip('/') == '/api/batch':
+            raise InvalidBatch('batches can not be nested')
+
+
+def dispatch(app, item):
+    """
+    Runs one item with its own request scoped values on `g`; the ones of the batch request are restored after it
+    """
+    outer = {key: g.pop(key) for key in REQUEST_SCOPED if key in g}
+    context = app.test_request_context(item['path'], method=item.get('method', 'GET').upper(),
+                                       json=item.get('body'), headers=item.get('headers'))
+    # pushed and popped by hand: `with` keeps the context pushed on errors when PRESERVE_CONTEXT_ON_EXCEPTION
+    context.push()
+    try:
+        try:
+            response = app.make_response(app.dispatch_request())
+        except Exception as ex:
+            response = app.make_response(app.handle_user_exception(ex))
+    finally:
+        context.pop()
+        for key in REQUEST_SCOPED:
+            g.pop(key, None)
+        for key, value in outer.items():
+            setattr(g, key, value)
+    body = response.get_data(as_text=True)
+    return {'status': response.status_code, 'body': response.get_json(silent=True) if body else None}
+
+
+def failed(result):
+    return result['status'] >= 400
+
+
+def outcome(results, committed):
+    """
+    success: every item succeeded; partial: the failed items were rolled back and the others kept;
+    rolled-back: nothing was kept
+    """
+    if not committed:
+        return 'rolled-back'
+    return 'partial' if any(failed(result) for result in results) else 'success'
+
+
+def run(app, items, atomic=False):
+    """
+    Runs the items in order and returns (results, committed), committed being False when no item was kept.
+    Atomic batches stop at the first failure and roll everything back; the other ones run every item
+    inside its own savepoint and only roll back the failed ones.
+    """
+    results = []
+    for index, item in enumerate(items):
+        if atomic:
+            result = dispatch(app, item)
+        else:
+            savepoint = db.session.begin_nested()
+            result = None
+            try:
+                result = dispatch(app, item)
+            finally:
+                # failed items, and items whose exception escapes, never keep their writes
+                if savepoint.is_active:
+                    if result is not None and not failed(result):
+                        savepoint.commit()
+                    else:
+                        savepoint.rollback()
+        results.append(result)
+        if atomic and failed(result):
+            db.session.rollback()
+            results.extend({'status': FAILED_DEPENDENCY, 'body': None} for _ in items[index + 1:])
+            return results, False
+    return results, not all(failed(result) for result in results)
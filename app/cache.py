@@ -0,0 +1,241 @@
+"""
+Caches used to avoid repeating database work between requests: in-process (TTLCache, optionally
+invalidated across workers through redis) and shared between workers through redis (CollectionCache)
+"""
+
+import hashlib
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+STORE_ERRORS = (redis.RedisError,) if redis is not None else ()
+
+
+class TTLCache(object):
+    """
+    Bounded LRU cache whose entries expire after a time to live (in seconds).
+    With a shared `store`, each entry also remembers the version of its key in the store when it was cached:
+    invalidate INCRs that version, so the copies cached by the other workers are dropped on their next get.
+    A failing store is counted in the stats and its entries are treated as missing.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, store=None, prefix='ttl'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def version_key(self, key):
+        return '{}:version:{}'.format(self.prefix, key)
+
+    def version(self, key):
+        """
+        Version of `key` in the shared store: 0 without store, None if the store failed
+        """
+        if self.store is None:
+            return 0
+        try:
+            return int(self.store.get(self.version_key(key)) or 0)
+        except STORE_ERRORS:
+            self.errors += 1
+            return None
+
+    def get(self, key, default=None):
+        version = self.version(key)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and (item[1] < time.time() or item[2] != version):
+                del self._items[key]
+                item = None
+            if item is None or version is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl=None, version=None):
+        """
+        Caches `value` under the shared `version` of the key read before it was loaded (default: the current one)
+        """
+        if self.max_size <= 0:
+            return
+        version = self.version(key) if version is None else version
+        if version is None:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._items[key] = (value, expires_at, version)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+        if self.store is not None:
+            try:
+                self.store.incr(self.version_key(key))
+            except STORE_ERRORS:
+                self.errors += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+            self.errors = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'shared': self.store is not None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+        }
+
+
+class MemoryStore(object):
+    """
+    In-process stand-in for the part of the redis client used by CollectionCache (REDIS_URL=memory://)
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._items.get(key, (None, None))
+            if expires_at is not None and expires_at < time.time():
+                del self._items[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._items[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value, expires_at = self._items.get(key, (0, None))
+            value = int(value) + amount
+            self._items[key] = (value, expires_at)
+            return value
+
+    def delete(self, *keys):
+        with self._lock:
+            return len([self._items.pop(key) for key in keys if key in self._items])
+
+    def flushdb(self):
+        with self._lock:
+            self._items.clear()
+        return True
+
+
+def connect(url, socket_timeout=None):
+    """
+    Store for a CollectionCache: None (caching off) without url, a MemoryStore for memory://, a redis client otherwise
+    """
+    if not url:
+        return None
+    if url == 'memory://':
+        return MemoryStore()
+    if redis is None:
+        raise RuntimeError('The redis package is required for {}'.format(url))
+    return redis.StrictRedis.from_url(url, socket_timeout=socket_timeout, socket_connect_timeout=socket_timeout)
+
+
+class CollectionCache(object):
+    """
+    Read-through cache of per owner (user) query results in a store shared by every worker.
+    Keys embed the owner version, so invalidating an owner is a single INCR and its stale entries just expire.
+    A failing store is counted in the stats and bypassed: the query then runs against the database.
+    """
+
+    def __init__(self, store=None, ttl=300, prefix='collections'):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.store is not None
+
+    def version_key(self, owner):
+        return '{}:version:{}'.format(self.prefix, owner)
+
+    def key(self, owner, version, shape):
+        digest = hashlib.sha1(repr(shape).encode('utf-8')).hexdigest()
+        return '{}:{}:{}:{}'.format(self.prefix, owner, version, digest)
+
+    def get_or_load(self, owner, shape, loader):
+        """
+        Cached result of the query described by `shape` for `owner`, calling `loader` on a miss
+        """
+        if self.store is None:
+            return loader()
+        started = time.time()
+        try:
+            key = self.key(owner, int(self.store.get(self.version_key(owner)) or 0), shape)
+            cached = self.store.get(key)
+        except STORE_ERRORS:
+            self.errors += 1
+            return loader()
+        if cached is not None:
+            self.hits += 1
+            value = pickle.loads(cached)
+            self.hit_seconds += time.time() - started
+            return value
+        value = loader()
+        self.misses += 1
+        self.miss_seconds += time.time() - started
+        try:
+            self.store.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=self.ttl)
+        except STORE_ERRORS:
+            self.errors += 1
+        return value
+
+    def invalidate(self, owner):
+        if self.store is None:
+            return
+        try:
+            self.store.incr(self.version_key(owner))
+        except STORE_ERRORS:
+            self.errors += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            'hit_ms': self.hit_seconds / self.hits * 1000 if self.hits else 0.0,
+            'miss_ms': self.miss_seconds / self.misses * 1000 if self.misses else 0.0
+        }
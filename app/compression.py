@@ -0,0 +1,95 @@
+"""
+Response compression for JSON payloads, negotiated on Accept-Encoding
+
+gzip is always available. brotli is used when the optional `brotli` package is installed and the client prefers it.
+Streamed responses are compressed chunk by chunk instead of being buffered.
+"""
+
+import gzip
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# streamed responses are flushed at least every STREAM_FLUSH_BYTES of input, so rows keep reaching the client
+STREAM_FLUSH_BYTES = 64 * 1024
+
+
+def choose_encoding(accept_encoding):
+    accepted = parse_accept_header(accept_encoding)
+    if brotli is not None and accepted['br'] and accepted['br'] >= accepted['gzip']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level=6, brotli_quality=4):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=level)
+
+
+class StreamCompressor(object):
+    def __init__(self, encoding, level=6, brotli_quality=4):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def iter_compressed(chunks, encoding, level=6, brotli_quality=4):
+    compressor = StreamCompressor(encoding, level, brotli_quality)
+    pending = 0
+    for chunk in chunks:
+        output = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= STREAM_FLUSH_BYTES:
+            output += compressor.flush()
+            pending = 0
+        if output:
+            yield output
+    yield compressor.finish()
+
+
+def compress_response(response, accept_encoding, level=6, brotli_quality=4, min_size=1024):
+    if response.status_code != 200 or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    encoding = choose_encoding(accept_encoding or '')
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = iter_compressed(response.iter_encoded(), encoding, level, brotli_quality)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress(data, encoding, level, brotli_quality))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -27,6 +27,45 @@ class Config(object):
         self.API_TOKEN = os.environ['API_TOKEN']
         self.SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
         self.SECRET_KEY = os.environ['SECRET_KEY']
+        self.IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 4096))
+        self.IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 300))
+        # without REDIS_URL an update is only seen by the worker that made it: the others keep the old
+        # name/email until their copy expires
+        self.IDENTITY_CACHE_LOCAL_TTL = int(os.environ.get('IDENTITY_CACHE_LOCAL_TTL', 15))
+        self.TOKEN_EXPIRATION = int(os.environ.get('TOKEN_EXPIRATION', 600))
+        self.TOKEN_REFRESH_WINDOW = float(os.environ.get('TOKEN_REFRESH_WINDOW', 0.5))
+        self.PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+        self.PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', 4))
+        self.PASSWORD_HASH_ROUNDS = int(os.environ.get('PASSWORD_HASH_ROUNDS', 0)) or None
+        self.PASSWORD_HASH_TIMEOUT = int(os.environ.get('PASSWORD_HASH_TIMEOUT', 30))
+        self.PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 25))
+        self.MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+        self.STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 1000))
+        self.COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+        self.COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+        self.BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+        self.BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 50))
+        self.BULK_INSERT_BATCH_SIZE = int(os.environ.get('BULK_INSERT_BATCH_SIZE', 1000))
+        self.IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 50000))
+        self.TRANSACTION_PARTITIONS_AHEAD = int(os.environ.get('TRANSACTION_PARTITIONS_AHEAD', 3))
+        self.REDIS_URL = os.environ.get('REDIS_URL', '')
+        self.REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 0.1))
+        self.COLLECTION_CACHE_TTL = int(os.environ.get('COLLECTION_CACHE_TTL', 300))
+        # comma separated read replica urls, served as the replica_N binds
+        replica_urls = [url.strip() for url in os.environ.get('REPLICA_DATABASE_URLS', '').split(',') if url.strip()]
+        self.REPLICA_BINDS = ['replica_{}'.format(index) for index in range(len(replica_urls))]
+        self.SQLALCHEMY_BINDS = dict(zip(self.REPLICA_BINDS, replica_urls))
+        self.REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+        self.REPLICA_LAG_CHECK_INTERVAL = int(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 5))
+        self.READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
+        # per worker process. Greenlets spend most of a request outside the database, so by default the
+        # pool holds a tenth of the worker's connections (gunicorn worker_connections) plus as much overflow
+        self.WORKER_CONNECTIONS = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+        self.DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0)) or max(5, self.WORKER_CONNECTIONS // 10)
+        self.DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', self.DB_POOL_SIZE))
+        self.DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+        self.DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+        self.DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true')
 
 
 class ProductionConfig(Config):
@@ -1,4 +1,273 @@
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
 from sqlalchemy_utils.types import choice
 
+try:
+    import psycopg2
+    from psycopg2 import extensions as psycopg_extensions
+except ImportError:
+    psycopg2 = psycopg_extensions = None
+
+try:
+    from gevent.socket import wait_read, wait_write
+except ImportError:
+    wait_read = wait_write = None
+
+logger = logging.getLogger(__name__)
+
+# unix time until which the client reads from the primary, set after its writes
+PRIMARY_READS_COOKIE = 'basePrimaryUntil'
+
+REPLICA_LAG_SQL = (
+    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
 class AppRepository(object):
     db = None
+
+
+class ReplicaRouter(object):
+    """
+    Round robin over the replica binds, skipping the ones lagging more than `max_lag` seconds behind the
+    primary. Lags are measured at most every `check_interval` seconds per process; a replica that cannot
+    be reached counts as lagging.
+    """
+
+    def __init__(self, binds, max_lag=5, check_interval=5):
+        self.binds = list(binds)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._cycle = itertools.cycle(self.binds)
+        self._lags = {}
+
+    def measure_lag(self, engine):
+        if engine.dialect.name != 'postgresql':
+            return 0.0
+        with engine.connect() as connection:
+            return float(connection.execute(REPLICA_LAG_SQL).scalar() or 0)
+
+    def lag(self, db, bind):
+        lag, checked_at = self._lags.get(bind, (None, 0))
+        if time.time() - checked_at >= self.check_interval:
+            try:
+                lag = self.measure_lag(db.get_engine(bind=bind))
+            except Exception as ex:
+                logger.warning('replica %s unavailable: %s', bind, ex)
+                lag = float('inf')
+            self._lags[bind] = (lag, time.time())
+        return lag
+
+    def choose(self, db):
+        """
+        Bind of the next replica in sync with the primary, None when there is none
+        """
+        for _ in range(len(self.binds)):
+            bind = next(self._cycle)
+            if self.lag(db, bind) <= self.max_lag:
+                return bind
+        return None
+
+    def stats(self):
+        return {bind: lag for bind, (lag, checked_at) in self._lags.items()}
+
+
+def gevent_wait_callback(connection, timeout=None):
+    """
+    psycopg2 wait callback yielding to the gevent hub while the connection waits on the server
+    """
+    while True:
+        state = connection.poll()
+        if state == psycopg_extensions.POLL_OK:
+            return
+        if state == psycopg_extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == psycopg_extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError('Bad result from poll: {!r}'.format(state))
+
+
+def make_psycopg_green():
+    """
+    Makes every psycopg2 connection of the process cooperative. Call it once per gevent worker, before any query.
+    """
+    if psycopg_extensions is None or wait_read is None:
+        raise RuntimeError('psycopg2 and gevent are required for the green database mode')
+    psycopg_extensions.set_wait_callback(gevent_wait_callback)
+
+
+def green_mode():
+    """
+    True once make_psycopg_green ran. COPY is not available in this mode.
+    """
+    return psycopg_extensions is not None and psycopg_extensions.get_wait_callback() is not None
+
+
+class MeasuredQueuePool(QueuePool):
+    """
+    QueuePool recording how long checkouts wait for a connection and how close it runs to its limit
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MeasuredQueuePool, self).__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.peak = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.time()
+        try:
+            connection = super(MeasuredQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        waited = time.time() - started
+        self.checkouts += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.peak = max(self.peak, self.checkedout())
+        return connection
+
+    def stats(self):
+        capacity = self.size() + max(self._max_overflow, 0)
+        return {
+            'size': self.size(),
+            'capacity': capacity,
+            'checked_out': self.checkedout(),
+            'peak': self.peak,
+            'saturation': float(self.checkedout()) / capacity if capacity else 0.0,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_ms': self.wait_seconds / self.checkouts * 1000 if self.checkouts else 0.0,
+            'max_wait_ms': self.max_wait_seconds * 1000
+        }
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session reading from a replica once `read_from_replicas` flagged it, unless it already wrote:
+    flushes and INSERT/UPDATE/DELETE statements always go to the primary and pin the session to it.
+    The replica is chosen on the first replica read and kept by the session, so all its reads see
+    the same replay point.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        elif self.info.get('read_replica') and not self.info.get('wrote'):
+            bind = self.replica_bind()
+            if bind is not None:
+                return self.app.extensions['sqlalchemy'].db.get_engine(bind=bind)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def replica_bind(self):
+        """
+        Replica of this session, None when no replica was in sync at its first read (it then reads the primary)
+        """
+        if 'replica' not in self.info:
+            db = self.app.extensions['sqlalchemy'].db
+            self.info['replica'] = db.router.choose(db) if db.router is not None else None
+        return self.info['replica']
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy whose sessions can send reads to the REPLICA_BINDS (see RoutingSession)
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.router = None
+        super(RoutingSQLAlchemy, self).__init__(app, **kwargs)
+
+    def init_app(self, app):
+        super(RoutingSQLAlchemy, self).init_app(app)
+        replica_binds = app.config.get('REPLICA_BINDS') or []
+        self.router = ReplicaRouter(replica_binds, max_lag=app.config.get('REPLICA_MAX_LAG', 5),
+                                    check_interval=app.config.get('REPLICA_LAG_CHECK_INTERVAL', 5)) \
+            if replica_binds else None
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        super(RoutingSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('sqlite'):
+            return
+        options.update({
+            'poolclass': MeasuredQueuePool,
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+            'pool_recycle': app.config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': app.config['DB_POOL_PRE_PING']
+        })
+
+    def pool_stats(self):
+        """
+        Stats of the primary and replica pools of this process (measured pools only)
+        """
+        stats = {}
+        for bind in [None] + (self.router.binds if self.router is not None else []):
+            pool = self.get_engine(bind=bind).pool
+            if isinstance(pool, MeasuredQueuePool):
+                stats[bind or 'primary'] = pool.stats()
+        return stats
+
+
+def read_from_replicas(enabled=True):
+    """
+    Lets the current session read from the replicas (it still goes to the primary once it writes)
+    """
+    AppRepository.db.session.info['read_replica'] = enabled
+
+
+@contextmanager
+def primary_reads():
+    """
+    Reads of the block go to the primary even in a session reading from the replicas
+    """
+    info = AppRepository.db.session.info
+    previous = info.get('read_replica', False)
+    info['read_replica'] = False
+    try:
+        yield
+    finally:
+        info['read_replica'] = previous
+
+
+def session_wrote():
+    return AppRepository.db.session.info.get('wrote', False)
+
+
+@contextmanager
+def count_queries(app=None):
+    """
+    Collects the statements run on the primary and replica engines inside the block
+    """
+    db = AppRepository.db
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    binds = [None] + (db.router.binds if db.router is not None else [])
+    engines = set(db.get_engine(app=app, bind=bind) for bind in binds)
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', record)
+
@@ -1,17 +1,68 @@
 import os
-from datetime import timedelta, datetime
+import time
+from datetime import timedelta, datetime, date
+from decimal import Decimal
 
 import jwt
-from passlib.apps import custom_app_context
+from dateutil import parser as date_parser, tz
+from sqlalchemy import types
 
 from app import config as config_module
-from app import models
+from app import models, hashing, serializers, importers, ledger, rollups
 
 config = config_module.get_config()
 
+identity_cache = models.identity_cache
+collection_cache = models.collection_cache
+
+password_hasher = hashing.PasswordHasher(
+    workers=config.PASSWORD_HASH_WORKERS,
+    concurrency=config.PASSWORD_HASH_CONCURRENCY,
+    rounds=config.PASSWORD_HASH_ROUNDS,
+    timeout=config.PASSWORD_HASH_TIMEOUT
+)
+
+
+class EntityRow(object):
+    """
+    Read only, row backed stand-in of an entity for list paths: no ORM instance, identity map entry or __dict__.
+    Its attributes are the columns of the row.
+    """
+    __slots__ = ('row',)
+
+    def __init__(self, row):
+        self.row = row
+
+    def __getattr__(self, name):
+        if name == 'row':
+            raise AttributeError(name)
+        return getattr(self.row, name)
+
+    @staticmethod
+    def plain(value):
+        if isinstance(value, Decimal):
+            # exact decimal string, like the compiled serializers
+            return str(value)
+        if isinstance(value, datetime):
+            return value.isoformat() + 'Z'
+        if isinstance(value, date):
+            return value.isoformat()
+        return value
+
+    def as_dict(self):
+        """
+        The selected columns, as plain json values. There is no compact form: pick the columns with `fields`.
+        """
+        return {key: self.plain(value) for key, value in zip(self.row.keys(), self.row)}
+
 
 class Entity(object):
     repository = None
+    # columns of the EntityRow list paths, declared by each entity
+    row_fields = ()
+    # columns a request payload may write, declared by each entity
+    writable_fields = ()
+    InvalidCursor = models.AbstractModel.InvalidCursor
 
     class AlreadyExist(Exception):
         pass
@@ -19,10 +70,79 @@ class Entity(object):
     class NotExist(Exception):
         pass
 
+    class InvalidEntityData(Exception):
+        pass
+
+    @staticmethod
+    def column_value(column, value):
+        """
+        JSON `value` as a value of `column`: exact decimals for amounts, naive UTC datetimes for dates
+        """
+        if value is None:
+            return None
+        if isinstance(column.type, types.Numeric):
+            return Decimal(str(value))
+        if isinstance(column.type, types.DateTime):
+            moment = date_parser.isoparse(value)
+            return moment.astimezone(tz.tzutc()).replace(tzinfo=None) if moment.tzinfo else moment
+        if isinstance(column.type, types.Boolean):
+            if not isinstance(value, bool):
+                raise ValueError('not a boolean')
+            return value
+        if isinstance(column.type, types.Integer):
+            if isinstance(value, bool) or int(value) != value:
+                raise ValueError('not an integer')
+            return int(value)
+        return str(value)
+
+    @classmethod
+    def writable_values(cls, json_data):
+        """
+        Column values of the `writable_fields` present in a request payload. Raises InvalidEntityData.
+        """
+        columns = cls.repository.__table__.columns
+        values = {}
+        for field in cls.writable_fields:
+            if field not in json_data:
+                continue
+            try:
+                values[field] = cls.column_value(columns[field], json_data[field])
+            except (TypeError, ValueError, ArithmeticError, OverflowError):
+                raise cls.InvalidEntityData('invalid {}'.format(field))
+        return values
+
     @classmethod
     def list_all(cls):
         return [cls.create_with_instance(instance) for instance in cls.repository.list_all()]
 
+    @classmethod
+    def list_page(cls, limit=None, cursor=None, fields=None, options=(), **kwargs):
+        instances, next_cursor = cls.repository.list_page(limit=limit, cursor=cursor, fields=fields, options=options,
+                                                          **kwargs)
+        return [cls.create_with_instance(instance) for instance in instances], next_cursor
+
+    @classmethod
+    def row_columns(cls, fields=None):
+        fields = fields or cls.row_fields
+        if not fields:
+            raise NotImplementedError('{} declares no row_fields'.format(cls.__name__))
+        return [getattr(cls.repository, field) for field in fields]
+
+    @classmethod
+    def list_all_rows(cls, fields=None):
+        """
+        Read only version of list_all: EntityRow over the `fields` columns (default: row_fields)
+        """
+        return [EntityRow(row) for row in cls.repository.list_rows(cls.row_columns(fields))]
+
+    @classmethod
+    def list_row_page(cls, fields=None, limit=None, cursor=None, **kwargs):
+        """
+        Read only version of list_page: a page of EntityRow and the cursor of the next one
+        """
+        rows, next_cursor = cls.repository.list_page(cls.row_columns(fields), limit=limit, cursor=cursor, **kwargs)
+        return [EntityRow(row) for row in rows], next_cursor
+
     @classmethod
     def create_new(cls, json_data):
         try:
@@ -31,6 +151,18 @@ class Entity(object):
             if 'already exists' in ex.message.lower:
                 raise cls.AlreadyExist('Entity with {} already exists in repository'.format(json_data))
 
+    @classmethod
+    def create_many(cls, json_list):
+        """
+        Bulk version of create_new. Returns the ids of the created rows instead of entities.
+        """
+        try:
+            return cls.repository.bulk_create_from_json(json_list)
+        except cls.repository.RepositoryError as ex:
+            if 'already exists' in str(ex).lower():
+                raise cls.AlreadyExist('Entity in {} already exists in repository'.format(json_list))
+            raise
+
     @classmethod
     def create_with_id(cls, entity_id):
         instance = cls.repository.get(entity_id)
@@ -68,8 +200,31 @@ class Entity(object):
         }
 
 
-class User(Entity):
+class AuthTokenMixin(object):
+    """
+    Token handling shared by the User entity and its lazy LoggedUser stand-in. Needs `id` and `token_expires_at`.
+    """
+
+    def generate_auth_token(self, expiration=None):
+        expiration = expiration or config.TOKEN_EXPIRATION
+        return jwt.encode({'id': self.id, 'exp': datetime.utcnow() + timedelta(minutes=expiration)}, config.SECRET_KEY, algorithm='HS256')
+
+    def refresh_auth_token(self):
+        """
+        Sliding refresh: a new token is only signed when the current one entered the last
+        TOKEN_REFRESH_WINDOW fraction of its lifetime. Returns None while the current token is still fresh.
+        """
+        if self.token_expires_at is not None:
+            remaining = self.token_expires_at - time.time()
+            if remaining > config.TOKEN_EXPIRATION * 60 * config.TOKEN_REFRESH_WINDOW:
+                return None
+        return self.generate_auth_token()
+
+
+class User(AuthTokenMixin, Entity):
     repository = models.User
+    identity_columns = ('id', 'email', 'name')
+    row_fields = ('id', 'name', 'email')
 
     class InvalidEntityData(Exception):
         pass
@@ -94,7 +249,25 @@ class User(Entity):
             return None
         if not data.get('id', None):
             return None
-        return cls.create_with_id(data['id'])
+        identity = identity_cache.get(data['id'])
+        user = None
+        if identity is None:
+            version = identity_cache.version(data['id'])
+            user = cls.create_with_id(data['id'])
+            identity = user.instance.snapshot(*cls.identity_columns)
+            identity_cache.set(user.id, identity, version=version)
+        return LoggedUser(identity, token_expires_at=data.get('exp'), entity=user)
+
+    @classmethod
+    def get_data_version(cls, user_id):
+        return cls.repository.get_data_version(user_id)
+
+    @classmethod
+    def get_dashboard(cls, user_id, first_month, last_month):
+        """
+        Monthly totals from first_month to last_month out of the transaction rollups, whatever the ledger size
+        """
+        return rollups.dashboard(user_id, first_month, last_month)
 
     @classmethod
     def create_with_logged(cls, logged_user):
@@ -114,7 +287,7 @@ class User(Entity):
     @classmethod
     def create_new(cls, json_data):
         password = json_data.pop('password')
-        password_hash = custom_app_context.encrypt(password)
+        password_hash = password_hasher.encrypt(password)
         json_data['password_hash'] = password_hash
         instance = super(User, cls).create_new(json_data)
         # error: "exception": "can't set attribute"
@@ -125,6 +298,7 @@ class User(Entity):
         self.temp_password = None
         self.entity_key = None
         self.resource_key = None
+        self.token_expires_at = None
 
     @property
     def email(self):
@@ -140,7 +314,11 @@ class User(Entity):
 
     @property
     def is_correct(self):
-        return custom_app_context.verify(self.temp_password, self.password_hash)
+        return password_hasher.verify(self.temp_password, self.password_hash)
+
+    def update_me(self, json_data):
+        super(User, self).update_me(json_data)
+        models.mark_identity_stale(self.id)
 
     def as_dict(self, compact=False):
         as_dict = super(User, self).as_dict()
@@ -149,17 +327,77 @@ class User(Entity):
             return as_dict
         return as_dict
 
-    def generate_auth_token(self, expiration=600):
-        return jwt.encode({'id': self.id, 'exp': datetime.utcnow() + timedelta(minutes=expiration)}, config.SECRET_KEY, algorithm='HS256')
-
     def get_item(self, **kwargs):
         return None
 
-    def get_list(self, payload, **kwargs):
-        return []
+    def get_list(self, payload, limit=None, cursor=None, **kwargs):
+        return [], None
+
+
+class LoggedUser(AuthTokenMixin):
+    """
+    Lazy, request scoped stand-in for the logged User entity.
+    id, email and name come from the identity the request already holds; the user row is only loaded
+    when anything else is touched.
+    """
+
+    def __init__(self, identity, token_expires_at=None, entity=None):
+        self._entity = entity
+        self.identity = identity
+        self.token_expires_at = token_expires_at
+        self.entity_key = None
+        self.resource_key = None
+
+    def __setattr__(self, name, value):
+        super(LoggedUser, self).__setattr__(name, value)
+        if name in ('entity_key', 'resource_key', 'token_expires_at') and self._entity is not None:
+            setattr(self._entity, name, value)
+
+    def __getattr__(self, name):
+        attribute = getattr(User, name, None)
+        if isinstance(attribute, type):
+            return attribute
+        return getattr(self.entity, name)
+
+    @property
+    def entity(self):
+        if self._entity is None:
+            entity = User.create_with_id(self.id)
+            entity.entity_key = self.entity_key
+            entity.resource_key = self.resource_key
+            entity.token_expires_at = self.token_expires_at
+            self._entity = entity
+        return self._entity
+
+    @property
+    def is_loaded(self):
+        return self._entity is not None
+
+    @property
+    def id(self):
+        return self.identity['id']
+
+    @property
+    def email(self):
+        return self.identity['email']
+
+    @property
+    def name(self):
+        if 'name' in self.identity:
+            return self.identity['name']
+        return self.entity.name
+
+    def as_dict(self, compact=False):
+        if compact:
+            return {'id': self.id, 'name': self.name, 'email': self.email}
+        return self.entity.as_dict()
+
 
 class Account(Entity):
     repository = models.Account
+    row_fields = ('id', 'name', 'account_type', 'balance', 'sum_on_dash')
+    # the balance follows the ledger
+    writable_fields = ('name', 'account_type', 'sum_on_dash')
 
     # @classmethod
     # def create_new(cls, json_data):
@@ -194,16 +432,57 @@ class Account(Entity):
         return True
 
     # @bp.route('/accounts/<int:account_id>', methods=['GET'])
-    # @classmethod
-    # def get_account(cls, account_id):
-    #     return jsonify(Account.query.get_or_404(account_id).to_dict())
+    @classmethod
+    def get_account(cls, account_id, user_id, columns=serializers.account.columns):
+        return cls.repository.get_row(columns, id=account_id, user_id=user_id)
+
+    @classmethod
+    def create_account(cls, user_id, json_data):
+        """
+        New account of the user. Returns its id.
+        """
+        values = cls.writable_values(json_data)
+        if not values.get('name'):
+            raise cls.InvalidEntityData('name is required')
+        return cls.repository.create_from_json(dict(values, user_id=user_id)).id
+
+    @classmethod
+    def update_account(cls, account_id, user_id, json_data):
+        accounts = cls.repository.list_with_filter(id=account_id, user_id=user_id)
+        if not accounts:
+            raise cls.NotExist('Account {} of user {} does not exist'.format(account_id, user_id))
+        values = cls.writable_values(json_data)
+        if 'name' in values and not values['name']:
+            raise cls.InvalidEntityData('name is required')
+        accounts[0].update_from_json(values)
 
     # @bp.route('/users/<int:user_id>/accounts', methods=['GET'])
     @classmethod
-    def get_user_accounts(cls, user_id):
-        print("Oi, pegar contas do usuário {}".format(user_id))
-        # data = Account.to_collection_dict(Account.query.filter_by(user_id=user_id), 'api.get_user_accounts', user_id=user_id)
-        return True
+    def get_user_accounts(cls, user_id, limit=None, cursor=None, columns=serializers.account.columns):
+        return cls.repository.list_page(columns, limit=limit, cursor=cursor, user_id=user_id)
+
+    @classmethod
+    def stream_user_accounts(cls, user_id, columns=serializers.account.columns):
+        return cls.repository.stream_rows(columns, user_id=user_id)
+
+    @classmethod
+    def get_balance_at(cls, account_id, day):
+        """
+        Balance at the end of `day`
+        """
+        return ledger.balance_at(account_id, datetime(day.year, day.month, day.day) + timedelta(days=1))
+
+    @classmethod
+    def get_balance_series(cls, account_id, first_day, last_day):
+        return ledger.balance_series(account_id, first_day, last_day)
+
+    @classmethod
+    def import_statement(cls, account_id, user_id, stream, statement_format, **options):
+        """
+        Loads a CSV/OFX bank statement into the account transactions. Returns the ImportReport.
+        """
+        importer = importers.StatementImporter(account_id, user_id, batch_size=config.IMPORT_BATCH_SIZE)
+        return importer.run(stream, statement_format.lower(), **options)
     #
     # @bp.route('/accounts/<int:account_id>', methods=['PUT'])
     # def update_account(account_id):
@@ -211,4 +490,77 @@ class Account(Entity):
     #     data = request.get_json() or {}
     #     account.from_dict(data)
     #     db.session.commit()
-    #     return jsonify(account.to_dict())
\ No newline at end of file
+    #     return jsonify(account.to_dict())
+
+
+class Transfer(Entity):
+    repository = models.Transfer
+    row_fields = ('id', 'from_account', 'to_account', 'amount', 'transfer_date')
+    writable_fields = ('to_account', 'amount', 'observation', 'transfer_date')
+
+    @classmethod
+    def create_transfer(cls, from_account, user_id, json_data):
+        """
+        New transfer from one of the user's accounts (checked by the caller) to another one. Returns its id.
+        """
+        values = cls.writable_values(json_data)
+        if values.get('to_account') is None or Account.get_account(values['to_account'], user_id) is None:
+            raise cls.InvalidEntityData('to_account must be one of your accounts')
+        if values.get('amount') is None or values['amount'] <= 0:
+            raise cls.InvalidEntityData('amount must be positive')
+        return cls.repository.create_from_json(dict(values, from_account=from_account)).id
+
+    @classmethod
+    def get_transfer(cls, transfer_id, columns=serializers.transfer.columns):
+        return cls.repository.get_row(columns, id=transfer_id)
+
+    @classmethod
+    def get_account_transfers(cls, account_id, limit=None, cursor=None, options=()):
+        """
+        Page of the transfer instances from or to the account, with the loader `options` of the calling
+        endpoint, for serializers.transfer
+        """
+        return cls.repository.list_page(limit=limit, cursor=cursor, options=options,
+                                        clauses=(cls.repository.account_clause(account_id),))
+
+    @property
+    def name(self):
+        return None
+
+
+
+class Transaction(Entity):
+    repository = models.Transaction
+    row_fields = ('id', 'description', 'value', 'transaction_type', 'paid', 'date_created')
+    writable_fields = ('account_id', 'category_id', 'value', 'description', 'observation', 'paid',
+                       'transaction_type', 'date_created')
+
+    @classmethod
+    def create_transaction(cls, user_id, json_data):
+        """
+        New transaction in one of the user's accounts. Returns its id.
+        """
+        values = cls.writable_values(json_data)
+        if values.get('account_id') is None or Account.get_account(values['account_id'], user_id) is None:
+            raise cls.InvalidEntityData('account_id must be one of your accounts')
+        if values.get('value') is None:
+            raise cls.InvalidEntityData('value is required')
+        if values.get('transaction_type') not in (cls.repository.INCOME, cls.repository.EXPENSE):
+            raise cls.InvalidEntityData('invalid transaction_type')
+        return cls.repository.create_from_json(dict(values, user_id=user_id)).id
+
+    @classmethod
+    def get_transaction(cls, transaction_id, user_id, columns=serializers.transaction.columns):
+        return cls.repository.get_row(columns, id=transaction_id, user_id=user_id)
+
+    @classmethod
+    def get_user_transactions(cls, user_id, limit=None, cursor=None, options=()):
+        """
+        Page of the transaction instances of the user, with the loader `options` of the calling endpoint,
+        for serializers.transaction
+        """
+        return cls.repository.list_page(limit=limit, cursor=cursor, options=options, user_id=user_id)
+
+    @property
+    def name(self):
+        return self.instance.description
@@ -0,0 +1,87 @@
+"""
+Password hashing service
+
+passlib hashes are deliberately slow and CPU bound. Running them inline blocks every greenlet of a
+gevent worker, so they are sent to a small process pool and the number of operations in flight is bounded.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import BoundedSemaphore
+
+from passlib.apps import custom_app_context
+
+_contexts = {}
+
+
+def _crypt_context(rounds):
+    if not rounds:
+        return custom_app_context
+    if rounds not in _contexts:
+        # the admin category has its own (higher) minimum, the context refuses default rounds below it
+        _contexts[rounds] = custom_app_context.copy(
+            sha256_crypt__min_rounds=rounds,
+            sha256_crypt__default_rounds=rounds,
+            sha512_crypt__min_rounds=rounds,
+            sha512_crypt__default_rounds=rounds,
+            admin__sha256_crypt__min_rounds=rounds,
+            admin__sha512_crypt__min_rounds=rounds
+        )
+    return _contexts[rounds]
+
+
+def encrypt(password, rounds=None):
+    return _crypt_context(rounds).hash(password)
+
+
+def verify(password, password_hash):
+    return custom_app_context.verify(password, password_hash)
+
+
+class PasswordHasher(object):
+    """
+    Runs `encrypt` and `verify` in a process pool. With `workers` set to 0 they run inline.
+    The pool is only started on first use, so each gunicorn worker gets its own after the fork.
+    """
+
+    class Busy(Exception):
+        pass
+
+    def __init__(self, workers=1, concurrency=4, rounds=None, timeout=30):
+        self.workers = workers
+        self.rounds = rounds
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(concurrency)
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _run(self, function, *args):
+        if self.executor is None:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise self.Busy('Too many password hashing operations in progress')
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # the slot is freed when the operation ends, not when the caller stops waiting: an operation that
+        # timed out keeps its pool process busy until it finishes
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise self.Busy('Password hashing did not finish in {} seconds'.format(self.timeout))
+
+    def _release(self, future):
+        self._slots.release()
+
+    def encrypt(self, password):
+        return self._run(encrypt, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._run(verify, password, password_hash)
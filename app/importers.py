@@ -0,0 +1,318 @@
+"""
+Bank statement import
+
+Statements (CSV or OFX) are parsed as streams, so memory does not depend on the file size. The
+normalized transactions are loaded in batches: on PostgreSQL with COPY into a temporary staging table
+merged into `transaction` with a single INSERT ... SELECT, which also sums the ledger effects of the merged
+rows per month, elsewhere (and in the gevent workers, where psycopg2 cannot COPY) with
+AbstractModel.bulk_create_from_json. Rows already in the account (same date, value, type
+and description) are skipped, so importing an overlapping statement again does not duplicate them.
+"""
+
+import csv
+import io
+import logging
+import re
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from dateutil import parser as date_parser
+from sqlalchemy import func
+
+from app import database, models
+
+db = database.AppRepository.db
+logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = ('account_id', 'user_id', 'category_id', 'value', 'description', 'observation', 'paid',
+                  'transaction_type', 'date_created')
+# natural key of an imported row inside its account
+IMPORT_KEY_COLUMNS = ('date_created', 'value', 'transaction_type', 'description')
+# ledger columns the imported rows are summed by, with their month (see StatementImporter.copy_load)
+IMPORT_TOTAL_COLUMNS = ('user_id', 'account_id', 'category_id', 'transaction_type', 'paid')
+# NULL in the COPY csv: an unquoted empty field is then an empty string, as in the batch path
+COPY_NULL = '\\N'
+OFX_TOKEN_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+OFX_DATE_RE = re.compile(r'^(\d{8})(\d{6})?')
+ISO_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+CHUNK_SIZE = 64 * 1024
+
+
+class InvalidStatement(Exception):
+    pass
+
+
+class ImportReport(object):
+    def __init__(self):
+        self.read = 0
+        self.rows = 0
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def seconds(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def skipped(self):
+        return self.read - self.rows
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'skipped': self.skipped,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1)
+        }
+
+
+def parse_amount(value):
+    value = value.strip().replace(' ', '')
+    if ',' in value and value.rfind(',') > value.rfind('.'):
+        value = value.replace('.', '').replace(',', '.')
+    else:
+        value = value.replace(',', '')
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise InvalidStatement('Invalid amount {}'.format(value))
+
+
+def parse_ofx_date(value):
+    match = OFX_DATE_RE.match(value.strip())
+    if match is None:
+        raise InvalidStatement('Invalid OFX date {}'.format(value))
+    return datetime.strptime(match.group(1) + (match.group(2) or '000000'), '%Y%m%d%H%M%S')
+
+
+def parse_csv_date(value, date_format=None):
+    """
+    Date of a CSV line: with `date_format` when given, otherwise ISO (YYYY-MM-DD) or day first (dd/mm/yyyy)
+    """
+    value = value.strip()
+    if date_format:
+        return datetime.strptime(value, date_format)
+    return date_parser.parse(value, dayfirst=ISO_DATE_RE.match(value) is None)
+
+
+def iter_csv_records(stream, encoding='utf-8-sig', date_column='date', description_column='description',
+                     amount_column='amount', memo_column='memo', date_format=None):
+    """
+    Yields (date, amount, description, memo) from a CSV statement with a header row
+    """
+    text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    sample = text.read(CHUNK_SIZE)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(_chain_sample(sample, text), dialect=dialect)
+    for line in reader:
+        try:
+            date = parse_csv_date(line[date_column], date_format)
+            amount = parse_amount(line[amount_column])
+        except (KeyError, ValueError, OverflowError) as ex:
+            raise InvalidStatement('Invalid CSV line {}: {}'.format(reader.line_num, ex))
+        yield date, amount, line.get(description_column) or '', line.get(memo_column) or ''
+
+
+def _chain_sample(sample, text):
+    for line in io.StringIO(sample):
+        if not line.endswith('\n'):
+            line += text.readline()
+        yield line
+    for line in text:
+        yield line
+
+
+def iter_ofx_tokens(stream, encoding='latin-1'):
+    """
+    Yields (closing, tag, value) from an OFX (SGML or XML) stream read in chunks
+    """
+    pending = ''
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        pending += chunk.decode(encoding) if isinstance(chunk, bytes) else chunk
+        last_tag = pending.rfind('<')
+        for match in OFX_TOKEN_RE.finditer(pending, 0, last_tag if last_tag > 0 else 0):
+            yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+        pending = pending[last_tag:] if last_tag > 0 else pending
+    for match in OFX_TOKEN_RE.finditer(pending):
+        yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+
+
+def iter_ofx_records(stream, encoding='latin-1'):
+    """
+    Yields (date, amount, description, memo) for every STMTTRN of an OFX statement
+    """
+    transaction = None
+    for closing, tag, value in iter_ofx_tokens(stream, encoding):
+        if tag == 'STMTTRN':
+            if closing and transaction is not None:
+                if 'DTPOSTED' not in transaction or 'TRNAMT' not in transaction:
+                    raise InvalidStatement('STMTTRN without DTPOSTED or TRNAMT')
+                yield (parse_ofx_date(transaction['DTPOSTED']), parse_amount(transaction['TRNAMT']),
+                       transaction.get('NAME', ''), transaction.get('MEMO', ''))
+                transaction = None
+            elif not closing:
+                transaction = {}
+        elif transaction is not None and not closing and value:
+            transaction[tag] = value
+
+
+def normalize(records, account_id, user_id):
+    """
+    Statement records as `transaction` rows. Amount sign picks income or expense, value is stored positive.
+    """
+    for date, amount, description, memo in records:
+        yield {
+            'account_id': account_id,
+            'user_id': user_id,
+            'category_id': None,
+            'value': abs(amount),
+            'description': description[:50],
+            'observation': memo[:200],
+            'paid': True,
+            'transaction_type': models.Transaction.INCOME if amount >= 0 else models.Transaction.EXPENSE,
+            'date_created': date
+        }
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CsvRowStream(io.RawIOBase):
+    """
+    File like object producing the CSV of a batch of rows on demand, as COPY reads it
+    """
+
+    def __init__(self, rows):
+        self._lines = (self._line(row) for row in rows)
+        self._buffer = b''
+
+    @staticmethod
+    def _line(row):
+        output = io.StringIO()
+        csv.writer(output).writerow([COPY_NULL if row[column] is None else row[column] for column in IMPORT_COLUMNS])
+        return output.getvalue().encode('utf-8')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self._buffer) < len(buffer):
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+class StatementImporter(object):
+    def __init__(self, account_id, user_id, batch_size=50000, progress=None):
+        self.account_id = account_id
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.progress = progress or self.log_progress
+        self.report = ImportReport()
+
+    def log_progress(self, report):
+        logger.info('account %s: %s rows read, %s imported (%.0f rows/s)', self.account_id, report.read, report.rows,
+                    report.rows_per_second)
+
+    def records(self, stream, statement_format, **options):
+        if statement_format == 'csv':
+            return iter_csv_records(stream, **options)
+        if statement_format == 'ofx':
+            return iter_ofx_records(stream, **options)
+        raise InvalidStatement('Unknown statement format {}'.format(statement_format))
+
+    def run(self, stream, statement_format, **options):
+        rows = normalize(self.records(stream, statement_format, **options), self.account_id, self.user_id)
+        if db.session.bind.dialect.name == 'postgresql' and not database.green_mode():
+            self.copy_load(rows)
+        else:
+            self.batch_load(rows)
+        self.report.finished_at = time.time()
+        return self.report
+
+    def batch_load(self, rows):
+        # rows inserted by this import have greater ids, so same day duplicates of the statement are kept
+        last_id = db.session.query(func.max(models.Transaction.id)).scalar() or 0
+        for batch in batches(rows, self.batch_size):
+            existing = self.existing_keys(batch, last_id)
+            new_rows = [row for row in batch if tuple(row[column] for column in IMPORT_KEY_COLUMNS) not in existing]
+            if new_rows:
+                models.Transaction.bulk_create_from_json(new_rows)
+            self.report.read += len(batch)
+            self.report.rows += len(new_rows)
+            self.progress(self.report)
+
+    def existing_keys(self, batch, last_id):
+        dates = [row['date_created'] for row in batch]
+        Transaction = models.Transaction
+        query = db.session.query(*[getattr(Transaction, column) for column in IMPORT_KEY_COLUMNS])\
+            .filter(Transaction.account_id == self.account_id, Transaction.id <= last_id,
+                    Transaction.date_created >= min(dates), Transaction.date_created <= max(dates))
+        return set(tuple(key) for key in query)
+
+    def copy_load(self, rows):
+        connection = db.session.connection()
+        connection.execute(
+            'CREATE TEMP TABLE transaction_import ('
+            'account_id integer, user_id integer, category_id integer, value numeric(12, 2), '
+            'description varchar(50), observation varchar(200), paid boolean, transaction_type integer, '
+            'date_created timestamp) ON COMMIT DROP'
+        )
+        cursor = connection.connection.cursor()
+        copy_sql = "COPY transaction_import ({}) FROM STDIN WITH (FORMAT csv, NULL '{}')".format(
+            ', '.join(IMPORT_COLUMNS), COPY_NULL)
+        for batch in batches(rows, self.batch_size):
+            cursor.copy_expert(copy_sql, CsvRowStream(batch))
+            self.report.read += len(batch)
+            self.progress(self.report)
+        # anti-join on the natural key, against the rows that were there before the import. The inserted rows
+        # are summed in the same statement, so only one row per user, account, category, type and month comes back
+        totals = connection.execute(
+            'WITH inserted AS (INSERT INTO "transaction" ({columns}) SELECT {columns} FROM transaction_import i '
+            'WHERE NOT EXISTS (SELECT 1 FROM "transaction" t WHERE t.account_id = i.account_id '
+            'AND t.date_created = i.date_created AND t.value = i.value AND t.transaction_type = i.transaction_type '
+            'AND t.description IS NOT DISTINCT FROM i.description) '
+            'RETURNING {ledger_columns}) '
+            "SELECT {group_columns}, date_trunc('month', date_created) AS date_created, sum(value) AS value, "
+            "count(*) AS count FROM inserted GROUP BY {group_columns}, date_trunc('month', date_created)"
+            .format(columns=', '.join(IMPORT_COLUMNS),
+                    ledger_columns=', '.join(models.Transaction.ledger_columns),
+                    group_columns=', '.join(IMPORT_TOTAL_COLUMNS))).fetchall()
+        ledger_effects = []
+        rollup_effects = []
+        for total in totals:
+            values = dict(total)
+            # a month total stands for `count` rows: same snapshot period and rollup key as each of them
+            ledger_effects.extend(models.Transaction.ledger_effects(values))
+            rollup_effects.extend((key, value, paid_value, values['count'])
+                                  for key, value, paid_value, count in models.Transaction.rollup_effects(values))
+            self.report.rows += values['count']
+        models.apply_ledger_effects(connection, ledger_effects)
+        models.apply_rollup_effects(connection, rollup_effects)
+        self.progress(self.report)
+        connection.execute('DROP TABLE transaction_import')
+        models.bump_data_versions(connection, models.User.id == self.user_id)
@@ -1,16 +1,16 @@
 import os
+import time
 
 from datetime import datetime, timedelta
 from flask import Flask, g, request
-from flask_sqlalchemy import SQLAlchemy
-from app import config as config_module, database, api, auth
+from app import config as config_module, database, api, auth, compression
 
 config = config_module.get_config()
 
 web_app = Flask(__name__)
 web_app.config.from_object(config)
 
-database.AppRepository.db = SQLAlchemy(web_app)
+database.AppRepository.db = database.RoutingSQLAlchemy(web_app)
 
 api.create_api(web_app)
 
@@ -28,7 +28,7 @@ def before_request():
         user, new_token, user_entity = auth.check_auth_token(token)
     elif api_token:
         authenticated = api.authenticate_api(api_token)
-    if user and new_token:
+    if user:
         g.user = user
         g.current_token = new_token
         g.user_entity = user_entity
@@ -38,17 +38,30 @@ def before_request():
 
 @web_app.after_request
 def add_cache_header(response):
+    etag = g.get('etag')
+    if etag and response.status_code in (200, 304):
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = "private, no-cache"
+        response.vary.update(['Accept', 'Cookie'])
+        return response
     response.headers['Cache-Control'] = "no-cache, no-store, must-revalidate"
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     return response
 
 
+@web_app.after_request
+def add_debug_header(response):
+    if web_app.debug:
+        response.headers['X-Payload-Parses'] = str(g.get('payload_parses', 0))
+    return response
+
+
 @web_app.after_request
 def add_token_header(response):
     user = g.get("user")
-    if user is not None:
-        token = g.current_token
+    token = g.get("current_token")
+    if user is not None and token:
         expire_date = datetime.now()
         expire_date = expire_date + timedelta(days=90)
         response.set_cookie('baseUserToken', token, domain='finlife.com', expires=expire_date)
@@ -57,5 +70,27 @@ def add_token_header(response):
     return response
 
 
+@web_app.after_request
+def add_primary_reads_cookie(response):
+    """
+    After a write, the next reads of this client go to the primary for READ_YOUR_WRITES_SECONDS
+    """
+    if config.REPLICA_BINDS and database.session_wrote():
+        response.set_cookie(database.PRIMARY_READS_COOKIE, str(int(time.time()) + config.READ_YOUR_WRITES_SECONDS),
+                            domain='finlife.com', max_age=config.READ_YOUR_WRITES_SECONDS)
+    return response
+
+
+@web_app.after_request
+def compress_response(response):
+    return compression.compress_response(
+        response,
+        request.headers.get('Accept-Encoding'),
+        level=config.COMPRESSION_LEVEL,
+        brotli_quality=config.BROTLI_QUALITY,
+        min_size=config.COMPRESSION_MIN_SIZE
+    )
+
+
 def run():
     web_app.run(host='0.0.0.0', port=int(os.environ.get('PORTA', 33366)), debug=True)
@@ -0,0 +1,118 @@
+"""
+Point in time balances
+
+The balance of an account at any moment is its latest BalanceSnapshot before that moment plus the
+ledger entries (paid transactions and transfers) between the snapshot and the moment.
+Moments are exclusive: balance_at(account, moment) counts the entries dated before it.
+"""
+
+import heapq
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import case, func
+
+from app import database, models
+
+db = database.AppRepository.db
+Transaction = models.Transaction
+Transfer = models.Transfer
+BalanceSnapshot = models.BalanceSnapshot
+
+
+def signed_value():
+    return case([
+        (Transaction.transaction_type == Transaction.INCOME, Transaction.value),
+        (Transaction.transaction_type == Transaction.EXPENSE, -Transaction.value)
+    ], else_=0)
+
+
+def between(column, start, end):
+    clauses = [column < end]
+    if start is not None:
+        clauses.append(column >= start)
+    return clauses
+
+
+def ledger_delta(account_id, start, end):
+    """
+    Sum of the ledger entries of the account dated in [start, end). `start` None means since the beginning.
+    """
+    transactions = db.session.query(func.sum(signed_value())).filter(
+        Transaction.account_id == account_id, Transaction.paid == True,
+        *between(Transaction.date_created, start, end)).scalar()
+    incoming = db.session.query(func.sum(Transfer.amount)).filter(
+        Transfer.to_account == account_id, *between(Transfer.transfer_date, start, end)).scalar()
+    outgoing = db.session.query(func.sum(Transfer.amount)).filter(
+        Transfer.from_account == account_id, *between(Transfer.transfer_date, start, end)).scalar()
+    return Decimal(transactions or 0) + Decimal(incoming or 0) - Decimal(outgoing or 0)
+
+
+def balance_at(account_id, moment):
+    snapshot = BalanceSnapshot.latest(account_id, moment)
+    if snapshot is None:
+        return ledger_delta(account_id, None, moment)
+    as_of, balance = snapshot
+    return Decimal(balance) + ledger_delta(account_id, as_of, moment)
+
+
+def iter_entries(account_id, start, end):
+    """
+    (date, delta) of the ledger entries of the account dated in [start, end), in date order
+    """
+    transactions = db.session.query(Transaction.date_created, signed_value()).filter(
+        Transaction.account_id == account_id, Transaction.paid == True,
+        *between(Transaction.date_created, start, end)).order_by(Transaction.date_created)
+    incoming = db.session.query(Transfer.transfer_date, Transfer.amount).filter(
+        Transfer.to_account == account_id, *between(Transfer.transfer_date, start, end)).order_by(Transfer.transfer_date)
+    outgoing = db.session.query(Transfer.transfer_date, -Transfer.amount).filter(
+        Transfer.from_account == account_id, *between(Transfer.transfer_date, start, end)).order_by(Transfer.transfer_date)
+    streams = [query.yield_per(models.config.STREAM_BATCH_SIZE) for query in (transactions, incoming, outgoing)]
+    return heapq.merge(*streams, key=lambda entry: entry[0])
+
+
+def balance_series(account_id, first_day, last_day):
+    """
+    End of day balances from first_day to last_day (dates, inclusive) in a single pass over the range
+    """
+    start = datetime(first_day.year, first_day.month, first_day.day)
+    end = datetime(last_day.year, last_day.month, last_day.day) + timedelta(days=1)
+    balance = balance_at(account_id, start)
+    entries = iter_entries(account_id, start, end)
+    entry = next(entries, None)
+    series = []
+    day = start
+    while day < end:
+        day_end = day + timedelta(days=1)
+        while entry is not None and entry[0] < day_end:
+            balance += Decimal(entry[1] or 0)
+            entry = next(entries, None)
+        series.append((day.date(), balance))
+        day = day_end
+    return series
+
+
+def rebuild_snapshots(account_id=None, until=None):
+    """
+    Recomputes the month boundary snapshots of one account (or all of them) from the whole ledger
+    """
+    until = until or datetime.utcnow()
+    accounts = [account_id] if account_id else [row[0] for row in db.session.query(models.Account.id)]
+    for current_id in accounts:
+        db.session.query(BalanceSnapshot).filter_by(account_id=current_id).delete(synchronize_session=False)
+        snapshots = []
+        balance = Decimal(0)
+        boundary = None
+        for moment, delta in iter_entries(current_id, None, until):
+            while boundary is not None and moment >= boundary:
+                snapshots.append({'account_id': current_id, 'as_of': boundary, 'balance': balance})
+                boundary = models.next_period_start(boundary)
+            if boundary is None:
+                boundary = models.next_period_start(moment)
+            balance += Decimal(delta or 0)
+        while boundary is not None and boundary <= until:
+            snapshots.append({'account_id': current_id, 'as_of': boundary, 'balance': balance})
+            boundary = models.next_period_start(boundary)
+        if snapshots:
+            db.session.execute(BalanceSnapshot.__table__.insert(), snapshots)
+    return len(accounts)
@@ -1,19 +1,41 @@
+import base64
+import json
+from collections import defaultdict
 from datetime import datetime
-from sqlalchemy import exc, text, or_, and_
+from decimal import Decimal
 
-from app import database, config as config_module, ClassProperty
+from dateutil import parser as date_parser
+from sqlalchemy import exc, text, or_, and_, types, event, select, case, func, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import load_only
+
+from app import database, cache, config as config_module, ClassProperty
 
 config = config_module.get_config()
 db = database.AppRepository.db
+# shared cache of the per user list queries, off unless REDIS_URL is set
+collection_cache = cache.CollectionCache(
+    cache.connect(config.REDIS_URL, config.REDIS_SOCKET_TIMEOUT), ttl=config.COLLECTION_CACHE_TTL)
+# per worker cache of the logged users' identity, invalidated in every worker through the same store
+identity_cache = cache.TTLCache(
+    max_size=config.IDENTITY_CACHE_SIZE, store=collection_cache.store, prefix='identities',
+    ttl=config.IDENTITY_CACHE_TTL if collection_cache.enabled else config.IDENTITY_CACHE_LOCAL_TTL)
 
 
 class AbstractModel(object):
+    # keyset used by list_page, in sort order. The last one must be unique.
+    cursor_columns = ('id',)
+    ledger_date_column = None
+
     class NotExist(Exception):
         pass
 
     class RepositoryError(Exception):
         pass
 
+    class InvalidCursor(Exception):
+        pass
+
     @classmethod
     def create_from_json(cls, json_data):
         try:
@@ -24,6 +46,91 @@ class AbstractModel(object):
         except exc.IntegrityError as ex:
             raise cls.RepositoryError(ex.message)
 
+    @classmethod
+    def bulk_create_from_json(cls, json_list, batch_size=None):
+        """
+        Inserts many rows with one multi-row INSERT per `batch_size` chunk, without building instances
+        or flushing/refreshing them one by one. Returns the new ids in input order.
+        """
+        batch_size = batch_size or config.BULK_INSERT_BATCH_SIZE
+        ids = []
+        try:
+            for start in range(0, len(json_list), batch_size):
+                rows = [cls.bulk_row(json_data) for json_data in json_list[start:start + batch_size]]
+                ids.extend(cls.bulk_insert(rows))
+                owner_clause = cls.bulk_owner_clause(rows)
+                if owner_clause is not None:
+                    bump_data_versions(db.session.connection(), owner_clause)
+                for owner in set(row.get('user_id') for row in rows):
+                    mark_cache_stale(owner)
+                apply_ledger_effects(db.session.connection(), [
+                    effect for row in rows for effect in cls.ledger_effects(row)
+                ])
+                apply_rollup_effects(db.session.connection(), [
+                    effect for row in rows for effect in cls.rollup_effects(row)
+                ])
+        except exc.IntegrityError as ex:
+            raise cls.RepositoryError(str(ex))
+        return ids
+
+    @classmethod
+    def bulk_row(cls, json_data):
+        """
+        Table values for one row, over every non primary key column so every row of a multi-row INSERT
+        has the same keys. Missing or None columns get their python side default, or None, as they do on a flush.
+        """
+        row = {}
+        for column in cls.__table__.columns:
+            if column.primary_key:
+                continue
+            if json_data.get(column.key) is not None or (column.key in json_data and column.default is None):
+                row[column.key] = json_data[column.key]
+            elif column.default is not None and column.default.is_scalar:
+                row[column.key] = column.default.arg
+            elif column.default is not None and column.default.is_callable:
+                row[column.key] = column.default.arg(None)
+            else:
+                row[column.key] = None
+        return row
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        table = cls.__table__
+        if db.session.bind.dialect.implicit_returning:
+            return [row_id for row_id, in db.session.execute(table.insert().values(rows).returning(table.c.id))]
+        # no RETURNING (sqlite): ids of a single multi-row INSERT are consecutive and end on lastrowid
+        last_id = db.session.execute(table.insert().values(rows)).lastrowid
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    @classmethod
+    def bulk_owner_clause(cls, rows):
+        """
+        Users whose data version must be bumped after a bulk insert of `rows`. None for unversioned models.
+        """
+        return None
+
+    @classmethod
+    def balance_effect(cls, values):
+        """
+        (account_id, delta) pairs that a row with `values` applies to account balances
+        """
+        return []
+
+    @classmethod
+    def ledger_effects(cls, values, sign=1):
+        """
+        balance_effect as (account_id, delta, date) using the model `ledger_date_column`
+        """
+        moment = values.get(cls.ledger_date_column) if cls.ledger_date_column else None
+        return [(account_id, sign * delta, moment) for account_id, delta in cls.balance_effect(values)]
+
+    @classmethod
+    def rollup_effects(cls, values, sign=1):
+        """
+        (rollup key, total, paid total, count) deltas that a row with `values` applies to the monthly rollups
+        """
+        return []
+
     @classmethod
     def list_with_filter(cls, **kwargs):
         return cls.query.filter_by(**kwargs).all()
@@ -32,6 +139,108 @@ class AbstractModel(object):
     def list_all(cls):
         return cls.query.all()
 
+    @classmethod
+    def list_rows(cls, columns, **kwargs):
+        return cls.cached(columns, ('list_rows',), lambda: db.session.query(*columns).filter_by(**kwargs).all(), **kwargs)
+
+    @classmethod
+    def cached(cls, columns, shape, loader, **kwargs):
+        """
+        `loader()` through the collection cache, keyed by the owner (the `user_id` filter) and the query shape.
+        Models without user_id share the owner None. Queries over many users are not cached.
+        Misses load from the primary, so a lagging replica cannot keep stale rows cached for a whole TTL.
+        """
+        if not collection_cache.enabled:
+            return loader()
+        if 'user_id' in kwargs:
+            owner = kwargs['user_id']
+        elif 'user_id' not in cls.__table__.columns:
+            owner = None
+        else:
+            return loader()
+        shape = (cls.__tablename__,) + tuple(shape) + (tuple(str(column) for column in columns), sorted(kwargs.items()))
+        return collection_cache.get_or_load(owner, shape, lambda: load_from_primary(loader))
+
+    @classmethod
+    def stream_rows(cls, columns, **kwargs):
+        """
+        Iterates the rows through a server side cursor, holding at most STREAM_BATCH_SIZE rows in memory
+        """
+        keys = [getattr(cls, column) for column in cls.cursor_columns]
+        query = db.session.query(*columns).filter_by(**kwargs).order_by(*keys)
+        return query.execution_options(stream_results=True).yield_per(config.STREAM_BATCH_SIZE)
+
+    @classmethod
+    def get_row(cls, columns, **kwargs):
+        return db.session.query(*columns).filter_by(**kwargs).one_or_none()
+
+    @classmethod
+    def list_page(cls, columns=None, limit=None, cursor=None, fields=None, options=(), clauses=(), **kwargs):
+        """
+        Keyset pagination over `cursor_columns`. With `columns` the page holds column tuples instead of instances,
+        with `fields` instances only load those columns and `options` are the loader options of the instances
+        (eager loading of their relationships). `clauses` are extra filters. Returns the page and the opaque
+        cursor of the next one (None on the last page). Column pages filtered by kwargs only go through
+        the collection cache.
+        """
+        if columns and not clauses:
+            return cls.cached(columns, ('list_page', limit, cursor), lambda: cls.query_page(
+                columns, limit=limit, cursor=cursor, **kwargs), **kwargs)
+        return cls.query_page(columns, limit=limit, cursor=cursor, fields=fields, options=options, clauses=clauses,
+                              **kwargs)
+
+    @classmethod
+    def query_page(cls, columns=None, limit=None, cursor=None, fields=None, options=(), clauses=(), **kwargs):
+        keys = [getattr(cls, column) for column in cls.cursor_columns]
+        if columns:
+            selected = set(column.key for column in columns)
+            query = db.session.query(*(list(columns) + [key for key in keys if key.key not in selected]))
+        elif fields:
+            query = cls.query.options(load_only(*(set(fields) | set(cls.cursor_columns))))
+        else:
+            query = cls.query
+        if options and not columns:
+            query = query.options(*options)
+        query = query.filter_by(**kwargs).filter(*clauses).order_by(*keys)
+        if cursor:
+            query = query.filter(cls.after_cursor(cursor))
+        limit = min(limit or config.PAGE_SIZE, config.MAX_PAGE_SIZE)
+        rows = query.limit(limit + 1).all()
+        next_cursor = cls.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    @classmethod
+    def encode_cursor(cls, row):
+        values = [getattr(row, column) for column in cls.cursor_columns]
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def decode_cursor(cls, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            if len(values) != len(cls.cursor_columns):
+                raise ValueError('Cursor does not match {}'.format(cls.cursor_columns))
+            return [
+                date_parser.parse(value) if isinstance(getattr(cls, column).type, types.DateTime) else value
+                for column, value in zip(cls.cursor_columns, values)
+            ]
+        except Exception as ex:
+            raise cls.InvalidCursor(str(ex))
+
+    @classmethod
+    def after_cursor(cls, cursor):
+        """
+        (a, b) > (x, y) spelled as a > x OR (a = x AND b > y), which every backend can use an index for
+        """
+        keys = [getattr(cls, column) for column in cls.cursor_columns]
+        values = cls.decode_cursor(cursor)
+        clauses = []
+        for index, key in enumerate(keys):
+            equals = [keys[previous] == values[previous] for previous in range(index)]
+            clauses.append(and_(*(equals + [key > values[index]])))
+        return or_(*clauses)
+
     @classmethod
     def get_with_filter(cls, **kwargs):
         return cls.query.filter_by(**kwargs).one_or_none()
@@ -52,11 +261,13 @@ class AbstractModel(object):
         db.session.add(self)
         db.session.flush()
         db.session.refresh(self)
+        mark_cache_stale(getattr(self, 'user_id', None))
 
     def delete_db(self):
         try:
             db.session.delete(self)
             db.session.flush()
+            mark_cache_stale(getattr(self, 'user_id', None))
         except exc.IntegrityError as ex:
             raise self.RepositoryError(ex.message)
 
@@ -68,6 +279,9 @@ class AbstractModel(object):
         except exc.IntegrityError as ex:
             raise self.RepositoryError(ex.message)
 
+    def snapshot(self, *columns):
+        return {column: getattr(self, column) for column in columns}
+
     def set_values(self, json_data):
         for key, value in json_data.items():
             setattr(self, key, json_data.get(key, getattr(self, key)))
@@ -84,16 +298,91 @@ class User(db.Model, AbstractModel):
     def get_by_email(cls, email):
         return cls.get_with_filter(email=email)
 
-
-class Account(db.Model):
+    @classmethod
+    def get_data_version(cls, user_id):
+        """
+        Version of the user's accounts, transfers and transactions (0 before the first write), None for no user
+        """
+        return db.session.query(func.coalesce(DataVersion.version, 0)).select_from(cls)\
+            .outerjoin(DataVersion, DataVersion.user_id == cls.id).filter(cls.id == user_id).scalar()
+
+
+class DataVersion(db.Model):
+    """
+    Bumped once per committed transaction that wrote the user's accounts, transfers or transactions
+    (see bump_pending_data_versions). Kept off the user row, so writes do not lock it.
+    """
+    __tablename__ = 'user_data_version'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True,
+                        autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Account(db.Model, AbstractModel):
     __tablename__ = 'account'
+    __table_args__ = (
+        db.Index('ix_account_user_id_created_at', 'user_id', 'created_at', 'id'),
+    )
+    cursor_columns = ('created_at', 'id')
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     account_type = db.Column(db.Integer, db.ForeignKey('account_type.id'))
+    # kept in sync with the ledger (paid transactions and transfers) by the balance events below.
+    # Opening balances are recorded as an income transaction.
     balance = db.Column(db.Numeric(12, 2), default=0.0)
     sum_on_dash = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # first keyset column of the account pages: never NULL
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # relationships load lazily: list endpoints pick their eager loading strategy (see resources loader_options)
+    type = db.relationship('AccountType')
+
+    @classmethod
+    def ledger_balances(cls):
+        """
+        Every account balance recomputed from scratch out of its paid transactions and transfers
+        """
+        balances = defaultdict(Decimal)
+        signed_value = case([
+            (Transaction.transaction_type == Transaction.INCOME, Transaction.value),
+            (Transaction.transaction_type == Transaction.EXPENSE, -Transaction.value)
+        ], else_=0)
+        transactions = db.session.query(Transaction.account_id, func.sum(signed_value))\
+            .filter(Transaction.paid == True).group_by(Transaction.account_id)
+        incoming = db.session.query(Transfer.to_account, func.sum(Transfer.amount)).group_by(Transfer.to_account)
+        outgoing = db.session.query(Transfer.from_account, -func.sum(Transfer.amount)).group_by(Transfer.from_account)
+        for query in (transactions, incoming, outgoing):
+            for account_id, total in query:
+                if account_id is not None:
+                    balances[account_id] += Decimal(total or 0)
+        return balances
+
+    @classmethod
+    def balance_drifts(cls):
+        """
+        (account_id, stored balance, ledger balance) for every account whose stored balance is wrong
+        """
+        balances = cls.ledger_balances()
+        drifts = []
+        for account_id, stored in db.session.query(cls.id, cls.balance):
+            stored = Decimal(stored or 0)
+            expected = balances.get(account_id, Decimal(0))
+            if stored != expected:
+                drifts.append((account_id, stored, expected))
+        return drifts
+
+    @classmethod
+    def fix_balances(cls, drifts):
+        for account_id, stored, expected in drifts:
+            db.session.query(cls).filter_by(id=account_id).update({'balance': expected}, synchronize_session=False)
+
+    @classmethod
+    def bulk_owner_clause(cls, rows):
+        return User.id.in_(set(row.get('user_id') for row in rows))
+
+    def data_owner_clause(self):
+        # the previous owner too, when the account moves to another user
+        return User.id.in_(set([self.user_id, previous_value(self, 'user_id')]) - set([None]))
 
     def to_dict(self):
         data = {
@@ -114,7 +403,7 @@ class Account(db.Model):
             setattr(self, 'user_id', user_id)
 
 
-class AccountType(db.Model):
+class AccountType(db.Model, AbstractModel):
     __tablename__ = 'account_type'
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.String(20), index=True)
@@ -126,14 +415,51 @@ class AccountType(db.Model):
     # 5 - investimentos
     # 6 - outra
 
-class Transfer(db.Model):
+class Transfer(db.Model, AbstractModel):
     __tablename__ = 'transfer'
+    __table_args__ = (
+        db.Index('ix_transfer_from_account_transfer_date', 'from_account', 'transfer_date'),
+        db.Index('ix_transfer_to_account_transfer_date', 'to_account', 'transfer_date'),
+    )
+    cursor_columns = ('transfer_date', 'id')
+    ledger_columns = ('from_account', 'to_account', 'amount', 'transfer_date')
+    ledger_date_column = 'transfer_date'
     id = db.Column(db.Integer, primary_key=True)
     from_account = db.Column(db.Integer, db.ForeignKey('account.id'))
     to_account = db.Column(db.Integer, db.ForeignKey('account.id'))
     amount = db.Column(db.Numeric(12,2))
     observation = db.Column(db.String(150))
-    transfer_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # first keyset column of the transfer pages: never NULL
+    transfer_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    source = db.relationship('Account', foreign_keys=[from_account])
+    destination = db.relationship('Account', foreign_keys=[to_account])
+
+    @classmethod
+    def account_clause(cls, account_id):
+        return or_(cls.from_account == account_id, cls.to_account == account_id)
+
+    @classmethod
+    def bulk_owner_clause(cls, rows):
+        account_ids = set(row.get('from_account') for row in rows) | set(row.get('to_account') for row in rows)
+        return User.id.in_(select([Account.user_id]).where(Account.id.in_(account_ids)))
+
+    @classmethod
+    def balance_effect(cls, values):
+        amount = values.get('amount')
+        if amount is None:
+            return []
+        effects = []
+        if values.get('from_account') is not None:
+            effects.append((values['from_account'], -Decimal(str(amount))))
+        if values.get('to_account') is not None:
+            effects.append((values['to_account'], Decimal(str(amount))))
+        return effects
+
+    def data_owner_clause(self):
+        # the owners of the previous accounts too, when the transfer moves
+        account_ids = set([self.from_account, self.to_account, previous_value(self, 'from_account'),
+                           previous_value(self, 'to_account')]) - set([None])
+        return User.id.in_(select([Account.user_id]).where(Account.id.in_(account_ids)))
 
     def to_dict(self):
         data = {
@@ -152,8 +478,23 @@ class Transfer(db.Model):
                 setattr(self, field, data[field])
 
 
-class Transaction(db.Model):
+class Transaction(db.Model, AbstractModel):
     __tablename__ = 'transaction'
+    # on postgresql the account index also INCLUDEs (value, transaction_type, paid), see migration 7e4b0a9c1d23
+    # optionally partitioned by month of date_created on postgresql (see app.partitions): bound date_created
+    # in queries over many rows so they only touch the partitions of their range. A partitioned table only
+    # indexes id (no primary key), the mapping still uses it as the identity
+    __table_args__ = (
+        db.Index('ix_transaction_user_id_date_created', 'user_id', 'date_created'),
+        db.Index('ix_transaction_account_id_date_created', 'account_id', 'date_created'),
+        db.Index('ix_transaction_category_id_date_created', 'category_id', 'date_created'),
+    )
+    cursor_columns = ('date_created', 'id')
+    ledger_columns = ('account_id', 'value', 'paid', 'transaction_type', 'date_created', 'user_id', 'category_id')
+    ledger_date_column = 'date_created'
+    # transaction_type values. value is always positive, the type tells its direction
+    INCOME = 1
+    EXPENSE = 2
     id = db.Column(db.Integer, primary_key=True)
     account_id = db.Column(db.Integer, db.ForeignKey('account.id'))
     category_id = db.Column(db.Integer, db.ForeignKey('transaction_category.id'))
@@ -163,7 +504,40 @@ class Transaction(db.Model):
     observation = db.Column(db.String(200))
     paid = db.Column(db.Boolean, default=False)
     transaction_type = db.Column(db.Integer)
-    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    # first keyset column of the transaction pages: never NULL
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    account = db.relationship('Account')
+    category = db.relationship('TransactionCategory')
+    # read only: the links are written through TransactionTag
+    tags = db.relationship('Tag', secondary='transaction_tag', viewonly=True, order_by='Tag.id')
+
+    @classmethod
+    def bulk_owner_clause(cls, rows):
+        return User.id.in_(set(row.get('user_id') for row in rows))
+
+    @classmethod
+    def balance_effect(cls, values):
+        if not values.get('paid') or values.get('account_id') is None or values.get('value') is None:
+            return []
+        if values.get('transaction_type') == cls.INCOME:
+            return [(values['account_id'], Decimal(str(values['value'])))]
+        if values.get('transaction_type') == cls.EXPENSE:
+            return [(values['account_id'], -Decimal(str(values['value'])))]
+        return []
+
+    @classmethod
+    def rollup_effects(cls, values, sign=1):
+        # rollups are per user (user_id is part of their primary key), like `rollups.rebuild`
+        if values.get('user_id') is None or values.get('date_created') is None or values.get('value') is None:
+            return []
+        key = TransactionRollup.key(values.get('user_id'), values.get('account_id'), values.get('category_id'),
+                                    values.get('transaction_type'), values['date_created'])
+        value = sign * Decimal(str(values['value']))
+        return [(key, value, value if values.get('paid') else Decimal(0), sign)]
+
+    def data_owner_clause(self):
+        # the previous owner too, when the transaction moves to another user
+        return User.id.in_(set([self.user_id, previous_value(self, 'user_id')]) - set([None]))
 
     def to_dict(self):
         data = {
@@ -186,22 +560,319 @@ class Transaction(db.Model):
         if user_id:
             setattr(self, 'user_id', user_id)
 
-class TransactionCategory(db.Model):
+class BalanceSnapshot(db.Model):
+    """
+    Balance of an account with every ledger entry dated before `as_of`, a month boundary.
+    Written by `ledger.rebuild_snapshots` and shifted by apply_ledger_effects on every ledger write.
+    """
+    __tablename__ = 'account_balance_snapshot'
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), primary_key=True)
+    as_of = db.Column(db.DateTime, primary_key=True)
+    balance = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    @classmethod
+    def latest(cls, account_id, moment):
+        return db.session.query(cls.as_of, cls.balance)\
+            .filter(cls.account_id == account_id, cls.as_of <= moment)\
+            .order_by(cls.as_of.desc()).first()
+
+
+class TransactionRollup(db.Model):
+    """
+    Sums and counts of the transactions of one user, account, category and type in one month.
+    A missing account, category or type is stored as 0 so it can be part of the key.
+    Kept up to date by apply_rollup_effects on every transaction write, rebuilt by `rollups.rebuild`.
+    """
+    __tablename__ = 'transaction_monthly_rollup'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    account_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    category_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    transaction_type = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.DateTime, primary_key=True)
+    total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    paid_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def key(user_id, account_id, category_id, transaction_type, moment):
+        return (user_id, account_id or 0, category_id or 0, transaction_type or 0,
+                datetime(moment.year, moment.month, 1))
+
+
+class TransactionCategory(db.Model, AbstractModel):
     __tablename__ = 'transaction_category'
     id = db.Column(db.Integer, primary_key=True)
     transaction_type = db.Column(db.Integer)
     description = db.Column(db.String(50))
 
 
-class Tag(db.Model):
+class Tag(db.Model, AbstractModel):
     __tablename__ = 'tag'
+    __table_args__ = (
+        db.Index('ix_tag_user_id', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     description = db.Column(db.String(50), index=True)
 
 
-class TransactionTag(db.Model):
+class TransactionTag(db.Model, AbstractModel):
     __tablename__ = 'transaction_tag'
+    __table_args__ = (
+        db.Index('ix_transaction_tag_tag_id_transaction_id', 'tag_id', 'transaction_id'),
+        db.Index('ix_transaction_tag_transaction_id', 'transaction_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
+    # no foreign key in the database once transaction is partitioned (migration 9c2e5b7d4a10)
     transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'))
-    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'))
\ No newline at end of file
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'))
+    transaction = db.relationship('Transaction')
+    tag = db.relationship('Tag')
+
+
+def bump_data_versions(connection, owner_clause):
+    """
+    Marks the users matching `owner_clause` for a data version bump when the transaction commits, and their
+    cached collections stale now. Nothing is locked until the commit.
+    """
+    for user_id, in connection.execute(select([User.id]).where(owner_clause)):
+        db.session.info.setdefault('data_owners', set()).add(user_id)
+        mark_cache_stale(user_id)
+
+
+def bump_pending_data_versions(session):
+    """
+    Bumps the data version of every user the transaction wrote for, with one statement at commit, so the
+    version rows stay locked for the commit only however many rows the transaction wrote
+    """
+    # commit flushes after before_commit: the last pending changes mark their owners here
+    session.flush()
+    owners = sorted(session.info.pop('data_owners', ()))
+    if not owners:
+        return
+    connection = session.connection()
+    table = DataVersion.__table__
+    if connection.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values([{'user_id': owner, 'version': 1} for owner in owners])
+        connection.execute(statement.on_conflict_do_update(index_elements=[table.c.user_id],
+                                                           set_={'version': table.c.version + 1}))
+        return
+    connection.execute(table.update().where(table.c.user_id.in_(owners)).values(version=table.c.version + 1))
+    existing = set(user_id for user_id, in connection.execute(select([table.c.user_id]).where(
+        table.c.user_id.in_(owners))))
+    missing = [{'user_id': owner, 'version': 1} for owner in owners if owner not in existing]
+    if missing:
+        connection.execute(table.insert(), missing)
+
+
+def forget_data_owners(session, transaction):
+    # a rolled back transaction wrote nothing; savepoints leave the owners to their transaction
+    if transaction.parent is None:
+        session.info.pop('data_owners', None)
+
+
+def bump_data_version(mapper, connection, target):
+    bump_data_versions(connection, target.data_owner_clause())
+    if 'user_id' not in mapper.local_table.columns:
+        # collections of models without user_id (transfers) are cached under the owner None
+        mark_cache_stale(None)
+
+
+for versioned_model in (Account, Transfer, Transaction):
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(versioned_model, event_name, bump_data_version)
+event.listen(db.session, 'before_commit', bump_pending_data_versions)
+event.listen(db.session, 'after_transaction_end', forget_data_owners)
+
+
+def load_from_primary(loader):
+    with database.primary_reads():
+        return loader()
+
+
+def mark_cache_stale(owner):
+    """
+    Invalidates the cached collections of `owner` now, for the rest of this request, and again after commit,
+    for the other workers that may have cached the pre-commit rows in between
+    """
+    if collection_cache.enabled:
+        db.session.info.setdefault('stale_cache_owners', set()).add(owner)
+        collection_cache.invalidate(owner)
+
+
+def mark_identity_stale(user_id):
+    """
+    Invalidates the cached identity of `user_id` now and again after commit, like mark_cache_stale
+    """
+    db.session.info.setdefault('stale_identities', set()).add(user_id)
+    identity_cache.invalidate(user_id)
+
+
+def invalidate_stale_owners(session):
+    """
+    Invalidates the owners and identities marked stale by the transaction once it ended. After a rollback too:
+    the transaction may have cached its own uncommitted rows.
+    """
+    for owner in session.info.pop('stale_cache_owners', ()):
+        collection_cache.invalidate(owner)
+    for user_id in session.info.pop('stale_identities', ()):
+        identity_cache.invalidate(user_id)
+
+
+event.listen(db.session, 'after_commit', invalidate_stale_owners)
+event.listen(db.session, 'after_rollback', invalidate_stale_owners)
+
+
+def next_period_start(moment):
+    """
+    First instant of the month after `moment`: the snapshot boundary that first includes it
+    """
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+
+def apply_ledger_effects(connection, effects):
+    """
+    Applies (account_id, delta, date) effects to the account balances and to every balance snapshot taken
+    after the date, so back-dated writes keep the snapshots right, then creates the missing snapshot of each
+    written period from the ledger (which already holds the writes). Effects are summed per account and per
+    period first, so a batch costs one UPDATE per account and per period.
+    """
+    balances = defaultdict(Decimal)
+    periods = defaultdict(Decimal)
+    for account_id, delta, moment in effects:
+        balances[account_id] += delta
+        if moment is not None:
+            periods[(account_id, next_period_start(moment))] += delta
+    written = [key for key, delta in periods.items() if delta]
+    account_table = Account.__table__
+    # the account row lock also serializes the snapshot writes of concurrent transactions of the account
+    snapshot_accounts = set(account_id for account_id, period_start in written)
+    for account_id, delta in balances.items():
+        if delta or account_id in snapshot_accounts:
+            connection.execute(
+                account_table.update().where(account_table.c.id == account_id)
+                .values(balance=func.coalesce(account_table.c.balance, 0) + delta)
+            )
+    snapshot_table = BalanceSnapshot.__table__
+    for account_id, period_start in written:
+        connection.execute(
+            snapshot_table.update()
+            .where(and_(snapshot_table.c.account_id == account_id, snapshot_table.c.as_of >= period_start))
+            .values(balance=snapshot_table.c.balance + periods[(account_id, period_start)])
+        )
+    if written:
+        from app import ledger
+        for account_id, period_start in written:
+            existing = connection.execute(select([snapshot_table.c.as_of]).where(and_(
+                snapshot_table.c.account_id == account_id, snapshot_table.c.as_of == period_start))).first()
+            if existing is None:
+                connection.execute(snapshot_table.insert().values(
+                    account_id=account_id, as_of=period_start, balance=ledger.balance_at(account_id, period_start)))
+
+
+def apply_rollup_effects(connection, effects):
+    """
+    Adds (key, total, paid total, count) effects to the monthly rollups, creating the missing rows.
+    Effects are summed per key first, so a batch costs one statement per user, account, category, type and month.
+    """
+    deltas = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+    for key, total, paid_total, count in effects:
+        delta = deltas[key]
+        delta[0] += total
+        delta[1] += paid_total
+        delta[2] += count
+    table = TransactionRollup.__table__
+    key_columns = list(table.primary_key.columns)
+    for key, (total, paid_total, count) in deltas.items():
+        if not (total or paid_total or count):
+            continue
+        row = dict(zip([column.key for column in key_columns], key), total=total, paid_total=paid_total, count=count)
+        if connection.dialect.name == 'postgresql':
+            statement = postgresql.insert(table).values(row)
+            connection.execute(statement.on_conflict_do_update(index_elements=key_columns, set_={
+                'total': table.c.total + statement.excluded.total,
+                'paid_total': table.c.paid_total + statement.excluded.paid_total,
+                'count': table.c.count + statement.excluded.count}))
+            continue
+        updated = connection.execute(
+            table.update().where(and_(*[column == value for column, value in zip(key_columns, key)]))
+            .values(total=table.c.total + total, paid_total=table.c.paid_total + paid_total,
+                    count=table.c.count + count))
+        if updated.rowcount == 0:
+            connection.execute(table.insert().values(row))
+
+
+def previous_value(target, column):
+    """
+    Value of `column` before the pending update (the current one when it did not change).
+    Only reliable for active history attributes (see below): expired instances have no previous value otherwise.
+    """
+    history = inspect(target).attrs[column].history
+    return history.deleted[0] if history.deleted else getattr(target, column)
+
+
+def ledger_values(target, previous=False):
+    """
+    Ledger columns of `target`, as they are now or as they were before the pending update
+    """
+    if previous:
+        return {column: previous_value(target, column) for column in target.ledger_columns}
+    return {column: getattr(target, column) for column in target.ledger_columns}
+
+
+def defer_ledger_effects(ledger_effects, rollup_effects):
+    """
+    Queues the effects of one flushed row: they are applied together once every row of the flush is written
+    (apply_flushed_ledger_effects). Applied row by row, the first row would create a missing snapshot from a
+    ledger that already holds the rows flushed with it, and their own effects would then shift it again.
+    """
+    pending = db.session.info.setdefault('ledger_effects', ([], []))
+    pending[0].extend(ledger_effects)
+    pending[1].extend(rollup_effects)
+
+
+def maintain_balance_on_insert(mapper, connection, target):
+    values = ledger_values(target)
+    defer_ledger_effects(target.ledger_effects(values), target.rollup_effects(values))
+
+
+def maintain_balance_on_update(mapper, connection, target):
+    previous, values = ledger_values(target, previous=True), ledger_values(target)
+    defer_ledger_effects(target.ledger_effects(previous, sign=-1) + target.ledger_effects(values),
+                         target.rollup_effects(previous, sign=-1) + target.rollup_effects(values))
+
+
+def maintain_balance_on_delete(mapper, connection, target):
+    previous = ledger_values(target, previous=True)
+    defer_ledger_effects(target.ledger_effects(previous, sign=-1), target.rollup_effects(previous, sign=-1))
+
+
+def forget_ledger_effects(session, flush_context, instances):
+    # left over by a flush that failed before its end
+    session.info.pop('ledger_effects', None)
+
+
+def apply_flushed_ledger_effects(session, flush_context):
+    ledger_effects, rollup_effects = session.info.pop('ledger_effects', ([], []))
+    if ledger_effects:
+        apply_ledger_effects(session.connection(), ledger_effects)
+    if rollup_effects:
+        apply_rollup_effects(session.connection(), rollup_effects)
+
+
+def load_previous_value(target, value, oldvalue, initiator):
+    pass
+
+
+for ledger_model in (Transfer, Transaction):
+    # load the value being replaced even on expired instances (every instance after a commit), otherwise
+    # the history has no deleted value and the update cannot revert the previous effect
+    for ledger_column in ledger_model.ledger_columns:
+        event.listen(getattr(ledger_model, ledger_column), 'set', load_previous_value, active_history=True)
+    event.listen(ledger_model, 'after_insert', maintain_balance_on_insert)
+    event.listen(ledger_model, 'after_update', maintain_balance_on_update)
+    event.listen(ledger_model, 'after_delete', maintain_balance_on_delete)
+event.listen(db.session, 'before_flush', forget_ledger_effects)
+event.listen(db.session, 'after_flush', apply_flushed_ledger_effects)
+# the previous owner of an account gets its data version bumped too
+event.listen(Account.user_id, 'set', load_previous_value, active_history=True)
@@ -0,0 +1,143 @@
+"""
+Monthly range partitions of `transaction` on PostgreSQL
+
+Optional: the table is only partitioned when migration 9c2e5b7d4a10 ran with TRANSACTION_PARTITIONING=1.
+Partitions are named transaction_YYYY_MM and rows outside them land in transaction_default, so future
+partitions are created ahead of time: by every gunicorn worker as it boots (gunicorn_conf.post_fork) and by
+`manage.py create_partitions` (e.g. from a monthly cron, for deployments that rarely restart). A partition
+created late takes over the rows the default partition holds for its month.
+
+The models keep the unpartitioned schema: the partitions, the plain id index replacing the primary key and
+the missing transaction_tag foreign key are left out of autogenerate (see migrations/env.py).
+
+What the planner prunes:
+- ranges on date_created: ledger scans and balance series between two dates, and keyset pages after a cursor
+  (date_created > x OR date_created = x AND ...), skip the partitions outside the range;
+- an upper bound only (ledger_delta and balance_at with no snapshot before the moment, start=None) skips the
+  partitions after it but reads every older one;
+- first keyset pages have no bound: PostgreSQL 12+ scans the partitions in date order and stops at the LIMIT.
+Lookups without date_created (Transaction.query.get by id, filters on account or user alone) are not pruned:
+they probe the id or account index of every partition. Pruning those would need the date in the API (or a
+partition key the clients know) and is out of scope here.
+The plain table keeps working everywhere else (sqlite included).
+"""
+
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import database, models
+
+db = database.AppRepository.db
+logger = logging.getLogger(__name__)
+
+PARENT = 'transaction'
+DEFAULT = 'transaction_default'
+PARTITION_RE = re.compile(r'^transaction_(\d{4}_\d{2}|default)$')
+# index migration 9c2e5b7d4a10 creates in place of the primary key, which a partitioned table cannot have on id
+ID_INDEX = 'ix_transaction_id'
+# pg_advisory_xact_lock key of ensure_partitions: the workers booting together create the partitions one at a time
+LOCK_KEY = 7105201
+
+
+def partition_name(month_start):
+    return 'transaction_{:%Y_%m}'.format(month_start)
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def months_between(first, last):
+    current = month_start(first)
+    while current <= last:
+        yield current
+        current = models.next_period_start(current)
+
+
+def is_partitioned(connection):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+        'WHERE c.relname = :name)'), name=PARENT).scalar()
+
+
+def partition_exists(connection, name):
+    return connection.execute(text('SELECT to_regclass(:name) IS NOT NULL'), name=name).scalar()
+
+
+def create_partition(connection, start):
+    """
+    Creates the partition of the month starting at `start`. Rows of that month already in the default partition
+    would make CREATE ... PARTITION OF fail, so the default partition is detached while they move to the new one.
+    Detaching locks the whole table until the transaction ends.
+    """
+    name = partition_name(start)
+    if partition_exists(connection, name):
+        return
+    values = {'name': name, 'parent': PARENT, 'default': DEFAULT, 'start': start.isoformat(),
+              'end': models.next_period_start(start).isoformat()}
+    in_range = "date_created >= '{start}' AND date_created < '{end}'".format(**values)
+    late = connection.execute('SELECT EXISTS (SELECT 1 FROM {} WHERE {})'.format(DEFAULT, in_range)).scalar()
+    if late:
+        connection.execute('ALTER TABLE "{parent}" DETACH PARTITION {default}'.format(**values))
+    connection.execute(
+        'CREATE TABLE {name} PARTITION OF "{parent}" FOR VALUES FROM (\'{start}\') TO (\'{end}\')'.format(**values))
+    if late:
+        connection.execute('WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING *) '
+                           'INSERT INTO {name} SELECT * FROM moved'.format(in_range=in_range, **values))
+        connection.execute('ALTER TABLE "{parent}" ATTACH PARTITION {default} DEFAULT'.format(**values))
+
+
+def ensure_partitions(connection=None, months_ahead=None, first=None):
+    """
+    Creates the missing monthly partitions from `first` (default: this month) up to `months_ahead` months from now.
+    Returns the names of the partitions it checked, or an empty list when the table is not partitioned.
+    """
+    connection = connection or db.session.connection()
+    if not is_partitioned(connection):
+        return []
+    connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), key=LOCK_KEY)
+    months_ahead = models.config.TRANSACTION_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    last = datetime.utcnow()
+    for _ in range(months_ahead):
+        last = models.next_period_start(last)
+    names = []
+    for start in months_between(first or datetime.utcnow(), last):
+        create_partition(connection, start)
+        names.append(partition_name(start))
+    return names
+
+
+def ensure_partitions_at_boot(app):
+    """
+    ensure_partitions in its own transaction, for a worker booting. Failures are only logged: meanwhile the rows
+    of a missing month go to the default partition.
+    """
+    with app.app_context():
+        try:
+            names = ensure_partitions()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception('could not create the upcoming transaction partitions')
+            return []
+    return names
+
+
+def changed_by_partitioning(object, name, type_, reflected, compare_to):
+    """
+    True for the schema differences of a partitioned transaction table with the models, which autogenerate
+    must not undo: the partitions, the id index and the foreign key of transaction_tag to transaction
+    """
+    if type_ == 'table':
+        return reflected and PARTITION_RE.match(name) is not None
+    if type_ == 'index':
+        return reflected and compare_to is None and name == ID_INDEX
+    if type_ == 'foreign_key_constraint':
+        return (not reflected and compare_to is None and object.parent.name == 'transaction_tag'
+                and object.referred_table.name == PARENT)
+    return False
@@ -1,14 +1,23 @@
-from functools import wraps
+from functools import wraps, lru_cache
+import hashlib
 import re
+import time
+from datetime import datetime
 
-from flask import request, g, Response
+from flask import current_app, request, g, Response, stream_with_context
 from flask_restful import Resource
+from sqlalchemy.orm import joinedload, selectinload
 
-from app import config as config_module, domain
+from app import config as config_module, api, database, domain, serializers, batch, importers, rollups
 # from app.domain import Account, User
 
 config = config_module.get_config()
 
+FIRST_CAP_RE = re.compile('(.)([A-Z][a-z]+)')
+ALL_CAP_RE = re.compile('([a-z0-9])([A-Z])')
+KEY_CACHE_SIZE = 2048
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -18,6 +27,33 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def api_token_required(f):
+    """
+    Internal endpoints: only the API-TOKEN header authenticates, a logged user is not enough
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not api.authenticate_api(request.headers.get('API-TOKEN')):
+            return Response('{"result": "Not Authorized"}', 401, content_type='application/json')
+        return f(*args, **kwargs)
+    return decorated_function
+
+def conditional(f):
+    """
+    Conditional GET keyed on the logged user's data version. A matching If-None-Match answers 304 before
+    the resource runs any query; otherwise the ETag is attached to the response by the after_request hook.
+    """
+    @wraps(f)
+    def decorated_function(self, *args, **kwargs):
+        etag = self.data_etag()
+        if etag is None:
+            return f(self, *args, **kwargs)
+        g.etag = etag
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304)
+        return f(self, *args, **kwargs)
+    return decorated_function
+
 def not_allowed(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -30,23 +66,48 @@ class ResourceBase(Resource):
     entity_key = None
     resource_key = None
     list_compact = True
+    serializer = None
+    # loader options (eager loading strategies) of the entities the endpoint lists
+    loader_options = ()
+
+    class InvalidPagination(Exception):
+        pass
 
     def __init__(self):
-        self.me = getattr(g, 'user_entity', None)
-        if self.me is None and self.logged_user is not None:
-            self.me = domain.User.create_with_logged(self.logged_user)
         if self.me is not None:
             self.me.entity_key = self.entity_key
             self.me.resource_key = self.resource_key
 
+    def dispatch_request(self, *args, **kwargs):
+        database.read_from_replicas(request.method == 'GET' and not self.reads_own_writes)
+        return super(ResourceBase, self).dispatch_request(*args, **kwargs)
+
+    @property
+    def reads_own_writes(self):
+        try:
+            return float(request.cookies.get(database.PRIMARY_READS_COOKIE) or 0) > time.time()
+        except ValueError:
+            return False
+
+    @property
+    def me(self):
+        """
+        The logged user as a lazy LoggedUser kept on `g`. Its row is only loaded when more than id/email/name is needed.
+        """
+        me = g.get('user_entity')
+        if me is None and self.logged_user is not None:
+            me = g.user_entity = domain.LoggedUser(self.logged_user)
+        return me
 
     @staticmethod
+    @lru_cache(maxsize=KEY_CACHE_SIZE)
     def camel_to_snake(name):
-        s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-        return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
+        s1 = FIRST_CAP_RE.sub(r'\1_\2', name)
+        return ALL_CAP_RE.sub(r'\1_\2', s1).lower()
 
 
     @staticmethod
+    @lru_cache(maxsize=KEY_CACHE_SIZE)
     def snake_to_camel(name):
         result = []
         for index, part in enumerate(name.split('_')):
@@ -62,13 +123,20 @@ class ResourceBase(Resource):
             return {method(key): self.transform_key(value, method) for key, value in data.items()}
         if isinstance(data, list):
             for index, item in enumerate(data):
-                if isinstance(item, dict):
-                    data[index] = {method(key): self.transform_key(value, method) for key, value in item.items()}
+                if isinstance(item, (dict, list)):
+                    data[index] = self.transform_key(item, method)
         return data
 
 
     @property
     def payload(self):
+        """
+        Request data (json, form and args) with snake_case keys. Parsed once and kept on `g` for the rest of the request.
+        """
+        payload = g.get('payload')
+        if payload is not None:
+            return payload
+        g.payload_parses = g.get('payload_parses', 0) + 1
         payload = {}
         if request.json:
             payload.update(self.transform_key(request.json, self.camel_to_snake))
@@ -78,8 +146,71 @@ class ResourceBase(Resource):
             payload.update(self.transform_key(request.args, self.camel_to_snake))
         if request.files:
             payload['attachment'] = request.files
+        g.payload = payload
         return payload
 
+    @property
+    def pagination(self):
+        """
+        `limit` and `cursor` query params. Raises InvalidPagination when limit is not a positive number.
+        """
+        limit = self.payload.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                raise self.InvalidPagination('limit must be a number')
+            if limit <= 0:
+                raise self.InvalidPagination('limit must be positive')
+        return {'limit': limit, 'cursor': self.payload.get('cursor')}
+
+    @property
+    def stream_format(self):
+        """
+        'ndjson' when the client accepts application/x-ndjson, 'json' for `stream=1` and None when not streaming
+        """
+        if request.accept_mimetypes.best == NDJSON_MIMETYPE:
+            return 'ndjson'
+        if self.payload.get('stream') in ('1', 'true'):
+            return 'json'
+        return None
+
+    def data_etag(self):
+        if self.me is None:
+            return None
+        version = domain.User.get_data_version(self.me.id)
+        if version is None:
+            return None
+        variant = '{} {}'.format(request.full_path, request.headers.get('Accept', ''))
+        return '{}-{}-{}'.format(self.me.id, version, hashlib.md5(variant.encode('utf-8')).hexdigest()[:12])
+
+    def stream_response(self, rows):
+        """
+        Writes the serialized rows as they are fetched, so memory does not grow with the collection size
+        """
+        serializer = self.fieldset
+        if self.stream_format == 'ndjson':
+            chunks, mimetype = serializer.iter_ndjson(rows), NDJSON_MIMETYPE
+        else:
+            chunks, mimetype = serializer.iter_json(rows), 'application/json'
+        return Response(stream_with_context(chunks), 200, mimetype=mimetype)
+
+    @property
+    def fieldset(self):
+        """
+        The resource serializer restricted to the camelCase `fields` query param, so only those columns are selected
+        """
+        fields = self.payload.get('fields')
+        if not fields:
+            return self.serializer
+        return self.serializer.only(self.camel_to_snake(field.strip()) for field in fields.split(',') if field.strip())
+
+    def return_invalid_fields(self, ex):
+        return self.response({'erro': 'Invalid fields.', 'internal_code': str(ex)}), 400
+
+    def return_invalid_pagination(self):
+        return self.response({'erro': 'Invalid pagination.'}), 400
+
     @property
     def cookies(self):
         username = request.cookies.get('baseUserName', None)
@@ -104,9 +235,18 @@ class ResourceBase(Resource):
         return self.transform_key(data_dict, self.snake_to_camel)
 
     def get_list(self, **kwargs):
+        """
+        Entities `get_list` return a page of entities and the cursor of the next page
+        """
         try:
-            entity_list = self.me.get_list(self.payload, **kwargs)
-            return [self.response(entity.as_dict(compact=self.list_compact)) for entity in entity_list]
+            entity_list, next_cursor = self.me.get_list(self.payload, **dict(kwargs, **self.pagination))
+            return self.response({
+                'result': 'success',
+                'data': [entity.as_dict(compact=self.list_compact) for entity in entity_list],
+                'next_cursor': next_cursor
+            })
+        except (self.InvalidPagination, domain.Entity.InvalidCursor):
+            return self.return_invalid_pagination()
         except Exception as ex:
             return self.return_unexpected_error(ex)
 
@@ -199,125 +339,225 @@ class ResourceBase(Resource):
 class AccountResource(ResourceBase):
     http_methods_allowed = ['GET', 'POST', 'PUT']
     entity = domain.Account
+    serializer = serializers.account
 
+    @login_required
+    @conditional
     def get(self, account_id=None, user_id=None):
         try:
-            # self.entity.create_new(self.payload)
-            domain.Account.get_user_accounts(21)
-            # return self.response({'result': 'success', 'data': account_data})
-
-            # if account_id:
-            #     account_data = domain.Account.get_account(account_id)
-            #     return self.response({'result': 'success', 'data': account_data})
-            #
-            # if user_id:
-            #     user_accounts = domain.Account.get_user_accounts(user_id)
-            #     return self.response({'result': 'success', 'data': user_accounts})
-            user_accounts = {
-                '1': {
-                    'account_name': "CC Itau",
-                    'account_balance': 221.58
-                },
-                '2': {
-                    'account_name': "CP Itau",
-                    'account_balance': 1221.58
-                }
-            }
-            return self.response(user_accounts)
-            # return self.response({'result': 'GET OK', 'data': 'nothing to return'})
+            if user_id is not None and user_id != self.me.id:
+                return "Item doesn't exist", 404
+            serializer = self.fieldset
+            if account_id:
+                account = self.entity.get_account(account_id, self.me.id, columns=serializer.columns)
+                if account is None:
+                    return "Item doesn't exist", 404
+                return serializer.item_response(account)
+            if self.stream_format:
+                return self.stream_response(self.entity.stream_user_accounts(self.me.id, columns=serializer.columns))
+            accounts, next_cursor = self.entity.get_user_accounts(self.me.id, columns=serializer.columns, **self.pagination)
+            return serializer.page_response(accounts, next_cursor)
+        except serializers.ModelSerializer.UnknownField as ex:
+            return self.return_invalid_fields(ex)
+        except (self.InvalidPagination, domain.Entity.InvalidCursor):
+            return self.return_invalid_pagination()
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
+
+    @login_required
+    def post(self, account_id=None, user_id=None):
+        try:
+            if account_id is not None or (user_id is not None and user_id != self.me.id):
+                return self.return_not_allowed()
+            account_id = self.entity.create_account(self.me.id, self.payload)
+            return serializers.account.item_response(self.entity.get_account(account_id, self.me.id), 201)
+        except self.entity.InvalidEntityData as ex:
+            return self.response({'erro': 'Invalid data.', 'internal_code': str(ex)}), 400
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
+
+    @login_required
+    def put(self, account_id=None, user_id=None):
+        try:
+            if account_id is None:
+                return self.return_not_allowed()
+            self.entity.update_account(account_id, self.me.id, self.payload)
+            return serializers.account.item_response(self.entity.get_account(account_id, self.me.id))
+        except self.entity.NotExist:
+            return "Item doesn't exist", 404
+        except self.entity.InvalidEntityData as ex:
+            return self.response({'erro': 'Invalid data.', 'internal_code': str(ex)}), 400
         except Exception as ex:
             return self.return_unexpected_error(ex)
 
-    # def post(self, user_id):
-    #     try:
-    #         if user_id:
-    #             # TODO: passar nome da conta e tipo da conta no payload
-    #             account_created = domain.Account.create_account(user_id)
-    #             return self.response({'result': 'success', 'data': account_created})
-    #
-    #         return self.response({'result': 'POST OK', 'data': 'nothing to return'})
-    #     except Exception as ex:
-    #         return self.return_unexpected_error(ex)
-
-    # def put(self, account_id):
-    #     try:
-    #         if account_id:
-    #             account_data = domain.Account.update_account(account_id)
-    #             return self.response({'result': 'success', 'data': account_data})
-    #
-    #         return self.response({'result': 'PUT OK', 'data': 'nothing to return'})
-    #     except Exception as ex:
-    #         return self.return_unexpected_error(ex)
-
-# class TransferResource(ResourceBase):
-#     http_methods_allowed = ['GET', 'POST']
-#
-#     def get(self, account_id=None, transfer_id=None):
-#         try:
-#             if account_id:
-#                 account_transfers = Transfer.get_account_transfers(account_id)
-#                 return self.response({'result': 'success', 'data': account_transfers})
-#
-#             if transfer_id:
-#                 transfer_data = Transfer.get_transfer(transfer_id)
-#                 return self.response({'result': 'success', 'data': transfer_data})
-#
-#             return self.response({'result': 'GET OK', 'data': 'nothing to return'})
-#         except Exception as ex:
-#             return self.return_unexpected_error(ex)
-#
-#     def post(self, user_id):
-#         try:
-#             if user_id:
-#                 # TODO: passar contas da transferencia no payload (from to)
-#                 transfer_realized = Transfer.create_transfer(user_id)
-#                 return self.response({'result': 'success', 'data': transfer_realized})
-#
-#             return self.response({'result': 'POST OK', 'data': 'nothing to return'})
-#         except Exception as ex:
-#             return self.return_unexpected_error(ex)
-#
-#
-# class TransactionResource(ResourceBase):
-#     http_methods_allowed = ['GET', 'POST', 'PUT']
-#
-#     def get(self, transaction_id=None, user_id=None):
-#         try:
-#             if transaction_id:
-#                 transaction_data = Transaction.get_transaction(transaction_id)
-#                 return self.response({'result': 'success', 'data': transaction_data})
-#
-#             if user_id:
-#                 # TODO: passar se quer despesas ou receitas no payload
-#                 user_incomes = Transaction.get_user_incomes(user_id)
-#                 user_expenses = Transaction.get_user_expenses(user_id)
-#                 return self.response({'result': 'success', 'data': 'user_something'})
-#
-#             return self.response({'result': 'GET OK', 'data': 'nothing to return'})
-#         except Exception as ex:
-#             return self.return_unexpected_error(ex)
-#
-#     def post(self, user_id):
-#         try:
-#             if user_id:
-#                 # TODO: passar se cria despesa ou receita
-#                 income = Transaction.create_income(user_id)
-#                 expense = Transaction.create_expense(user_id)
-#                 return self.response({'result': 'success', 'data': 'money_in_or_out'})
-#
-#             return self.response({'result': 'POST OK', 'data': 'nothing to return'})
-#         except Exception as ex:
-#             return self.return_unexpected_error(ex)
-#
-#     def put(self, transaction_id):
-#         try:
-#             if transaction_id:
-#                 transaction_data = Transaction.update_transaction(transaction_id)
-#                 return self.response({'result': 'success', 'data': transaction_data})
-#
-#             return self.response({'result': 'PUT OK', 'data': 'nothing to return'})
-#         except Exception as ex:
-#             return self.return_unexpected_error(ex)
+
+class AccountBalanceResource(ResourceBase):
+    """
+    Balance of an account at the end of `date`, or the daily balances from `start` to `end` (YYYY-MM-DD).
+    Balances are decimal strings.
+    """
+    http_methods_allowed = ['GET']
+    max_series_days = 3660
+
+    @staticmethod
+    def parse_day(value):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    @login_required
+    @conditional
+    def get(self, account_id):
+        try:
+            if domain.Account.get_account(account_id, self.me.id) is None:
+                return "Item doesn't exist", 404
+            payload = self.payload
+            if 'start' in payload and 'end' in payload:
+                first_day, last_day = self.parse_day(payload['start']), self.parse_day(payload['end'])
+                if not 0 <= (last_day - first_day).days < self.max_series_days:
+                    raise ValueError('start and end must be at most {} days apart'.format(self.max_series_days))
+                series = domain.Account.get_balance_series(account_id, first_day, last_day)
+                data = [{'date': day.isoformat(), 'balance': rollups.amount(balance)} for day, balance in series]
+            else:
+                day = self.parse_day(payload['date']) if 'date' in payload else datetime.utcnow().date()
+                data = {'date': day.isoformat(), 'balance': rollups.amount(domain.Account.get_balance_at(account_id, day))}
+            return self.response({'result': 'success', 'data': data})
+        except ValueError as ex:
+            return self.response({'erro': 'Invalid data.', 'internal_code': str(ex)}), 400
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
+
+
+class DashboardResource(ResourceBase):
+    """
+    Monthly dashboard totals of the logged user from `start` to `end` (YYYY-MM, default: the last 12 months)
+    """
+    http_methods_allowed = ['GET']
+    max_months = 120
+
+    @staticmethod
+    def parse_month(value):
+        return datetime.strptime(value, '%Y-%m')
+
+    @login_required
+    @conditional
+    def get(self):
+        try:
+            payload = self.payload
+            now = datetime.utcnow()
+            last_month = self.parse_month(payload['end']) if 'end' in payload else datetime(now.year, now.month, 1)
+            if 'start' in payload:
+                first_month = self.parse_month(payload['start'])
+            else:
+                first_month = datetime(last_month.year - 1 + (last_month.month + 1) // 13, last_month.month % 12 + 1, 1)
+            months = (last_month.year - first_month.year) * 12 + last_month.month - first_month.month
+            if not 0 <= months < self.max_months:
+                raise ValueError('start and end must be at most {} months apart'.format(self.max_months))
+            data = domain.User.get_dashboard(self.me.id, first_month, last_month)
+            return self.response({'result': 'success', 'data': data})
+        except ValueError as ex:
+            return self.response({'erro': 'Invalid data.', 'internal_code': str(ex)}), 400
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
+
+
+class StatementImportResource(ResourceBase):
+    """
+    Imports an uploaded bank statement (`file`, CSV or OFX) into one of the logged user's accounts
+    """
+    http_methods_allowed = ['POST']
+    csv_options = ('encoding', 'date_column', 'description_column', 'amount_column', 'memo_column',
+                   'date_format')
+
+    @login_required
+    def post(self, account_id):
+        try:
+            if domain.Account.get_account(account_id, self.me.id) is None:
+                return "Item doesn't exist", 404
+            statement = request.files.get('file')
+            if statement is None:
+                return self.response({'erro': 'Invalid data.', 'internal_code': 'missing_file'}), 400
+            statement_format = self.payload.get('format') or statement.filename.rsplit('.', 1)[-1]
+            option_keys = self.csv_options if statement_format.lower() == 'csv' else ('encoding',)
+            options = {key: self.payload[key] for key in option_keys if key in self.payload}
+            report = domain.Account.import_statement(account_id, self.me.id, statement.stream, statement_format, **options)
+            return self.response({'result': 'success', 'data': report.as_dict()}), 201
+        except importers.InvalidStatement as ex:
+            domain.Account.repository.rollback_db()
+            return self.response({'erro': 'Invalid statement.', 'internal_code': str(ex)}), 400
+        except Exception as ex:
+            domain.Account.repository.rollback_db()
+            return self.return_unexpected_error(ex)
+
+
+class TransferResource(ResourceBase):
+    """
+    Transfers from or to one of the logged user's accounts, with both account names
+    """
+    http_methods_allowed = ['GET', 'POST']
+    entity = domain.Transfer
+    # both accounts are many-to-one: joined into the page query, so a page costs one query
+    loader_options = (joinedload('source'), joinedload('destination'))
+
+    @login_required
+    @conditional
+    def get(self, account_id):
+        try:
+            if domain.Account.get_account(account_id, self.me.id) is None:
+                return "Item doesn't exist", 404
+            transfers, next_cursor = self.entity.get_account_transfers(
+                account_id, options=self.loader_options, **self.pagination)
+            return serializers.transfer.instance_page_response(transfers, next_cursor)
+        except (self.InvalidPagination, domain.Entity.InvalidCursor):
+            return self.return_invalid_pagination()
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
+
+    @login_required
+    def post(self, account_id):
+        try:
+            if domain.Account.get_account(account_id, self.me.id) is None:
+                return "Item doesn't exist", 404
+            transfer_id = self.entity.create_transfer(account_id, self.me.id, self.payload)
+            return serializers.transfer.item_response(self.entity.get_transfer(transfer_id), 201)
+        except self.entity.InvalidEntityData as ex:
+            return self.response({'erro': 'Invalid data.', 'internal_code': str(ex)}), 400
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
+
+
+class TransactionResource(ResourceBase):
+    """
+    Transactions of the logged user with their account, category and tags
+    """
+    http_methods_allowed = ['GET', 'POST']
+    entity = domain.Transaction
+    # account and category are many-to-one and joined; tags are many-to-many, loaded by one IN query per page
+    loader_options = (joinedload('account'), joinedload('category'), selectinload('tags'))
+
+    @login_required
+    @conditional
+    def get(self, user_id=None):
+        try:
+            if user_id is not None and user_id != self.me.id:
+                return "Item doesn't exist", 404
+            transactions, next_cursor = self.entity.get_user_transactions(
+                self.me.id, options=self.loader_options, **self.pagination)
+            return serializers.transaction.instance_page_response(transactions, next_cursor)
+        except (self.InvalidPagination, domain.Entity.InvalidCursor):
+            return self.return_invalid_pagination()
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
+
+    @login_required
+    def post(self, user_id=None):
+        try:
+            if user_id is not None and user_id != self.me.id:
+                return "Item doesn't exist", 404
+            transaction_id = self.entity.create_transaction(self.me.id, self.payload)
+            return serializers.transaction.item_response(self.entity.get_transaction(transaction_id, self.me.id), 201)
+        except self.entity.InvalidEntityData as ex:
+            return self.response({'erro': 'Invalid data.', 'internal_code': str(ex)}), 400
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
 
 
 class UserResource(ResourceBase):
@@ -326,7 +566,7 @@ class UserResource(ResourceBase):
 
     def get(self):
         try:
-            users = self.entity.list_all()
+            users, next_cursor = self.entity.list_row_page(**self.pagination)
             users_dict = {}
             for user in users:
                 users_dict[str(user.id)] = {
@@ -334,7 +574,9 @@ class UserResource(ResourceBase):
                     'email': user.email
                 }
 
-            return self.response({'result': 'success', 'data': users_dict})
+            return self.response({'result': 'success', 'data': users_dict, 'next_cursor': next_cursor})
+        except (self.InvalidPagination, domain.Entity.InvalidCursor):
+            return self.return_invalid_pagination()
         except Exception as ex:
             return self.return_unexpected_error(ex)
 
@@ -381,8 +623,34 @@ class MeResource(ResourceBase):
             return self.return_unexpected_error(ex)
 
 
+class BatchResource(ResourceBase):
+    """
+    Runs an ordered list of sub-requests ({method, path, body, headers}) in this request and its database session.
+    With `atomic` the whole batch is rolled back on the first failed item.
+    """
+    http_methods_allowed = ['POST']
+
+    @login_required
+    def post(self):
+        try:
+            data = request.get_json(silent=True) or {}
+            items = data.get('requests')
+            batch.validate(items, config.BATCH_MAX_REQUESTS)
+            results, committed = batch.run(current_app._get_current_object(), items, atomic=bool(data.get('atomic')))
+            return {'result': batch.outcome(results, committed), 'committed': committed, 'responses': results}, 200
+        except batch.InvalidBatch as ex:
+            return self.response({'erro': 'Invalid batch.', 'internal_code': str(ex)}), 400
+        except Exception as ex:
+            return self.return_unexpected_error(ex)
+
+
 class HealthcheckResource(Resource):
+    # services exposing internal stats, behind the API token
+    stats_services = ('cache', 'pool', 'replicas')
+
     def get(self, service=None):
+        if service in self.stats_services:
+            return self.get_stats(service)
         if service is None:
             return {"result": "OK"}, 200
         else:
@@ -391,3 +659,13 @@ class HealthcheckResource(Resource):
                     return {"result": "OK"}, 200
                 except:
                     return {"result": "NOT"}, 200
+
+    @api_token_required
+    def get_stats(self, service):
+        if service == 'cache':
+            return {"result": "OK", "identity": domain.identity_cache.stats(),
+                    "collections": domain.collection_cache.stats()}, 200
+        if service == 'pool':
+            return {"result": "OK", "pools": database.AppRepository.db.pool_stats()}, 200
+        router = database.AppRepository.db.router
+        return {"result": "OK", "lag": router.stats() if router is not None else {}}, 200
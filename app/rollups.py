@@ -0,0 +1,93 @@
+"""
+Monthly transaction rollups for the dashboard
+
+TransactionRollup holds the sums and counts of every (user, account, category, type, month), so dashboard
+queries read a few rows per month instead of the user's whole ledger. The rows are maintained by
+models.apply_rollup_effects on every transaction write; `rebuild` recomputes them from the ledger.
+"""
+
+from decimal import Decimal
+
+from sqlalchemy import case, func
+
+from app import database, models
+
+db = database.AppRepository.db
+Transaction = models.Transaction
+TransactionRollup = models.TransactionRollup
+CENT = Decimal('0.01')
+
+
+def month_of(column):
+    if db.session.bind.dialect.name == 'postgresql':
+        return func.date_trunc('month', column)
+    # sqlite keeps DateTime as text in the SQLAlchemy storage format
+    return func.strftime('%Y-%m-01 00:00:00.000000', column)
+
+
+def rebuild(user_id=None):
+    """
+    Recomputes the rollups of one user (or all of them) with a single INSERT ... SELECT ... GROUP BY
+    """
+    key = (Transaction.user_id, func.coalesce(Transaction.account_id, 0), func.coalesce(Transaction.category_id, 0),
+           func.coalesce(Transaction.transaction_type, 0), month_of(Transaction.date_created))
+    transactions = db.session.query(
+        *key + (func.sum(Transaction.value), func.sum(case([(Transaction.paid == True, Transaction.value)], else_=0)),
+                func.count(Transaction.id))
+    ).filter(Transaction.user_id != None, Transaction.date_created != None, Transaction.value != None)
+    deleted = db.session.query(TransactionRollup)
+    if user_id is not None:
+        transactions = transactions.filter(Transaction.user_id == user_id)
+        deleted = deleted.filter(TransactionRollup.user_id == user_id)
+    deleted.delete(synchronize_session=False)
+    return db.session.execute(TransactionRollup.__table__.insert().from_select(
+        ['user_id', 'account_id', 'category_id', 'transaction_type', 'month', 'total', 'paid_total', 'count'],
+        transactions.group_by(*key).statement)).rowcount
+
+
+def amount(value):
+    """
+    Money as an exact decimal string (a float would round the cents of large sums)
+    """
+    return str(Decimal(value or 0).quantize(CENT))
+
+
+def dashboard(user_id, first_month, last_month):
+    """
+    Per month totals of the user between first_month and last_month (inclusive, month starts):
+    spending and income per category, income vs. expense, and income vs. expense over the accounts shown
+    on the dashboard (`sum_on_dash`). Reads rollup rows only. Amounts are decimal strings.
+    """
+    end = models.next_period_start(last_month)
+    in_range = (TransactionRollup.user_id == user_id, TransactionRollup.month >= first_month,
+                TransactionRollup.month < end)
+    totals = (func.sum(TransactionRollup.total), func.sum(TransactionRollup.paid_total),
+              func.sum(TransactionRollup.count))
+
+    def rows(query, *names):
+        return [dict(zip(names, row[:-3]), month=row[0].strftime('%Y-%m'), total=amount(row[-3]),
+                     paid_total=amount(row[-2]), count=int(row[-1] or 0)) for row in query]
+
+    categories = db.session.query(TransactionRollup.month, TransactionRollup.category_id,
+                                  TransactionRollup.transaction_type, *totals)\
+        .filter(*in_range)\
+        .group_by(TransactionRollup.month, TransactionRollup.category_id, TransactionRollup.transaction_type)\
+        .order_by(TransactionRollup.month, TransactionRollup.category_id)
+    types = db.session.query(TransactionRollup.month, TransactionRollup.transaction_type, *totals)\
+        .filter(*in_range)\
+        .group_by(TransactionRollup.month, TransactionRollup.transaction_type)\
+        .order_by(TransactionRollup.month, TransactionRollup.transaction_type)
+    dash_accounts = db.session.query(models.Account.id)\
+        .filter(models.Account.user_id == user_id, models.Account.sum_on_dash == True)
+    dash = db.session.query(TransactionRollup.month, TransactionRollup.transaction_type, *totals)\
+        .filter(TransactionRollup.account_id.in_(dash_accounts), *in_range)\
+        .group_by(TransactionRollup.month, TransactionRollup.transaction_type)\
+        .order_by(TransactionRollup.month, TransactionRollup.transaction_type)
+    balance = db.session.query(func.sum(models.Account.balance))\
+        .filter(models.Account.user_id == user_id, models.Account.sum_on_dash == True).scalar()
+    return {
+        'categories': rows(categories, 'month', 'category_id', 'transaction_type'),
+        'types': rows(types, 'month', 'transaction_type'),
+        'dash_types': rows(dash, 'month', 'transaction_type'),
+        'dash_balance': amount(balance)
+    }
@@ -0,0 +1,154 @@
+"""
+Compiled serializers
+
+Each serializer compiles, once at import, the list of columns it selects and how each one is written as
+camelCase JSON. Rows coming from `query` are plain tuples in the same order and are written in a single pass,
+skipping the `to_dict` + `transform_key` round trip. List endpoints that need relationships pass eager loaded
+instances to `dump_instance` instead, which writes the same columns and then the `related` values.
+Amounts (Numeric columns) are written as decimal strings.
+"""
+
+import json
+
+from flask import Response
+from sqlalchemy import types
+
+from app import database, models
+
+db = database.AppRepository.db
+
+
+def snake_to_camel(name):
+    parts = name.split('_')
+    return ''.join([parts[0].lower()] + [part.capitalize() for part in parts[1:]])
+
+
+def json_string(value):
+    return json.dumps(value)
+
+
+def json_number(value):
+    return str(value)
+
+
+def json_decimal(value):
+    # amounts are exact decimal strings: clients read JSON numbers as floats, which round the cents
+    return '"{}"'.format(value)
+
+
+def json_boolean(value):
+    return 'true' if value else 'false'
+
+
+def json_datetime(value):
+    return '"{}Z"'.format(value.isoformat())
+
+
+def json_date(value):
+    return '"{}"'.format(value.isoformat())
+
+
+CONVERTERS = (
+    (types.Boolean, json_boolean),
+    (types.Integer, json_number),
+    (types.Numeric, json_decimal),
+    (types.DateTime, json_datetime),
+    (types.Date, json_date),
+)
+
+
+def converter_for(column_type):
+    for type_class, converter in CONVERTERS:
+        if isinstance(column_type, type_class):
+            return converter
+    return json_string
+
+
+class ModelSerializer(object):
+    class UnknownField(Exception):
+        pass
+
+    def __init__(self, model, fields=None, related=()):
+        self.model = model
+        self._subsets = {}
+        columns = [column for column in model.__table__.columns if fields is None or column.key in fields]
+        self.fields = tuple(column.key for column in columns)
+        self.columns = tuple(getattr(model, column.key) for column in columns)
+        self.plan = tuple(
+            ('"{}":'.format(snake_to_camel(column.key)), converter_for(column.type)) for column in columns
+        )
+        # (name, getter) of the values dump_instance reads through relationships, written with json.dumps
+        self.related_plan = tuple(('"{}":'.format(snake_to_camel(name)), getter) for name, getter in related)
+
+    def only(self, fields):
+        """
+        Serializer (and column list) restricted to `fields`, compiled once per distinct field set
+        """
+        fields = frozenset(fields)
+        unknown = fields - set(self.fields)
+        if unknown:
+            raise self.UnknownField(', '.join(sorted(unknown)))
+        if fields not in self._subsets:
+            self._subsets[fields] = ModelSerializer(self.model, fields=fields)
+        return self._subsets[fields]
+
+    def query(self):
+        return db.session.query(*self.columns)
+
+    def dump_row(self, row):
+        return '{' + ','.join(
+            key + ('null' if value is None else convert(value)) for (key, convert), value in zip(self.plan, row)
+        ) + '}'
+
+    def dump_instance(self, instance):
+        """
+        dump_row of an ORM instance, followed by its related values. The relationships are loaded by the caller.
+        """
+        related = ''.join(',' + key + json.dumps(getter(instance)) for key, getter in self.related_plan)
+        return self.dump_row([getattr(instance, field) for field in self.fields])[:-1] + related + '}'
+
+    def iter_json(self, rows, dump=None):
+        dump = dump or self.dump_row
+        yield '['
+        separator = ''
+        for row in rows:
+            yield separator + dump(row)
+            separator = ','
+        yield ']'
+
+    def iter_ndjson(self, rows):
+        for row in rows:
+            yield self.dump_row(row) + '\n'
+
+    def dumps(self, rows, dump=None):
+        return ''.join(self.iter_json(rows, dump))
+
+    def response(self, rows, status=200):
+        return Response(self.dumps(rows), status, content_type='application/json')
+
+    def page_response(self, rows, next_cursor, status=200, dump=None):
+        body = '{{"result":"success","data":{},"nextCursor":{}}}'.format(
+            self.dumps(rows, dump), 'null' if next_cursor is None else json_string(next_cursor))
+        return Response(body, status, content_type='application/json')
+
+    def instance_page_response(self, instances, next_cursor, status=200):
+        return self.page_response(instances, next_cursor, status, dump=self.dump_instance)
+
+    def item_response(self, row, status=200):
+        return Response(self.dump_row(row), status, content_type='application/json')
+
+
+user = ModelSerializer(models.User, fields=('id', 'name', 'email'))
+account = ModelSerializer(models.Account, fields=('id', 'user_id', 'name', 'account_type', 'balance', 'sum_on_dash'))
+transfer = ModelSerializer(models.Transfer, related=(
+    ('from_account_name', lambda transfer: transfer.source.name if transfer.source is not None else None),
+    ('to_account_name', lambda transfer: transfer.destination.name if transfer.destination is not None else None),
+))
+transaction = ModelSerializer(models.Transaction, fields=(
+    'id', 'account_id', 'category_id', 'value', 'description', 'observation', 'paid', 'transaction_type',
+    'date_created'
+), related=(
+    ('account_name', lambda transaction: transaction.account.name if transaction.account is not None else None),
+    ('category', lambda transaction: transaction.category.description if transaction.category is not None else None),
+    ('tags', lambda transaction: [tag.description for tag in transaction.tags]),
+))
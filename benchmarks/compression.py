@@ -0,0 +1,47 @@
+"""
+CPU cost against bytes saved when compressing typical account and transaction list responses.
+
+    $ python -m benchmarks.compression
+"""
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+from app import initialize, serializers, compression
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def account_rows(size):
+    return [(index, 1, 'Account {}'.format(index), 1, Decimal('1221.58'), True) for index in range(size)]
+
+
+def transaction_rows(size):
+    return [(index, 1, 3, Decimal('21.50'), 'Market', 'Weekly groceries', True, 2, datetime.utcnow())
+            for index in range(size)]
+
+
+def encodings():
+    yield 'gzip-1', 'gzip', {'level': 1}
+    yield 'gzip-6', 'gzip', {'level': 6}
+    yield 'gzip-9', 'gzip', {'level': 9}
+    if compression.brotli is not None:
+        yield 'br-4', 'br', {'brotli_quality': 4}
+        yield 'br-11', 'br', {'brotli_quality': 11}
+
+
+def main(repeat=10):
+    lists = (('accounts', serializers.account, account_rows), ('transactions', serializers.transaction, transaction_rows))
+    for name, serializer, builder in lists:
+        for size in SIZES:
+            data = serializer.dumps(builder(size)).encode('utf-8')
+            for title, encoding, options in encodings():
+                compressed = compression.compress(data, encoding, **options)
+                seconds = timeit.timeit(lambda: compression.compress(data, encoding, **options), number=repeat) / repeat
+                print('{:<13} {:>6} rows {:<7} {:>9} -> {:>8} bytes ({:>5.1f}%) {:>8.2f}ms'.format(
+                    name, size, title, len(data), len(compressed), 100.0 * len(compressed) / len(data),
+                    seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
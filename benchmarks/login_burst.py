@@ -0,0 +1,52 @@
+"""
+Measures healthcheck latency on a running api while a burst of logins is hashing passwords.
+
+    $ gunicorn -c gunicorn_conf.py app.initialize:web_app
+    $ python benchmarks/login_burst.py http://localhost:33366 user@mail.com user
+
+With the password hasher running inline, p99 during the burst grows with the hashing cost.
+With PASSWORD_HASH_WORKERS > 0 it should stay close to the baseline.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import sys
+import time
+
+import gevent
+import requests
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def poll_healthcheck(base_url, seconds):
+    samples = []
+    finish = time.time() + seconds
+    while time.time() < finish:
+        start = time.time()
+        requests.get('{}/api/healthcheck'.format(base_url))
+        samples.append((time.time() - start) * 1000)
+    return samples
+
+
+def login(base_url, username, password):
+    requests.post('{}/api/login'.format(base_url), data={'username': username, 'password': password})
+
+
+def report(title, samples):
+    print('{:<14} requests={:<6} p50={:.1f}ms p99={:.1f}ms'.format(
+        title, len(samples), percentile(samples, 0.5), percentile(samples, 0.99)))
+
+
+def main(base_url, username, password, logins=50, seconds=5):
+    report('baseline', poll_healthcheck(base_url, seconds))
+    burst = [gevent.spawn(login, base_url, username, password) for _ in range(logins)]
+    report('during burst', poll_healthcheck(base_url, seconds))
+    gevent.joinall(burst)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:4])
@@ -0,0 +1,75 @@
+"""
+Queries per request of the list endpoints, lazy loading against their eager loading strategies.
+
+    $ DATABASE_URL=sqlite:////tmp/finlife-bench.db python -m benchmarks.query_counts 100
+
+Seeds a user with N transactions (two tags each, over 10 categories) and N transfers between its accounts,
+then requests a page of 100 of each with the test client. Lazy loading costs a query per row and
+relationship; with the resources' loader_options a page costs a fixed handful (at most MAX_QUERIES, which
+tests/test_query_counts.py asserts).
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from app import initialize, models, domain, resources, database
+
+db = models.db
+MAX_QUERIES = 6
+ENDPOINTS = (
+    (resources.TransactionResource, '/api/transactions?limit=100'),
+    (resources.TransferResource, '/api/accounts/{account_id}/transfers?limit=100'),
+)
+
+
+def seed(size):
+    start = datetime(2018, 1, 1)
+    user = models.User.create_from_json({'email': 'bench-{}@finlife.com'.format(time.time()), 'password_hash': '-'})
+    accounts = models.Account.bulk_create_from_json([{'user_id': user.id, 'name': 'Bench {}'.format(index)}
+                                                     for index in range(2)])
+    categories = models.TransactionCategory.bulk_create_from_json(
+        [{'transaction_type': models.Transaction.EXPENSE, 'description': 'Category {}'.format(index)}
+         for index in range(10)])
+    tags = models.Tag.bulk_create_from_json([{'user_id': user.id, 'description': 'tag {}'.format(index)}
+                                             for index in range(20)])
+    transaction_ids = models.Transaction.bulk_create_from_json([
+        {'user_id': user.id, 'account_id': accounts[index % 2], 'category_id': categories[index % 10],
+         'value': Decimal('10.00'), 'paid': True, 'transaction_type': models.Transaction.EXPENSE,
+         'description': 'Bench', 'date_created': start + timedelta(hours=index)} for index in range(size)])
+    models.TransactionTag.bulk_create_from_json([
+        {'transaction_id': transaction_id, 'tag_id': tags[(index + offset) % 20]}
+        for index, transaction_id in enumerate(transaction_ids) for offset in (0, 1)])
+    models.Transfer.bulk_create_from_json([
+        {'from_account': accounts[0], 'to_account': accounts[1], 'amount': Decimal('5.00'),
+         'transfer_date': start + timedelta(hours=index)} for index in range(size)])
+    db.session.commit()
+    return user, accounts[0]
+
+
+def main(size=100):
+    app = initialize.web_app
+    with app.app_context():
+        db.create_all()
+        user, account_id = seed(size)
+        token = domain.User.create_with_id(user.id).generate_auth_token()
+        email = user.email
+    client = app.test_client()
+    client.set_cookie('localhost', 'baseUserToken', token.decode('ascii') if isinstance(token, bytes) else token)
+    client.set_cookie('localhost', 'baseUserName', email)
+    for resource, path in ENDPOINTS:
+        path = path.format(account_id=account_id)
+        eager = resource.loader_options
+        resource.loader_options = ()
+        with database.count_queries(app) as lazy_statements:
+            client.get(path)
+        resource.loader_options = eager
+        with database.count_queries(app) as statements:
+            response = client.get(path)
+        print('{:<50} status={} lazy={:<4} eager={}{}'.format(
+            path, response.status_code, len(lazy_statements), len(statements),
+            '' if len(statements) <= MAX_QUERIES else ' (over {})'.format(MAX_QUERIES)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,44 @@
+"""
+Compares the list response paths on 10k rows.
+
+    $ python -m benchmarks.serializers
+
+* to_dict: ORM instance -> to_dict -> ResourceBase.response -> json.dumps
+* compiled: row tuple -> ModelSerializer.dumps
+"""
+import json
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+from app import initialize, models, serializers
+from app.resources import ResourceBase
+
+ROWS = 10000
+
+
+def transaction_values(index):
+    return {'id': index, 'account_id': 1, 'category_id': 3, 'value': Decimal('21.50'), 'description': 'Market',
+            'observation': 'Weekly groceries', 'paid': True, 'transaction_type': 2,
+            'date_created': datetime.utcnow()}
+
+
+def main(repeat=5):
+    resource = ResourceBase.__new__(ResourceBase)
+    serializer = serializers.transaction
+    instances = [models.Transaction(**transaction_values(index)) for index in range(ROWS)]
+    rows = [tuple(transaction_values(index)[field] for field in serializer.fields) for index in range(ROWS)]
+
+    def to_dict_path():
+        return json.dumps([resource.response(instance.to_dict()) for instance in instances], default=str)
+
+    def compiled_path():
+        return serializer.dumps(rows)
+
+    for title, path in (('to_dict + transform_key', to_dict_path), ('compiled serializer', compiled_path)):
+        seconds = timeit.timeit(path, number=repeat) / repeat
+        print('{:<26} {} rows {:>8.1f}ms'.format(title, ROWS, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Microbenchmark of ResourceBase.transform_key on account and transaction lists.
+
+    $ python -m benchmarks.transform_key
+
+Compares the memoized key translation against calling the translation functions without the cache.
+"""
+import timeit
+from datetime import datetime
+
+from app import initialize
+from app.resources import ResourceBase
+
+
+def accounts(size):
+    return [{'id': index, 'user_id': 1, 'name': 'Account {}'.format(index), 'account_type': 1,
+             'balance': 1221.58, 'sum_on_dash': True} for index in range(size)]
+
+
+def transactions(size):
+    return [{'id': index, 'account_id': 1, 'category_id': 3, 'value': 21.5, 'description': 'Market',
+             'observation': '', 'paid': True, 'transaction_type': 2,
+             'date_created': datetime.utcnow().isoformat() + 'Z'} for index in range(size)]
+
+
+def run(title, rows, method, repeat=20):
+    resource = ResourceBase.__new__(ResourceBase)
+    seconds = timeit.timeit(lambda: resource.transform_key(rows, method), number=repeat) / repeat
+    print('{:<40} {:>8.2f}ms'.format(title, seconds * 1000))
+
+
+def main():
+    for name, builder in (('accounts', accounts), ('transactions', transactions)):
+        for size in (100, 1000, 10000):
+            cached = ResourceBase.snake_to_camel
+            run('{} {} cached'.format(size, name), builder(size), cached)
+            run('{} {} uncached'.format(size, name), builder(size), cached.__wrapped__)
+    print(ResourceBase.snake_to_camel.cache_info())
+
+
+if __name__ == '__main__':
+    main()
@@ -10,3 +10,17 @@ errorlog = '{}/error.log'.format(os.getenv('LOG_DIR'))
 loglevel = 'debug'
 capture_output = True
 worker_class = 'gevent'
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+
+def post_fork(server, worker):
+    # without the wait callback every query blocks the worker's event loop
+    from app import database
+    database.make_psycopg_green()
+
+
+def post_worker_init(worker):
+    # the upcoming monthly partitions (a no-op unless transaction is partitioned). Runs once gevent patched
+    # the worker, so the pool it opens is cooperative like the ones of the requests
+    from app import initialize, partitions
+    partitions.ensure_partitions_at_boot(initialize.web_app)
@@ -9,6 +9,65 @@ from app.models import *
 manager = Manager(initialize.web_app)
 
 
+@manager.option('-a', '--account', dest='account_id', type=int, required=True)
+@manager.option('-f', '--file', dest='path', required=True)
+@manager.option('--format', dest='statement_format', default=None)
+@manager.option('--date-format', dest='date_format', default=None)
+def import_statement(account_id, path, statement_format=None, date_format=None):
+    """Imports a CSV or OFX bank statement into an account"""
+    from app import domain
+    account = Account.query.get(account_id)
+    if account is None:
+        sys.exit('Account {} not found'.format(account_id))
+    statement_format = statement_format or path.rsplit('.', 1)[-1]
+    options = {'date_format': date_format} if date_format and statement_format.lower() == 'csv' else {}
+    with open(path, 'rb') as statement:
+        report = domain.Account.import_statement(account.id, account.user_id, statement, statement_format, **options)
+    db.session.commit()
+    print('{rows} rows ({skipped} already imported) in {seconds}s ({rows_per_second} rows/s)'.format(
+        **report.as_dict()))
+
+
+@manager.option('--fix', dest='fix', action='store_true', default=False)
+def verify_balances(fix=False):
+    """Recomputes every account balance from its ledger and reports the drift"""
+    drifts = Account.balance_drifts()
+    for account_id, stored, expected in drifts:
+        print('account {}: stored {} ledger {} drift {}'.format(account_id, stored, expected, stored - expected))
+    print('{} account(s) with drift'.format(len(drifts)))
+    if fix and drifts:
+        Account.fix_balances(drifts)
+        db.session.commit()
+        print('balances fixed')
+
+
+@manager.option('-a', '--account', dest='account_id', type=int, default=None)
+def snapshot_balances(account_id=None):
+    """Rebuilds the monthly balance snapshots of one account (default: all of them)"""
+    from app import ledger
+    accounts = ledger.rebuild_snapshots(account_id)
+    db.session.commit()
+    print('snapshots rebuilt for {} account(s)'.format(accounts))
+
+
+@manager.option('-u', '--user', dest='user_id', type=int, default=None)
+def rebuild_rollups(user_id=None):
+    """Recomputes the monthly transaction rollups of one user (default: all of them) from the ledger"""
+    from app import rollups
+    rows = rollups.rebuild(user_id)
+    db.session.commit()
+    print('{} rollup row(s) written'.format(rows))
+
+
+@manager.option('-m', '--months-ahead', dest='months_ahead', type=int, default=None)
+def create_partitions(months_ahead=None):
+    """Creates the upcoming monthly partitions of a partitioned transaction table (postgresql)"""
+    from app import partitions
+    names = partitions.ensure_partitions(months_ahead=months_ahead)
+    db.session.commit()
+    print('partitions ready: {}'.format(', '.join(names)) if names else 'transaction is not partitioned')
+
+
 def register_migrate(manager):
     migrate = Migrate(initialize.web_app, db)
     manager.add_command('db', MigrateCommand)
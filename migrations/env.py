@@ -18,6 +18,7 @@ logger = logging.getLogger('alembic.env')
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from flask import current_app
+from app import partitions
 config.set_main_option('sqlalchemy.url',
                        current_app.config.get('SQLALCHEMY_DATABASE_URI'))
 target_metadata = current_app.extensions['migrate'].db.metadata
@@ -65,14 +66,23 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # bookkeeping table of revision a1c4d2e9b705, not a model table, and the differences of a partitioned
+    # transaction table (revision 9c2e5b7d4a10) with the models
+    def include_object(object, name, type_, reflected, compare_to):
+        if type_ == 'table' and name == 'ledger_tables_created':
+            return False
+        return not (partitioned and partitions.changed_by_partitioning(object, name, type_, reflected, compare_to))
+
     engine = engine_from_config(config.get_section(config.config_ini_section),
                                 prefix='sqlalchemy.',
                                 poolclass=pool.NullPool)
 
     connection = engine.connect()
+    partitioned = partitions.is_partitioned(connection)
     context.configure(connection=connection,
                       target_metadata=target_metadata,
                       process_revision_directives=process_revision_directives,
+                      include_object=include_object,
                       **current_app.extensions['migrate'].configure_args)
 
     try:
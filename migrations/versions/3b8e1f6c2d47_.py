@@ -0,0 +1,30 @@
+"""add user data versions
+
+Revision ID: 3b8e1f6c2d47
+Revises: fa96c3ebd87a
+Create Date: 2026-10-18 10:12:41.118204
+
+Kept off the user row, so writes do not lock it. Users without a row are at version 0.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e1f6c2d47'
+down_revision = 'fa96c3ebd87a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_data_version',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_data_version')
@@ -0,0 +1,30 @@
+"""account balance snapshots
+
+Revision ID: 5d92c7a1e3f8
+Revises: a1c4d2e9b705
+Create Date: 2026-10-18 14:20:51.003912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d92c7a1e3f8'
+down_revision = 'a1c4d2e9b705'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('account_balance_snapshot',
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.DateTime(), nullable=False),
+    sa.Column('balance', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+    sa.PrimaryKeyConstraint('account_id', 'as_of')
+    )
+
+
+def downgrade():
+    op.drop_table('account_balance_snapshot')
@@ -0,0 +1,46 @@
+"""ledger access path indexes
+
+Revision ID: 7e4b0a9c1d23
+Revises: 5d92c7a1e3f8
+Create Date: 2026-10-18 15:41:07.662810
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4b0a9c1d23'
+down_revision = '5d92c7a1e3f8'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_account_user_id_created_at', 'account', ['user_id', 'created_at', 'id']),
+    ('ix_transfer_from_account_transfer_date', 'transfer', ['from_account', 'transfer_date']),
+    ('ix_transfer_to_account_transfer_date', 'transfer', ['to_account', 'transfer_date']),
+    ('ix_transaction_user_id_date_created', 'transaction', ['user_id', 'date_created']),
+    ('ix_transaction_category_id_date_created', 'transaction', ['category_id', 'date_created']),
+    ('ix_tag_user_id', 'tag', ['user_id']),
+    ('ix_transaction_tag_tag_id_transaction_id', 'transaction_tag', ['tag_id', 'transaction_id']),
+    ('ix_transaction_tag_transaction_id', 'transaction_tag', ['transaction_id']),
+)
+# covering index (postgresql 11+): balance and statement queries by account + date are answered from the index only
+COVERING_INDEX = ('CREATE INDEX ix_transaction_account_id_date_created ON "transaction" '
+                  '(account_id, date_created) INCLUDE (value, transaction_type, paid)')
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(COVERING_INDEX)
+    else:
+        op.create_index('ix_transaction_account_id_date_created', 'transaction', ['account_id', 'date_created'],
+                        unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_transaction_account_id_date_created', table_name='transaction')
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,84 @@
+"""optional monthly partitioning of transaction (postgresql)
+
+Revision ID: 9c2e5b7d4a10
+Revises: 7e4b0a9c1d23
+Create Date: 2026-10-18 17:05:33.271940
+
+Only runs on postgresql (11+) when TRANSACTION_PARTITIONING=1. `transaction` becomes a table partitioned
+by RANGE (date_created) with one partition per month, from the oldest row up to
+TRANSACTION_PARTITIONS_AHEAD months from now, plus a default partition.
+A partitioned table has no unique constraint on id alone, so transaction_tag loses its FK to it.
+"""
+import os
+from datetime import datetime
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2e5b7d4a10'
+down_revision = '7e4b0a9c1d23'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    'CREATE INDEX ix_transaction_id ON "transaction" (id)',
+    'CREATE INDEX ix_transaction_user_id_date_created ON "transaction" (user_id, date_created)',
+    'CREATE INDEX ix_transaction_account_id_date_created ON "transaction" (account_id, date_created) '
+    'INCLUDE (value, transaction_type, paid)',
+    'CREATE INDEX ix_transaction_category_id_date_created ON "transaction" (category_id, date_created)',
+)
+FOREIGN_KEYS = (
+    'ALTER TABLE "transaction" ADD FOREIGN KEY (account_id) REFERENCES account (id)',
+    'ALTER TABLE "transaction" ADD FOREIGN KEY (category_id) REFERENCES transaction_category (id)',
+    'ALTER TABLE "transaction" ADD FOREIGN KEY (user_id) REFERENCES "user" (id)',
+)
+
+
+def enabled():
+    return (op.get_bind().dialect.name == 'postgresql'
+            and os.environ.get('TRANSACTION_PARTITIONING', '').lower() in ('1', 'true'))
+
+
+def next_month(moment):
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+
+def upgrade():
+    if not enabled():
+        return
+    op.execute('ALTER TABLE "transaction" RENAME TO transaction_unpartitioned')
+    op.execute('ALTER TABLE transaction_tag DROP CONSTRAINT IF EXISTS transaction_tag_transaction_id_fkey')
+    op.execute('CREATE TABLE "transaction" (LIKE transaction_unpartitioned INCLUDING DEFAULTS) '
+               'PARTITION BY RANGE (date_created)')
+    op.execute('CREATE TABLE transaction_default PARTITION OF "transaction" DEFAULT')
+
+    oldest = op.get_bind().execute('SELECT min(date_created) FROM transaction_unpartitioned').scalar()
+    current = datetime((oldest or datetime.utcnow()).year, (oldest or datetime.utcnow()).month, 1)
+    last = datetime.utcnow()
+    for _ in range(int(os.environ.get('TRANSACTION_PARTITIONS_AHEAD', 3))):
+        last = next_month(last)
+    while current <= last:
+        op.execute('CREATE TABLE transaction_{:%Y_%m} PARTITION OF "transaction" FOR VALUES FROM (\'{}\') TO (\'{}\')'
+                   .format(current, current.isoformat(), next_month(current).isoformat()))
+        current = next_month(current)
+
+    op.execute('INSERT INTO "transaction" SELECT * FROM transaction_unpartitioned')
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    op.execute('DROP TABLE transaction_unpartitioned')
+    for statement in INDEXES + FOREIGN_KEYS:
+        op.execute(statement)
+
+
+def downgrade():
+    if not enabled():
+        return
+    op.execute('ALTER TABLE "transaction" RENAME TO transaction_partitioned')
+    op.execute('CREATE TABLE "transaction" (LIKE transaction_partitioned INCLUDING DEFAULTS)')
+    op.execute('INSERT INTO "transaction" SELECT * FROM transaction_partitioned')
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    op.execute('DROP TABLE transaction_partitioned CASCADE')
+    op.execute('ALTER TABLE "transaction" ADD PRIMARY KEY (id)')
+    for statement in INDEXES[1:] + FOREIGN_KEYS:
+        op.execute(statement)
+    op.execute('ALTER TABLE transaction_tag ADD FOREIGN KEY (transaction_id) REFERENCES "transaction" (id)')
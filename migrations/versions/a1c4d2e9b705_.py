@@ -0,0 +1,122 @@
+"""ledger tables
+
+Revision ID: a1c4d2e9b705
+Revises: 3b8e1f6c2d47
+Create Date: 2026-10-18 14:02:19.540377
+
+The ledger tables were only ever created with db.create_all, so they are created here when missing.
+The tables it created are recorded in ledger_tables_created, so the downgrade only drops those.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c4d2e9b705'
+down_revision = '3b8e1f6c2d47'
+branch_labels = None
+depends_on = None
+
+
+# in creation order
+LEDGER_TABLES = ('account_type', 'transaction_category', 'account', 'tag', 'transfer', 'transaction', 'transaction_tag')
+CREATED_TABLE = 'ledger_tables_created'
+
+
+def existing_tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    existing = existing_tables()
+    if 'account_type' not in existing:
+        op.create_table('account_type',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('description', sa.String(length=20), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_account_type_description'), 'account_type', ['description'], unique=False)
+    if 'transaction_category' not in existing:
+        op.create_table('transaction_category',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('transaction_type', sa.Integer(), nullable=True),
+        sa.Column('description', sa.String(length=50), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'account' not in existing:
+        op.create_table('account',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('account_type', sa.Integer(), nullable=True),
+        sa.Column('balance', sa.Numeric(precision=12, scale=2), nullable=True),
+        sa.Column('sum_on_dash', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['account_type'], ['account_type.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_account_name'), 'account', ['name'], unique=False)
+    if 'tag' not in existing:
+        op.create_table('tag',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('description', sa.String(length=50), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_tag_description'), 'tag', ['description'], unique=False)
+    if 'transfer' not in existing:
+        op.create_table('transfer',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('from_account', sa.Integer(), nullable=True),
+        sa.Column('to_account', sa.Integer(), nullable=True),
+        sa.Column('amount', sa.Numeric(precision=12, scale=2), nullable=True),
+        sa.Column('observation', sa.String(length=150), nullable=True),
+        sa.Column('transfer_date', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['from_account'], ['account.id'], ),
+        sa.ForeignKeyConstraint(['to_account'], ['account.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'transaction' not in existing:
+        op.create_table('transaction',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('account_id', sa.Integer(), nullable=True),
+        sa.Column('category_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('value', sa.Numeric(precision=12, scale=2), nullable=True),
+        sa.Column('description', sa.String(length=50), nullable=True),
+        sa.Column('observation', sa.String(length=200), nullable=True),
+        sa.Column('paid', sa.Boolean(), nullable=True),
+        sa.Column('transaction_type', sa.Integer(), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+        sa.ForeignKeyConstraint(['category_id'], ['transaction_category.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'transaction_tag' not in existing:
+        op.create_table('transaction_tag',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), nullable=True),
+        sa.Column('tag_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+        sa.ForeignKeyConstraint(['transaction_id'], ['transaction.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    created = op.create_table(CREATED_TABLE, sa.Column('name', sa.String(length=64), primary_key=True))
+    op.bulk_insert(created, [{'name': name} for name in LEDGER_TABLES if name not in existing])
+
+
+def downgrade():
+    if CREATED_TABLE not in existing_tables():
+        # upgraded before the created tables were recorded: they may predate this revision, keep them
+        return
+    created = set(name for name, in op.get_bind().execute(sa.text('SELECT name FROM {}'.format(CREATED_TABLE))))
+    indexes = {'tag': 'ix_tag_description', 'account': 'ix_account_name', 'account_type': 'ix_account_type_description'}
+    for name in reversed(LEDGER_TABLES):
+        if name in created:
+            if name in indexes:
+                op.drop_index(op.f(indexes[name]), table_name=name)
+            op.drop_table(name)
+    op.drop_table(CREATED_TABLE)
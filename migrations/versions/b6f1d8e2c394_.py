@@ -0,0 +1,36 @@
+"""monthly transaction rollups
+
+Revision ID: b6f1d8e2c394
+Revises: 9c2e5b7d4a10
+Create Date: 2026-10-18 18:42:07.518223
+
+Existing ledgers are rolled up with `manage.py rebuild_rollups` once this ran.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6f1d8e2c394'
+down_revision = '9c2e5b7d4a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('transaction_monthly_rollup',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('transaction_type', sa.Integer(), nullable=False),
+    sa.Column('month', sa.DateTime(), nullable=False),
+    sa.Column('total', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('paid_total', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'account_id', 'category_id', 'transaction_type', 'month')
+    )
+
+
+def downgrade():
+    op.drop_table('transaction_monthly_rollup')
@@ -0,0 +1,50 @@
+"""keyset date columns not null
+
+Revision ID: ee560b19fb34
+Revises: b6f1d8e2c394
+Create Date: 2026-10-18 21:14:52.307716
+
+account.created_at, transfer.transfer_date and transaction.date_created are the first keyset columns of their
+pages, where NULL never compares. Rows without one get the migration time, after every dated row, which is
+where they sorted before. Undated transactions and transfers were left out of the balance snapshots and the
+rollups: when this backfilled any, run `manage.py snapshot_balances` and `manage.py rebuild_rollups`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ee560b19fb34'
+down_revision = 'b6f1d8e2c394'
+branch_labels = None
+depends_on = None
+
+
+def utc_now():
+    """
+    The migration time in UTC, like the datetime.utcnow the model writes. CURRENT_TIMESTAMP is already UTC on
+    sqlite, but in the server time zone on postgresql
+    """
+    if op.get_bind().dialect.name == 'postgresql':
+        return "timezone('utc', now())"
+    return 'CURRENT_TIMESTAMP'
+
+
+KEYSET_COLUMNS = (
+    ('account', 'created_at'),
+    ('transfer', 'transfer_date'),
+    ('transaction', 'date_created'),
+)
+
+
+def upgrade():
+    for table, column in KEYSET_COLUMNS:
+        op.execute('UPDATE "{0}" SET {1} = {2} WHERE {1} IS NULL'.format(table, column, utc_now()))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(column, existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table, column in reversed(KEYSET_COLUMNS):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(column, existing_type=sa.DateTime(), nullable=True)
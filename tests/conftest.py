@@ -0,0 +1,84 @@
+import os
+import tempfile
+from decimal import Decimal
+
+import pytest
+from flask import g
+from flask.testing import FlaskClient
+
+os.environ.setdefault('APP_SETTINGS', 'app.config.SandboxConfig')
+os.environ.setdefault('API_TOKEN', 'test-token')
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'finlife-test.db')))
+
+from app import initialize, models, domain  # noqa: E402
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'postgresql: runs only when DATABASE_URL points to PostgreSQL')
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ['DATABASE_URL'].startswith('postgres'):
+        return
+    skip = pytest.mark.skip(reason='needs DATABASE_URL to point to PostgreSQL')
+    for item in items:
+        if 'postgresql' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def app():
+    with initialize.web_app.app_context():
+        models.db.create_all()
+        yield initialize.web_app
+        models.db.session.remove()
+        models.db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    return models.db
+
+
+@pytest.fixture
+def user(db):
+    user = models.User.create_from_json({'email': 'user@finlife.com', 'password_hash': '-', 'name': 'User'})
+    db.session.commit()
+    return user
+
+
+class Client(FlaskClient):
+    """
+    Requests of a test run in the app context of the `app` fixture: each one starts with an empty `g`,
+    as it would in its own app context
+    """
+
+    def open(self, *args, **kwargs):
+        for key in list(g):
+            g.pop(key)
+        return super(Client, self).open(*args, **kwargs)
+
+
+@pytest.fixture
+def client(app, user):
+    """
+    Test client logged in as `user`
+    """
+    client = Client(app, app.response_class, use_cookies=True)
+    client.set_cookie('localhost', 'baseUserToken', domain.User(user).generate_auth_token())
+    client.set_cookie('localhost', 'baseUserName', user.email)
+    yield client
+    domain.identity_cache.clear()
+
+
+@pytest.fixture
+def account(db, user):
+    account = models.Account.create_from_json({'user_id': user.id, 'name': 'Main'})
+    db.session.commit()
+    return account
+
+
+def expense(user, account, value='10.00', **values):
+    return dict({'user_id': user.id, 'account_id': account.id, 'value': Decimal(value), 'paid': True,
+                 'transaction_type': models.Transaction.EXPENSE, 'description': 'Expense'}, **values)
@@ -0,0 +1,28 @@
+"""
+Query count assertions for the endpoint tests
+"""
+
+from contextlib import contextmanager
+
+from app import database
+
+
+@contextmanager
+def assert_max_queries(maximum, app=None):
+    """
+    Fails with the statements when the block ran more than `maximum` queries
+    """
+    with database.count_queries(app) as statements:
+        yield statements
+    if len(statements) > maximum:
+        raise AssertionError('{} queries, expected at most {}:\n{}'.format(
+            len(statements), maximum, '\n'.join(statements)))
+
+
+def assert_endpoint_queries(client, path, maximum, method='get', **kwargs):
+    """
+    Requests `path` with a flask test client, failing when the endpoint ran more than `maximum` queries.
+    Returns the response.
+    """
+    with assert_max_queries(maximum, app=client.application):
+        return getattr(client, method)(path, **kwargs)
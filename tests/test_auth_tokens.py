@@ -0,0 +1,42 @@
+import time
+
+import jwt
+
+from app import domain, initialize
+
+
+def token_cookies(response):
+    return [header for header in response.headers.getlist('Set-Cookie') if header.startswith('baseUserToken=')]
+
+
+def login_with(client, token):
+    client.set_cookie('localhost', 'baseUserToken', token)
+    return client.get('/api/accounts')
+
+
+def test_a_fresh_token_is_not_signed_again(client):
+    response = client.get('/api/accounts')
+
+    assert response.status_code == 200
+    assert token_cookies(response) == []
+
+
+def test_a_token_inside_the_refresh_window_is_renewed(client, user):
+    config = initialize.config
+    # 60 minutes left out of TOKEN_EXPIRATION, inside the last TOKEN_REFRESH_WINDOW of its lifetime
+    assert 60 < config.TOKEN_EXPIRATION * config.TOKEN_REFRESH_WINDOW
+    response = login_with(client, domain.User(user).generate_auth_token(expiration=60))
+
+    assert response.status_code == 200
+    cookie, = token_cookies(response)
+    token = cookie.split(';')[0].split('=', 1)[1]
+    claims = jwt.decode(token, config.SECRET_KEY, algorithms=['HS256'])
+    assert claims['id'] == user.id
+    assert claims['exp'] > time.time() + config.TOKEN_EXPIRATION * 60 - 60
+
+
+def test_an_expired_token_is_refused(client, user):
+    response = login_with(client, domain.User(user).generate_auth_token(expiration=-1))
+
+    assert response.status_code == 401
+    assert token_cookies(response) == []
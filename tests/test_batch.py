@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+from app import models, resources
+
+
+def test_items_do_not_leak_their_etag_into_the_batch_response(client, account):
+    response = client.post('/api/batch', json={'requests': [{'method': 'GET', 'path': '/api/accounts'}]})
+    assert response.status_code == 200
+    assert response.get_json()['responses'][0]['status'] == 200
+    assert response.headers.get('ETag') is None
+    assert response.headers['Cache-Control'] == 'no-cache, no-store, must-revalidate'
+
+
+def test_item_raising_rolls_back_its_savepoint(client, account, monkeypatch):
+    def failing_get(self, **kwargs):
+        models.Account.create_from_json({'user_id': account.user_id, 'name': 'Half written'})
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(resources.AccountResource, 'get', failing_get)
+    response = client.post('/api/batch', json={'requests': [{'method': 'GET', 'path': '/api/accounts'}]})
+    assert response.status_code == 500
+    assert models.db.session().transaction.nested is False
+    assert [account.name for account in models.Account.query] == ['Main']
+
+
+def balance(account):
+    return models.db.session.query(models.Account.balance).filter_by(id=account.id).scalar()
+
+
+def post_batch(client, items, atomic=False):
+    response = client.post('/api/batch', json={'requests': items, 'atomic': atomic})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_write_batch_keeps_the_items_that_succeeded(client, user, account):
+    other_user = models.User.create_from_json({'email': 'other@finlife.com', 'password_hash': '-'})
+    foreign = models.Account.create_from_json({'user_id': other_user.id, 'name': 'Foreign'})
+    models.db.session.commit()
+
+    data = post_batch(client, [
+        {'method': 'POST', 'path': '/api/accounts', 'body': {'name': 'Savings', 'sumOnDash': False}},
+        {'method': 'PUT', 'path': '/api/accounts/{}'.format(account.id), 'body': {'name': 'Checking'}},
+        {'method': 'PUT', 'path': '/api/accounts/{}'.format(foreign.id), 'body': {'name': 'Mine now'}},
+        {'method': 'POST', 'path': '/api/transactions',
+         'body': {'accountId': account.id, 'value': '10.50', 'transactionType': models.Transaction.EXPENSE,
+                  'paid': True, 'description': 'Lunch', 'dateCreated': '2024-01-10T12:00:00Z'}},
+        {'method': 'POST', 'path': '/api/accounts/{}/transfers'.format(account.id),
+         'body': {'toAccount': foreign.id, 'amount': '5.00'}},
+    ])
+
+    assert [result['status'] for result in data['responses']] == [201, 200, 404, 201, 400]
+    assert (data['result'], data['committed']) == ('partial', True)
+    savings = data['responses'][0]['body']
+    assert (savings['name'], savings['sumOnDash']) == ('Savings', False)
+    assert data['responses'][3]['body']['dateCreated'] == '2024-01-10T12:00:00Z'
+    assert sorted(account.name for account in models.Account.query.filter_by(user_id=user.id)) == ['Checking', 'Savings']
+    assert models.Account.query.get(foreign.id).name == 'Foreign'
+    assert balance(account) == Decimal('-10.50')
+    assert models.Transfer.query.count() == 0
+
+
+def test_atomic_write_batch_rolls_back_every_item(client, user, account):
+    savings = models.Account.create_from_json({'user_id': user.id, 'name': 'Savings'})
+    models.db.session.commit()
+
+    data = post_batch(client, [
+        {'method': 'POST', 'path': '/api/accounts/{}/transfers'.format(account.id),
+         'body': {'toAccount': savings.id, 'amount': '5.00'}},
+        {'method': 'PUT', 'path': '/api/accounts/{}'.format(account.id), 'body': {'name': 'Checking'}},
+        {'method': 'POST', 'path': '/api/transactions', 'body': {'accountId': account.id, 'value': 'ten'}},
+        {'method': 'POST', 'path': '/api/accounts', 'body': {'name': 'Never'}},
+    ], atomic=True)
+
+    assert [result['status'] for result in data['responses']] == [201, 200, 400, 424]
+    assert (data['result'], data['committed']) == ('rolled-back', False)
+    assert sorted(account.name for account in models.Account.query) == ['Main', 'Savings']
+    assert models.Transfer.query.count() == 0
+    assert balance(account) in (None, 0)
+
+
+def test_atomic_write_batch_commits_when_every_item_succeeds(client, user, account):
+    data = post_batch(client, [
+        {'method': 'POST', 'path': '/api/accounts', 'body': {'name': 'Savings'}},
+        {'method': 'POST', 'path': '/api/transactions',
+         'body': {'accountId': account.id, 'value': 100, 'transactionType': models.Transaction.INCOME,
+                  'paid': True}},
+    ], atomic=True)
+
+    assert [result['status'] for result in data['responses']] == [201, 201]
+    assert (data['result'], data['committed']) == ('success', True)
+    assert balance(account) == Decimal('100.00')
+
+
+def test_batch_of_failed_writes_is_not_committed(client, account):
+    data = post_batch(client, [
+        {'method': 'POST', 'path': '/api/accounts', 'body': {}},
+        {'method': 'PUT', 'path': '/api/accounts/999', 'body': {'name': 'Nobody'}},
+    ])
+
+    assert [result['status'] for result in data['responses']] == [400, 404]
+    assert (data['result'], data['committed']) == ('rolled-back', False)
@@ -0,0 +1,20 @@
+from decimal import Decimal
+
+from app import models
+from tests.conftest import expense
+
+
+def test_bulk_rows_with_different_keys_keep_every_value(db, user, account):
+    category = models.TransactionCategory.create_from_json({'description': 'Food'})
+    ids = models.Transaction.bulk_create_from_json([
+        expense(user, account, '1.00'),
+        expense(user, account, '2.00', category_id=category.id),
+        expense(user, account, '3.00', paid=False),
+    ])
+    db.session.commit()
+
+    transactions = [models.Transaction.query.get(transaction_id) for transaction_id in ids]
+    assert [transaction.value for transaction in transactions] == [Decimal('1.00'), Decimal('2.00'), Decimal('3.00')]
+    assert [transaction.category_id for transaction in transactions] == [None, category.id, None]
+    assert [transaction.paid for transaction in transactions] == [True, True, False]
+    assert models.Account.query.get(account.id).balance == Decimal('-3.00')
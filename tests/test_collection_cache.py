@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+import pytest
+
+from app import cache, models
+
+
+@pytest.fixture
+def collection_cache(db, monkeypatch):
+    monkeypatch.setattr(models.collection_cache, 'store', cache.MemoryStore())
+    return models.collection_cache
+
+
+def transfer_ids():
+    return [row.id for row in models.Transfer.list_rows([models.Transfer.id])]
+
+
+def test_transfer_writes_invalidate_the_transfer_lists(db, collection_cache, user, account):
+    other = models.Account.create_from_json({'user_id': user.id, 'name': 'Other'})
+    db.session.commit()
+    assert transfer_ids() == []
+
+    # flushed by the commit, without save_db
+    transfer = models.Transfer(from_account=account.id, to_account=other.id, amount=Decimal('5.00'))
+    db.session.add(transfer)
+    db.session.commit()
+    assert transfer_ids() == [transfer.id]
+
+    db.session.delete(transfer)
+    db.session.commit()
+    assert transfer_ids() == []
+
+
+def test_rollback_invalidates_the_lists_cached_by_the_transaction(db, collection_cache, user, account):
+    other = models.Account.create_from_json({'user_id': user.id, 'name': 'Other'})
+    db.session.commit()
+    models.Transfer.create_from_json({'from_account': account.id, 'to_account': other.id, 'amount': Decimal('5.00')})
+    # cached with the uncommitted transfer
+    assert len(transfer_ids()) == 1
+
+    db.session.rollback()
+    assert transfer_ids() == []
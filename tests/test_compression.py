@@ -0,0 +1,63 @@
+import gzip
+import json
+import zlib
+
+import pytest
+
+from app import compression, models
+
+
+@pytest.fixture
+def accounts(db, user, account):
+    models.Account.bulk_create_from_json([{'user_id': user.id, 'name': 'Account {}'.format(index)}
+                                          for index in range(50)])
+    db.session.commit()
+
+
+def test_small_responses_are_not_compressed(client, account):
+    response = client.get('/api/accounts', headers={'Accept-Encoding': 'gzip'})
+
+    assert len(response.get_data()) < 1024
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_json_is_gzipped_when_accepted(client, accounts):
+    plain = client.get('/api/accounts?limit=100')
+    compressed = client.get('/api/accounts?limit=100', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert len(compressed.get_data()) < len(plain.get_data())
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+
+
+def test_refused_gzip_is_not_used(client, accounts):
+    response = client.get('/api/accounts?limit=100', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_streamed_responses_are_gzipped_chunk_by_chunk(client, accounts):
+    response = client.get('/api/accounts', headers={'Accept': 'application/x-ndjson', 'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+    assert len(lines) == 51
+    assert json.loads(lines[-1])['name'] == 'Account 49'
+
+
+def test_stream_compression_flushes_as_it_goes():
+    chunks = [b'x' * 1000 + b'\n'] * (2 * compression.STREAM_FLUSH_BYTES // 1000)
+    outputs = list(compression.iter_compressed(iter(chunks), 'gzip'))
+
+    # a sync flush every STREAM_FLUSH_BYTES of input, then the end of the stream
+    assert len([output for output in outputs if output]) >= 3
+    assert zlib.decompress(b''.join(outputs), compression.GZIP_WBITS) == b''.join(chunks)
+
+
+def test_gzip_is_chosen_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert compression.choose_encoding('br, gzip') == 'gzip'
+    assert compression.choose_encoding('br') is None
+    assert compression.choose_encoding('') is None
@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+from app import models
+from tests.conftest import expense
+
+
+def version(user_id):
+    return models.User.get_data_version(user_id)
+
+
+def test_writes_bump_the_version_once_per_commit(db, user, account):
+    before = version(user.id)
+    for value in ('1.00', '2.00', '3.00'):
+        models.Transaction.create_from_json(expense(user, account, value))
+    db.session.commit()
+    assert version(user.id) == before + 1
+    assert version(-1) is None
+
+
+def test_rolled_back_writes_do_not_bump_the_next_commit(db, user, account):
+    before = version(user.id)
+    models.Transaction.create_from_json(expense(user, account))
+    db.session.rollback()
+    db.session.commit()
+    assert version(user.id) == before
+
+
+def test_moving_a_transaction_bumps_both_owners(db, user, account):
+    other = models.User.create_from_json({'email': 'other@finlife.com', 'password_hash': '-'})
+    transaction = models.Transaction.create_from_json(expense(user, account))
+    db.session.commit()
+    versions = version(user.id), version(other.id)
+
+    # expired by the commit: the previous owner still has to be loaded
+    transaction.user_id = other.id
+    db.session.commit()
+    assert (version(user.id), version(other.id)) == (versions[0] + 1, versions[1] + 1)
+
+
+def test_moving_an_account_bumps_both_owners(db, user, account):
+    other = models.User.create_from_json({'email': 'other@finlife.com', 'password_hash': '-'})
+    db.session.commit()
+    versions = version(user.id), version(other.id)
+
+    account.user_id = other.id
+    db.session.commit()
+    assert (version(user.id), version(other.id)) == (versions[0] + 1, versions[1] + 1)
+
+
+def test_moving_a_transfer_bumps_the_previous_account_owner(db, user, account):
+    other = models.User.create_from_json({'email': 'other@finlife.com', 'password_hash': '-'})
+    db.session.flush()
+    mine = models.Account.create_from_json({'user_id': user.id, 'name': 'Savings'})
+    theirs = models.Account.create_from_json({'user_id': other.id, 'name': 'Theirs'})
+    transfer = models.Transfer.create_from_json({'from_account': account.id, 'to_account': mine.id,
+                                                 'amount': Decimal('1.00')})
+    db.session.commit()
+    versions = version(user.id), version(other.id)
+
+    transfer.from_account = theirs.id
+    transfer.to_account = theirs.id
+    db.session.commit()
+    assert (version(user.id), version(other.id)) == (versions[0] + 1, versions[1] + 1)
+
+
+def test_conditional_get_follows_the_version(client, db, user, account):
+    etag = client.get('/api/transactions').headers['ETag']
+    assert client.get('/api/transactions', headers={'If-None-Match': etag}).status_code == 304
+
+    models.Transaction.create_from_json(expense(user, account))
+    db.session.commit()
+    response = client.get('/api/transactions', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
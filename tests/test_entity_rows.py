@@ -0,0 +1,35 @@
+from decimal import Decimal
+
+import pytest
+
+from app import domain, models
+from tests.conftest import expense
+
+
+def test_rows_of_entities_without_a_name_column(db, user, account):
+    models.Transaction.bulk_create_from_json([expense(user, account, description='Rent')])
+    models.Transfer.bulk_create_from_json([{'from_account': account.id, 'to_account': account.id,
+                                            'amount': Decimal('5.00')}])
+    db.session.commit()
+
+    transaction, = domain.Transaction.list_all_rows()
+    transfer, = domain.Transfer.list_all_rows()
+
+    assert set(transaction.as_dict()) == set(domain.Transaction.row_fields)
+    assert transaction.as_dict()['description'] == 'Rent'
+    assert transaction.as_dict()['value'] == '10.00'
+    assert transfer.as_dict()['amount'] == '5.00'
+
+
+def test_rows_of_selected_fields(db, account):
+    row, = domain.Account.list_all_rows(fields=('id', 'name'))
+
+    assert row.as_dict() == {'id': account.id, 'name': 'Main'}
+
+
+def test_entity_without_row_fields(db):
+    class Category(domain.Entity):
+        repository = models.TransactionCategory
+
+    with pytest.raises(NotImplementedError):
+        Category.list_all_rows()
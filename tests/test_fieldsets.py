@@ -0,0 +1,33 @@
+from app import database
+
+
+def account_selects(statements):
+    return [statement for statement in statements if statement.startswith('SELECT') and 'FROM account' in statement]
+
+
+def test_fields_select_only_the_requested_columns(client, account):
+    with database.count_queries(client.application) as statements:
+        response = client.get('/api/accounts?fields=id,sumOnDash')
+
+    assert response.status_code == 200
+    assert [set(item) for item in response.get_json()['data']] == [set(['id', 'sumOnDash'])]
+    select, = account_selects(statements)
+    # plus the keyset column (created_at) the page is ordered by
+    columns = select[:select.index('FROM')]
+    assert 'account.sum_on_dash' in columns and 'account.balance' not in columns and 'account.name' not in columns
+
+
+def test_fields_of_a_single_account(client, account):
+    response = client.get('/api/accounts/{}?fields=name, balance'.format(account.id))
+
+    assert response.status_code == 200
+    assert response.get_json() == {'name': 'Main', 'balance': '0.00'}
+
+
+def test_unknown_fields_are_refused(client, account):
+    response = client.get('/api/accounts?fields=id,passwordHash')
+
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body['erro'] == 'Invalid fields.'
+    assert 'password_hash' in body['internalCode']
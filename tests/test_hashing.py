@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app import hashing
+
+ROUNDS = 1000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# verifies passwords in a gevent patched process while a greenlet ticks every 10ms: the ticks only go on
+# when the hashing does not block the event loop
+GEVENT_SCRIPT = '''
+from gevent import monkey
+monkey.patch_all()
+import gevent
+from app import hashing
+
+hasher = hashing.PasswordHasher(workers={workers}, concurrency=2, rounds=1000000)
+password_hash = hasher.encrypt('secret')
+ticks = []
+
+def tick():
+    while True:
+        ticks.append(1)
+        gevent.sleep(0.01)
+
+ticker = gevent.spawn(tick)
+gevent.sleep(0)
+jobs = [gevent.spawn(hasher.verify, 'secret', password_hash) for _ in range(2)]
+gevent.joinall(jobs, raise_error=True)
+ticker.kill()
+print(all(job.value for job in jobs), len(ticks))
+'''
+
+
+@pytest.fixture
+def pool_hasher():
+    hasher = hashing.PasswordHasher(workers=1, concurrency=1, rounds=ROUNDS, timeout=0.2)
+    yield hasher
+    hasher.executor.shutdown()
+
+
+def test_inline_hashing():
+    hasher = hashing.PasswordHasher(workers=0, rounds=ROUNDS)
+    password_hash = hasher.encrypt('secret')
+
+    assert hasher.executor is None
+    assert hasher.verify('secret', password_hash)
+    assert not hasher.verify('wrong', password_hash)
+
+
+def test_pool_hashing(pool_hasher):
+    password_hash = pool_hasher.encrypt('secret')
+
+    assert password_hash.startswith('$6$rounds={}$'.format(ROUNDS))
+    assert pool_hasher.verify('secret', password_hash)
+    assert not pool_hasher.verify('wrong', password_hash)
+
+
+def test_a_timed_out_operation_keeps_its_slot_until_it_ends(pool_hasher):
+    with pytest.raises(hashing.PasswordHasher.Busy):
+        pool_hasher._run(time.sleep, 1)
+    # the only slot is still taken by the sleep running in the pool
+    assert not pool_hasher._slots.acquire(blocking=False)
+
+    time.sleep(1.5)
+    assert pool_hasher._slots.acquire(blocking=False)
+    pool_hasher._slots.release()
+
+
+@pytest.mark.parametrize('workers, event_loop_runs', [(1, True), (0, False)])
+def test_pool_hashing_does_not_block_gevent(workers, event_loop_runs):
+    pytest.importorskip('gevent')
+    output = subprocess.check_output([sys.executable, '-c', GEVENT_SCRIPT.format(workers=workers)], cwd=ROOT,
+                                     timeout=120)
+    verified, ticks = output.decode('utf-8').split()
+
+    assert verified == 'True'
+    # a verify takes about half a second: inline, the ticker runs at most between the two of them
+    assert (int(ticks) > 5) == event_loop_runs
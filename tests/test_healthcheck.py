@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize('service', ['cache', 'pool', 'replicas'])
+def test_stats_need_the_api_token(app, client, service):
+    path = '/api/healthcheck/{}'.format(service)
+    # the logged user of `client` is not enough
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={'API-TOKEN': 'wrong'}).status_code == 401
+
+    response = client.get(path, headers={'API-TOKEN': os.environ['API_TOKEN']})
+    assert response.status_code == 200
+    assert response.get_json()['result'] == 'OK'
+
+
+def test_liveness_is_public(app):
+    assert app.test_client().get('/api/healthcheck').status_code == 200
@@ -0,0 +1,56 @@
+import pytest
+import redis
+
+from app import cache, domain, models
+
+
+class FailingStore(object):
+
+    def get(self, key):
+        raise redis.ConnectionError('down')
+
+    def incr(self, key, amount=1):
+        raise redis.ConnectionError('down')
+
+
+@pytest.fixture
+def store(db, monkeypatch):
+    store = cache.MemoryStore()
+    monkeypatch.setattr(models.identity_cache, 'store', store)
+    return store
+
+
+def test_update_drops_the_identity_cached_by_other_workers(db, store, user):
+    other_worker = cache.TTLCache(store=store, prefix=models.identity_cache.prefix)
+    other_worker.set(user.id, {'id': user.id, 'name': 'User'})
+    assert other_worker.get(user.id) is not None
+
+    domain.User(user).update_me({'name': 'Renamed'})
+    # reloaded by the other worker before the commit
+    other_worker.set(user.id, {'id': user.id, 'name': 'User'})
+    db.session.commit()
+
+    assert other_worker.get(user.id) is None
+
+
+def test_logged_user_sees_the_update_of_another_worker(db, store, client, user):
+    token = domain.User(user).generate_auth_token()
+    assert domain.User.create_with_token(token).name == 'User'
+
+    # another worker has its own cache, sharing only the store
+    other_worker = cache.TTLCache(store=store, prefix=models.identity_cache.prefix)
+    other_worker.invalidate(user.id)
+    user.name = 'Renamed'
+    db.session.commit()
+
+    assert domain.User.create_with_token(token).name == 'Renamed'
+
+
+def test_failing_store_is_a_miss(db):
+    identities = cache.TTLCache(store=FailingStore())
+    identities.set(1, {'id': 1})
+    identities.invalidate(1)
+
+    assert identities.get(1) is None
+    assert identities.stats()['errors'] == 3
+
@@ -0,0 +1,79 @@
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app import importers, models, rollups
+
+
+STATEMENT = (
+    'date;description;amount\n'
+    '2024-03-05;Bakery;-12,50\n'
+    '05/03/2024;Bakery;-12,50\n'
+    '06/03/2024;Salary;1.000,00\n'
+)
+
+
+def rollup_rows():
+    table = models.TransactionRollup.__table__
+    return sorted(tuple(row) for row in models.db.session.execute(table.select()))
+
+
+def test_csv_dates_are_iso_or_day_first():
+    records = list(importers.iter_csv_records(io.BytesIO(STATEMENT.encode('utf-8'))))
+    assert [record[0] for record in records] == [datetime(2024, 3, 5), datetime(2024, 3, 5), datetime(2024, 3, 6)]
+
+
+def test_csv_date_format():
+    assert importers.parse_csv_date('03/05/2024', '%m/%d/%Y') == datetime(2024, 3, 5)
+
+
+def test_importing_a_statement_again_skips_the_imported_rows(db, user, account):
+    def run():
+        importer = importers.StatementImporter(account.id, user.id, batch_size=2)
+        report = importer.run(io.BytesIO(STATEMENT.encode('utf-8')), 'csv')
+        db.session.commit()
+        return report
+
+    first = run()
+    # the statement repeats a row on purpose: both are real transactions
+    assert (first.rows, first.skipped) == (3, 0)
+    second = run()
+    assert (second.rows, second.skipped) == (0, 3)
+    assert models.Transaction.query.filter_by(account_id=account.id).count() == 3
+    assert models.Account.balance_drifts() == []
+
+
+def test_copy_csv_keeps_empty_strings_apart_from_nulls():
+    row = dict(zip(importers.IMPORT_COLUMNS, [1, 2, None, Decimal('12.50'), '', 'memo', True, 2,
+                                              datetime(2024, 3, 5)]))
+    line = importers.CsvRowStream([row]).read().decode('utf-8')
+    # the empty description must not be read as NULL by COPY ... NULL '\N'
+    assert line == '1,2,\\N,12.50,,memo,True,2,2024-03-05 00:00:00\r\n'
+
+
+def test_empty_descriptions_are_stored_as_empty_strings(db, user, account):
+    statement = 'date;description;amount\n2024-03-05;;-12,50\n'
+    importers.StatementImporter(account.id, user.id).run(io.BytesIO(statement.encode('utf-8')), 'csv')
+    db.session.commit()
+    assert db.session.query(models.Transaction.description).scalar() == ''
+
+
+@pytest.mark.postgresql
+def test_copy_load_applies_the_ledger_effects_once(db, user, account):
+    statement = STATEMENT + '2024-04-01;;-7,50\n2024-04-02;Bakery;-2,50\n'
+    importer = importers.StatementImporter(account.id, user.id, batch_size=2)
+    report = importer.run(io.BytesIO(statement.encode('utf-8')), 'csv')
+    db.session.commit()
+
+    assert (report.rows, report.skipped) == (5, 0)
+    assert db.session.query(models.Account.balance).filter_by(id=account.id).scalar() == Decimal('965.00')
+    assert models.Account.balance_drifts() == []
+    assert [(snapshot.as_of, snapshot.balance) for snapshot in models.BalanceSnapshot.query.order_by('as_of')] == [
+        (datetime(2024, 4, 1), Decimal('975.00')), (datetime(2024, 5, 1), Decimal('965.00'))]
+    maintained = rollup_rows()
+    rollups.rebuild(user.id)
+    assert rollup_rows() == maintained
+    descriptions = [description for description, in db.session.query(models.Transaction.description)]
+    assert '' in descriptions and None not in descriptions
@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+from app import models
+from tests.conftest import expense
+
+
+def balance(account_id):
+    return models.Account.query.get(account_id).balance
+
+
+def test_update_of_expired_transaction_reverts_its_previous_effect(db, user, account):
+    transaction = models.Transaction.create_from_json(expense(user, account))
+    db.session.commit()
+    assert balance(account.id) == Decimal('-10.00')
+
+    # the commit expired the instance: the previous values are not loaded when these are set
+    transaction.paid = False
+    db.session.commit()
+    assert balance(account.id) == Decimal('0.00')
+
+    transaction.paid = True
+    transaction.value = Decimal('4.00')
+    db.session.commit()
+    assert balance(account.id) == Decimal('-4.00')
+    assert models.Account.balance_drifts() == []
+
+
+def test_moving_an_expired_transaction_to_another_account(db, user, account):
+    other = models.Account.create_from_json({'user_id': user.id, 'name': 'Other'})
+    transaction = models.Transaction.create_from_json(expense(user, account))
+    db.session.commit()
+
+    transaction.account_id = other.id
+    db.session.commit()
+    assert balance(account.id) == Decimal('0.00')
+    assert balance(other.id) == Decimal('-10.00')
+
+
+def test_delete_of_expired_transfer(db, user, account):
+    other = models.Account.create_from_json({'user_id': user.id, 'name': 'Other'})
+    transfer = models.Transfer.create_from_json({'from_account': account.id, 'to_account': other.id,
+                                                 'amount': Decimal('3.00')})
+    db.session.commit()
+    transfer.delete_db()
+    db.session.commit()
+    assert balance(account.id) == Decimal('0.00')
+    assert balance(other.id) == Decimal('0.00')
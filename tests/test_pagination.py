@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+
+from app import models
+from tests.conftest import expense
+
+
+def test_account_created_at_is_never_null(db, user):
+    account = models.Account.create_from_json({'user_id': user.id, 'name': 'Main', 'created_at': None})
+    assert account.created_at is not None
+
+
+def test_ledger_dates_are_never_null(db, user, account):
+    transaction = models.Transaction.create_from_json(expense(user, account, date_created=None))
+    transfer = models.Transfer.create_from_json({'from_account': account.id, 'to_account': account.id,
+                                                 'amount': '1.00', 'transfer_date': None})
+    transaction_id, = models.Transaction.bulk_create_from_json([expense(user, account, date_created=None)])
+
+    assert transaction.date_created is not None
+    assert transfer.transfer_date is not None
+    assert models.Transaction.query.get(transaction_id).date_created is not None
+
+
+def test_account_pages_walk_every_account(client, user):
+    models.Account.bulk_create_from_json([{'user_id': user.id, 'name': 'Account {}'.format(index),
+                                           'created_at': datetime(2024, 1, 1 + index % 2)} for index in range(5)])
+    models.db.session.commit()
+    names, cursor = [], None
+    while True:
+        response = client.get('/api/accounts?limit=2' + ('&cursor=' + cursor if cursor else ''))
+        assert response.status_code == 200
+        names.extend(account['name'] for account in response.get_json()['data'])
+        cursor = response.get_json()['nextCursor']
+        if cursor is None:
+            break
+    assert sorted(names) == ['Account {}'.format(index) for index in range(5)]
+
+
+def test_transaction_pages_walk_every_transaction(client, user, account):
+    models.Transaction.bulk_create_from_json([expense(user, account, description='Expense {}'.format(index),
+                                                      date_created=datetime(2024, 1, 1 + index % 2))
+                                              for index in range(5)])
+    models.db.session.commit()
+    descriptions, cursor = [], None
+    while True:
+        response = client.get('/api/transactions?limit=2' + ('&cursor=' + cursor if cursor else ''))
+        assert response.status_code == 200
+        descriptions.extend(transaction['description'] for transaction in response.get_json()['data'])
+        cursor = response.get_json()['nextCursor']
+        if cursor is None:
+            break
+    assert sorted(descriptions) == ['Expense {}'.format(index) for index in range(5)]
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=many', 'cursor=not-a-cursor'])
+def test_invalid_pagination_is_a_bad_request(client, query):
+    for path in ('/api/accounts', '/api/transactions'):
+        response = client.get('{}?{}'.format(path, query))
+        assert response.status_code == 400
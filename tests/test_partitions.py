@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+
+from app import models, partitions
+from tests.conftest import expense
+
+
+@pytest.fixture
+def partitioned(db):
+    """
+    transaction partitioned like migration 9c2e5b7d4a10 does it, with the default partition only
+    """
+    connection = db.session.connection()
+    connection.execute('ALTER TABLE "transaction" RENAME TO transaction_unpartitioned')
+    connection.execute('CREATE TABLE "transaction" (LIKE transaction_unpartitioned INCLUDING DEFAULTS) '
+                       'PARTITION BY RANGE (date_created)')
+    connection.execute('CREATE TABLE transaction_default PARTITION OF "transaction" DEFAULT')
+    connection.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    connection.execute('DROP TABLE transaction_unpartitioned CASCADE')
+    return connection
+
+
+def rows_in(connection, table):
+    return connection.execute('SELECT count(*) FROM {}'.format(table)).scalar()
+
+
+def test_plain_tables_have_no_partitions(db):
+    assert partitions.ensure_partitions(months_ahead=1) == []
+
+
+def test_only_the_partitioning_differences_are_left_out_of_autogenerate():
+    foreign_key, = [key.constraint for key in models.TransactionTag.__table__.foreign_keys
+                    if key.column.table.name == 'transaction']
+    changed = partitions.changed_by_partitioning
+    assert changed(None, 'transaction_2024_03', 'table', True, None)
+    assert changed(None, 'transaction_default', 'table', True, None)
+    assert not changed(None, 'transaction_tag', 'table', True, None)
+    assert changed(None, 'ix_transaction_id', 'index', True, None)
+    assert changed(foreign_key, None, 'foreign_key_constraint', False, None)
+    assert not changed(foreign_key, None, 'foreign_key_constraint', False, foreign_key)
+
+
+@pytest.mark.postgresql
+def test_ensure_partitions_creates_the_missing_months(partitioned):
+    now = datetime.utcnow()
+    names = partitions.ensure_partitions(partitioned, months_ahead=2, first=datetime(now.year, now.month, 1))
+
+    assert len(names) == 3
+    assert names[0] == partitions.partition_name(datetime(now.year, now.month, 1))
+    assert all(partitions.partition_exists(partitioned, name) for name in names)
+    # again: nothing to create
+    assert partitions.ensure_partitions(partitioned, months_ahead=2) == names
+
+
+@pytest.mark.postgresql
+def test_a_late_partition_takes_over_its_rows(db, user, account, partitioned):
+    models.Transaction.create_from_json(expense(user, account, date_created=datetime(2030, 5, 10)))
+    models.Transaction.create_from_json(expense(user, account, date_created=datetime(2030, 6, 10)))
+    db.session.flush()
+    assert rows_in(partitioned, partitions.DEFAULT) == 2
+
+    partitions.create_partition(partitioned, datetime(2030, 5, 1))
+
+    assert rows_in(partitioned, 'transaction_2030_05') == 1
+    assert rows_in(partitioned, partitions.DEFAULT) == 1
+    assert rows_in(partitioned, '"transaction"') == 2
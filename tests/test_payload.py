@@ -0,0 +1,10 @@
+def test_a_request_parses_its_payload_once(client, account):
+    # limit, cursor, fields and stream are all read from the payload
+    response = client.get('/api/accounts?limit=10&fields=id,name')
+    assert response.status_code == 200
+    assert response.headers['X-Payload-Parses'] == '1'
+
+    response = client.post('/api/accounts', json={'name': 'Savings', 'sumOnDash': True})
+    assert response.status_code == 201
+    assert response.headers['X-Payload-Parses'] == '1'
+
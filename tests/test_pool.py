@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from app import database
+
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('pool.db')), poolclass=database.MeasuredQueuePool,
+                           pool_size=2, max_overflow=1, pool_timeout=0.1)
+    yield engine
+    engine.dispose()
+
+
+def test_pool_stats_follow_the_checkouts(engine):
+    pool = engine.pool
+    assert pool.stats()['checkouts'] == 0
+
+    connections = [engine.connect() for _ in range(3)]
+    stats = pool.stats()
+    assert (stats['size'], stats['capacity'], stats['checked_out'], stats['peak']) == (2, 3, 3, 3)
+    assert stats['saturation'] == 1.0
+    assert stats['checkouts'] == 3
+    assert stats['wait_ms'] >= 0 and stats['max_wait_ms'] >= stats['wait_ms']
+
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    assert pool.stats()['timeouts'] == 1
+    assert pool.stats()['max_wait_ms'] < 100
+
+    for connection in connections:
+        connection.close()
+    stats = pool.stats()
+    # the peak is kept once the connections are back
+    assert (stats['checked_out'], stats['peak'], stats['saturation']) == (0, 3, 0.0)
+
+
+def test_green_mode_is_off_without_the_wait_callback():
+    assert not database.green_mode()
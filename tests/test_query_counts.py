@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app import models
+from tests.conftest import expense
+from tests.queries import assert_endpoint_queries
+
+MAX_QUERIES = 6
+
+
+def seed(user, account, size):
+    other = models.Account.create_from_json({'user_id': user.id, 'name': 'Other'})
+    categories = models.TransactionCategory.bulk_create_from_json(
+        [{'transaction_type': models.Transaction.EXPENSE, 'description': 'Category {}'.format(index)}
+         for index in range(3)])
+    tags = models.Tag.bulk_create_from_json([{'user_id': user.id, 'description': 'tag {}'.format(index)}
+                                             for index in range(4)])
+    start = datetime(2024, 1, 1)
+    transaction_ids = models.Transaction.bulk_create_from_json([
+        expense(user, account, category_id=categories[index % 3], date_created=start + timedelta(hours=index))
+        for index in range(size)])
+    models.TransactionTag.bulk_create_from_json([
+        {'transaction_id': transaction_id, 'tag_id': tags[(index + offset) % 4]}
+        for index, transaction_id in enumerate(transaction_ids) for offset in (0, 1)])
+    models.Transfer.bulk_create_from_json([
+        {'from_account': account.id, 'to_account': other.id, 'amount': Decimal('5.00'),
+         'transfer_date': start + timedelta(hours=index)} for index in range(size)])
+    models.db.session.commit()
+
+
+@pytest.mark.parametrize('path', [
+    '/api/transactions?limit=50',
+    '/api/accounts/{account_id}/transfers?limit=50',
+    '/api/accounts?limit=50',
+])
+def test_list_endpoints_run_a_fixed_number_of_queries(client, user, account, path):
+    seed(user, account, 30)
+    response = assert_endpoint_queries(client, path.format(account_id=account.id), MAX_QUERIES)
+    assert response.status_code == 200
+    assert len(response.get_json()['data']) in (2, 30)
+
+
+def test_list_endpoints_write_relationships_and_exact_amounts(client, user, account):
+    seed(user, account, 1)
+
+    transaction, = client.get('/api/transactions').get_json()['data']
+    transfer, = client.get('/api/accounts/{}/transfers'.format(account.id)).get_json()['data']
+    balances = [item['balance'] for item in client.get('/api/accounts').get_json()['data']]
+
+    assert (transaction['value'], transaction['accountName'], transaction['category']) == ('10.00', 'Main', 'Category 0')
+    assert sorted(transaction['tags']) == ['tag 0', 'tag 1']
+    assert transaction['dateCreated'] == '2024-01-01T00:00:00Z'
+    assert (transfer['amount'], transfer['fromAccountName'], transfer['toAccountName']) == ('5.00', 'Main', 'Other')
+    assert balances == ['-15.00', '5.00']
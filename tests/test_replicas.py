@@ -0,0 +1,138 @@
+import shutil
+import time
+
+import pytest
+from sqlalchemy import event
+
+from app import database, initialize, models
+
+REPLICAS = ['replica_0', 'replica_1']
+
+
+@pytest.fixture
+def replicas(app, account, monkeypatch, tmpdir):
+    """
+    Two sqlite replicas copied from the seeded primary. Yields the statements each engine ran, by bind.
+    """
+    db = models.db
+    # loads the id before the session ends, the tests still need it
+    assert account.id
+    db.session.remove()
+    urls = {}
+    for bind in REPLICAS:
+        path = str(tmpdir.join('{}.db'.format(bind)))
+        shutil.copy(db.engine.url.database, path)
+        urls[bind] = 'sqlite:///{}'.format(path)
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', urls)
+    monkeypatch.setattr(initialize.config, 'REPLICA_BINDS', REPLICAS)
+    monkeypatch.setattr(db, 'router', database.ReplicaRouter(REPLICAS))
+
+    statements = {}
+    listeners = []
+    for bind in [None] + REPLICAS:
+        engine = db.get_engine(bind=bind)
+        statements[bind or 'primary'] = []
+        listeners.append((engine, record_into(statements[bind or 'primary'])))
+    for engine, record in listeners:
+        event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    db.session.remove()
+    for engine, record in listeners:
+        event.remove(engine, 'before_cursor_execute', record)
+    connectors = app.extensions['sqlalchemy'].connectors
+    for bind in REPLICAS:
+        connectors.pop(bind).get_engine().dispose()
+
+
+def record_into(statements):
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    return record
+
+
+def request(client, method, path, **kwargs):
+    """
+    Sends a request in a new session, as each request of a worker would
+    """
+    models.db.session.remove()
+    return getattr(client, method)(path, **kwargs)
+
+
+def clear(statements):
+    for ran in statements.values():
+        del ran[:]
+
+
+def test_reads_go_to_a_single_replica(client, account, replicas):
+    clear(replicas)
+    for _ in range(2):
+        assert request(client, 'get', '/api/accounts').status_code == 200
+        assert request(client, 'get', '/api/accounts/{}'.format(account.id)).status_code == 200
+
+    assert not [statement for statement in replicas['primary'] if 'account' in statement]
+    for bind in REPLICAS:
+        assert replicas[bind]
+    # each request reads from one replica and the next request takes the other one
+    assert len(replicas['replica_0']) == len(replicas['replica_1'])
+
+
+def test_a_session_keeps_its_replica(app, account, replicas):
+    database.read_from_replicas()
+    first = models.Account.query.get(account.id)
+    models.db.session.expire_all()
+    assert models.Account.query.count() == 1
+
+    assert first is not None
+    assert models.db.session.info['replica'] in REPLICAS
+    assert len([bind for bind in REPLICAS if replicas[bind]]) == 1
+
+
+def test_writes_go_to_the_primary_and_set_the_cookie(client, replicas):
+    clear(replicas)
+    response = request(client, 'post', '/api/accounts', json={'name': 'Savings'})
+
+    assert response.status_code == 201
+    assert any(statement.startswith('INSERT INTO account') for statement in replicas['primary'])
+    assert not replicas['replica_0'] and not replicas['replica_1']
+    cookie = [header for header in response.headers.getlist('Set-Cookie')
+              if header.startswith(database.PRIMARY_READS_COOKIE)]
+    assert cookie
+
+
+def test_reads_inside_the_cookie_window_go_to_the_primary(client, replicas):
+    client.set_cookie('localhost', database.PRIMARY_READS_COOKIE, str(int(time.time()) + 60))
+    clear(replicas)
+    assert request(client, 'get', '/api/accounts').status_code == 200
+    assert [statement for statement in replicas['primary'] if 'FROM account' in statement]
+    assert not replicas['replica_0'] and not replicas['replica_1']
+
+    # once the window is over the reads go back to the replicas
+    client.set_cookie('localhost', database.PRIMARY_READS_COOKIE, str(int(time.time()) - 1))
+    clear(replicas)
+    assert request(client, 'get', '/api/accounts').status_code == 200
+    assert replicas['replica_0'] or replicas['replica_1']
+
+
+def test_lagging_replicas_are_skipped(client, replicas, monkeypatch):
+    lags = {'replica_0': 60.0, 'replica_1': 0.0}
+    monkeypatch.setattr(models.db.router, 'lag', lambda db, bind: lags[bind])
+    clear(replicas)
+    for _ in range(3):
+        assert request(client, 'get', '/api/accounts').status_code == 200
+    assert not replicas['replica_0'] and replicas['replica_1']
+
+    # no replica in sync: the primary serves the reads
+    lags['replica_1'] = 60.0
+    clear(replicas)
+    assert request(client, 'get', '/api/accounts').status_code == 200
+    assert [statement for statement in replicas['primary'] if 'FROM account' in statement]
+    assert not replicas['replica_0'] and not replicas['replica_1']
+
+
+def test_unreachable_replicas_count_as_lagging(app, replicas, monkeypatch):
+    def unreachable(engine):
+        raise RuntimeError('connection refused')
+    monkeypatch.setattr(models.db.router, 'measure_lag', unreachable)
+
+    assert models.db.router.choose(models.db) is None
+    assert models.db.router.stats() == {bind: float('inf') for bind in REPLICAS}
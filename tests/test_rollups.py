@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from app import models, rollups
+from tests.conftest import expense
+
+
+def test_transactions_without_user_have_no_rollup(db, user, account):
+    models.Transaction.create_from_json(expense(user, account, user_id=None))
+    models.Transaction.bulk_create_from_json([expense(user, account, user_id=None)])
+    db.session.commit()
+    assert models.TransactionRollup.query.count() == 0
+
+
+def test_dashboard_amounts_are_exact(db, user, account):
+    moment = datetime(2024, 3, 5)
+    for value in ('0.10', '0.20', '1234567890.01'):
+        models.Transaction.create_from_json(expense(user, account, value, date_created=moment))
+    db.session.commit()
+
+    dashboard = rollups.dashboard(user.id, datetime(2024, 3, 1), datetime(2024, 3, 1))
+    assert dashboard['types'][0]['total'] == '1234567890.31'
+    assert dashboard['types'][0]['paid_total'] == '1234567890.31'
+    assert dashboard['dash_balance'] == '-1234567890.31'
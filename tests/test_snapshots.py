@@ -0,0 +1,82 @@
+from datetime import datetime
+from decimal import Decimal
+
+from app import ledger, models
+from tests.conftest import expense
+
+
+def snapshots(account_id):
+    return [(snapshot.as_of, snapshot.balance) for snapshot in
+            models.BalanceSnapshot.query.filter_by(account_id=account_id).order_by(models.BalanceSnapshot.as_of)]
+
+
+def test_writes_create_the_snapshot_of_their_period(db, user, account):
+    models.Transaction.create_from_json(expense(user, account, '10.00', date_created=datetime(2024, 1, 10)))
+    models.Transaction.create_from_json(expense(user, account, '5.00', date_created=datetime(2024, 3, 10)))
+    db.session.commit()
+    assert snapshots(account.id) == [(datetime(2024, 2, 1), Decimal('-10.00')),
+                                     (datetime(2024, 4, 1), Decimal('-15.00'))]
+
+    # back-dated into a month without snapshot
+    transaction = models.Transaction.create_from_json(expense(user, account, '1.00', date_created=datetime(2024, 2, 10)))
+    db.session.commit()
+    assert snapshots(account.id) == [(datetime(2024, 2, 1), Decimal('-10.00')),
+                                     (datetime(2024, 3, 1), Decimal('-11.00')),
+                                     (datetime(2024, 4, 1), Decimal('-16.00'))]
+
+    transaction.date_created = datetime(2023, 12, 10)
+    db.session.commit()
+    assert snapshots(account.id) == [(datetime(2024, 1, 1), Decimal('-1.00')),
+                                     (datetime(2024, 2, 1), Decimal('-11.00')),
+                                     (datetime(2024, 3, 1), Decimal('-11.00')),
+                                     (datetime(2024, 4, 1), Decimal('-16.00'))]
+    assert ledger.balance_at(account.id, datetime(2024, 3, 15)) == Decimal('-16.00')
+
+
+def test_bulk_writes_create_the_snapshots_once(db, user, account):
+    models.Transaction.bulk_create_from_json([
+        expense(user, account, '2.00', date_created=datetime(2024, 3, 10)),
+        expense(user, account, '3.00', date_created=datetime(2024, 1, 10)),
+    ])
+    db.session.commit()
+    assert snapshots(account.id) == [(datetime(2024, 2, 1), Decimal('-3.00')),
+                                     (datetime(2024, 4, 1), Decimal('-5.00'))]
+
+
+def test_rows_flushed_together_create_the_snapshot_once(db, user, account):
+    db.session.add(models.Transaction(**expense(user, account, '10.00', date_created=datetime(2024, 1, 10))))
+    db.session.add(models.Transaction(**expense(user, account, '5.00', date_created=datetime(2024, 1, 20))))
+    db.session.add(models.Transaction(**expense(user, account, '1.00', date_created=datetime(2024, 3, 10))))
+    db.session.commit()
+
+    assert snapshots(account.id) == [(datetime(2024, 2, 1), Decimal('-15.00')),
+                                     (datetime(2024, 4, 1), Decimal('-16.00'))]
+    assert models.Account.query.get(account.id).balance == Decimal('-16.00')
+
+
+def test_updates_and_inserts_flushed_together(db, user, account):
+    transaction = models.Transaction.create_from_json(expense(user, account, '10.00', date_created=datetime(2024, 1, 10)))
+    db.session.commit()
+
+    transaction.value = Decimal('4.00')
+    db.session.add(models.Transaction(**expense(user, account, '2.00', date_created=datetime(2024, 1, 20))))
+    db.session.add(models.Transaction(**expense(user, account, '3.00', date_created=datetime(2024, 2, 20))))
+    db.session.commit()
+
+    assert snapshots(account.id) == [(datetime(2024, 2, 1), Decimal('-6.00')),
+                                     (datetime(2024, 3, 1), Decimal('-9.00'))]
+    assert ledger.balance_at(account.id, datetime(2024, 3, 1)) == Decimal('-9.00')
+
+
+def test_balance_endpoint_writes_exact_amounts(db, client, user, account):
+    models.Transaction.bulk_create_from_json([
+        expense(user, account, '1234567890.10', date_created=datetime(2024, 1, 10)),
+        expense(user, account, '0.20', date_created=datetime(2024, 1, 11)),
+    ])
+    db.session.commit()
+    path = '/api/accounts/{}/balances'.format(account.id)
+
+    assert client.get(path + '?date=2024-01-10').get_json()['data'] == {'date': '2024-01-10',
+                                                                        'balance': '-1234567890.10'}
+    series = client.get(path + '?start=2024-01-09&end=2024-01-11').get_json()['data']
+    assert [day['balance'] for day in series] == ['0.00', '-1234567890.10', '-1234567890.30']
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from app import models
+
+
+@pytest.fixture
+def accounts(db, user, account):
+    models.Account.bulk_create_from_json([{'user_id': user.id, 'name': 'Account {}'.format(index)}
+                                          for index in range(3)])
+    db.session.commit()
+    return [account.name, 'Account 0', 'Account 1', 'Account 2']
+
+
+def test_ndjson_writes_one_account_per_line(client, accounts):
+    response = client.get('/api/accounts?fields=id,name', headers={'Accept': 'application/x-ndjson'})
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    body = response.get_data(as_text=True)
+    assert body.endswith('\n')
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [row['name'] for row in rows] == accounts
+    assert set(rows[0]) == set(['id', 'name'])
+
+
+def test_stream_param_writes_a_json_array(client, accounts):
+    response = client.get('/api/accounts?stream=1')
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/json'
+    assert [row['name'] for row in json.loads(response.get_data(as_text=True))] == accounts
+
+
+def test_collections_are_not_streamed_by_default(client, accounts):
+    body = client.get('/api/accounts').get_json()
+
+    assert 'nextCursor' in body
+    assert len(body['data']) == len(accounts)